@@ -1,10 +1,10 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, request
 from flask_socketio import SocketIO, emit
 import pyaudio
-import wave
-import os
+import numpy as np
 from faster_whisper import WhisperModel
 import threading
+from audio_ring import AudioRingBuffer
 
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*")
@@ -15,62 +15,194 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
 chunk_length = 1  # in seconds
+RING_SECONDS = 30  # Audio buffered per session while inference catches up
 
 # Initialize Whisper Model
 model_size = "medium.en"
 model = WhisperModel(model_size, device="cpu", compute_type="float32")
 # model = WhisperModel(model_size, device="cuda", compute_type="float32")
 
-is_recording = False
 p = pyaudio.PyAudio()
-stream = None
-
-def record_and_transcribe():
-    global is_recording, stream
-    stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=4096)
-    
-    while is_recording:
-        chunk_file = "temp_chunk.wav"
-        frames = []
-        
-        for _ in range(0, int(RATE / CHUNK * chunk_length)):
-            data = stream.read(CHUNK, exception_on_overflow=False)
-            frames.append(data)
-        
-        wf = wave.open(chunk_file, 'wb')
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(p.get_sample_size(FORMAT))
-        wf.setframerate(RATE)
-        wf.writeframes(b''.join(frames))
-        wf.close()
-
-        transcription = transcribe_chunk(chunk_file)
-        os.remove(chunk_file)
-
-        socketio.emit('transcription', {'text': transcription})
-
-def transcribe_chunk(file_path):
-    segments, _ = model.transcribe(file_path)
+
+#===================#
+# Sessions
+#===================#
+
+class TranscriptionSession:
+    """
+    One Socket.IO connection (one kiosk): its own audio source, ring buffer
+    and transcription results, which are emitted to its SID only.
+
+    The source is either a local input device opened in PyAudio callback mode
+    (`device_index`, None = default device) or audio pushed by the client as
+    16 kHz mono int16 PCM through `audio_chunk` events.
+    """
+
+    def __init__(self, sid, source='server', device_index=None):
+        self.sid = sid
+        self.source = source
+        self.device_index = device_index
+        self.ring = AudioRingBuffer(RATE * RING_SECONDS)
+        self.stream = None
+        self.recording = False
+        self.input_overflows = 0  # Callbacks where PortAudio reported lost input
+        self.chunks_transcribed = 0
+        # The ring buffer allows one writer at a time; Socket.IO may run two
+        # audio_chunk handlers for the same SID concurrently on worker threads
+        self._write_lock = threading.Lock()
+        self._odd_byte = b""  # Half a sample from a client chunk of odd length
+
+    def start(self):
+        self.recording = True
+        if self.source == 'server':
+            self.stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
+                                 input_device_index=self.device_index,
+                                 frames_per_buffer=CHUNK, stream_callback=self._capture_callback)
+            self.stream.start_stream()
+
+    def stop(self):
+        self.recording = False
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        scheduler.wake()
+
+    def _capture_callback(self, in_data, frame_count, time_info, status_flags):
+        # Runs on PortAudio's capture thread: only copies samples into the ring buffer
+        if status_flags & pyaudio.paInputOverflow:
+            self.input_overflows += 1
+        self.push_audio(in_data)
+        return (None, pyaudio.paContinue)
+
+    def push_audio(self, pcm_bytes):
+        with self._write_lock:
+            data = self._odd_byte + bytes(pcm_bytes)
+            usable = len(data) - len(data) % 2
+            self._odd_byte = data[usable:]
+            self.ring.write(np.frombuffer(data[:usable], dtype=np.int16))
+        if self.ring.available() >= RATE * chunk_length:
+            scheduler.wake()
+
+    def next_chunk(self):
+        """A full chunk if one is buffered; once stopped, the partial remainder"""
+        samples = self.ring.read(int(RATE * chunk_length), timeout=0)
+        if samples is None and not self.recording:
+            samples = self.ring.drain()
+        return samples if samples is not None and len(samples) else None
+
+    def stats(self):
+        stats = self.ring.stats()
+        stats['input_overflows'] = self.input_overflows
+        stats['backlog_seconds'] = round(stats['buffered_samples'] / RATE, 2)
+        stats['chunks_transcribed'] = self.chunks_transcribed
+        stats['active_sessions'] = len(sessions)
+        return stats
+
+sessions = {}  # sid -> TranscriptionSession
+sessions_lock = threading.Lock()
+
+#===================#
+# Shared model scheduler
+#===================#
+
+class ModelScheduler:
+    """
+    Single worker that owns the model. It visits sessions round-robin and
+    transcribes at most one chunk per session per round, so a busy kiosk
+    can't starve the others.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            with sessions_lock:
+                active = list(sessions.values())
+
+            did_work = False
+            for session in active:
+                samples = session.next_chunk()
+                if samples is None:
+                    continue
+                did_work = True
+                transcription = transcribe_chunk(samples)
+                session.chunks_transcribed += 1
+                socketio.emit('transcription', {'text': transcription, 'stats': session.stats()},
+                              to=session.sid)
+
+            if not did_work:
+                self._wake.wait(0.5)
+
+scheduler = ModelScheduler()
+
+def transcribe_chunk(samples):
+    # faster_whisper takes 16 kHz float32 arrays directly; no temp WAV file
+    audio = samples.astype(np.float32) / 32768.0
+    segments, _ = model.transcribe(audio)
     return " ".join(segment.text for segment in segments)
 
+def close_session(sid):
+    with sessions_lock:
+        session = sessions.pop(sid, None)
+    if session:
+        session.stop()
+
 @app.route('/')
 def index():
     return render_template('index12.html')
 
 @socketio.on('start_listening')
-def start_listening():
-    global is_recording
-    if not is_recording:
-        is_recording = True
-        threading.Thread(target=record_and_transcribe, daemon=True).start()
+def start_listening(data=None):
+    data = data or {}
+    sid = request.sid
+    with sessions_lock:
+        session = sessions.get(sid)
+        if session is None:
+            session = sessions[sid] = TranscriptionSession(sid)
+        elif session.recording:
+            return
+
+    # A restarted session keeps its buffer, so audio still queued from before isn't lost
+    session.source = data.get('source', 'server')
+    session.device_index = data.get('device_index')
+    try:
+        session.start()
+    except Exception as e:
+        session.recording = False
+        emit('error', {'message': f"Could not open audio source: {str(e)}"})
+        return
+    print(f"[Sessions] {sid} started ({session.source}), {len(sessions)} active")
+
+@socketio.on('audio_chunk')
+def audio_chunk(data):
+    session = sessions.get(request.sid)
+    if session is not None and session.recording and session.source == 'client':
+        session.push_audio(data)
 
 @socketio.on('stop_listening')
 def stop_listening():
-    global is_recording, stream
-    is_recording = False
-    if stream:
-        stream.stop_stream()
-        stream.close()
+    session = sessions.get(request.sid)
+    if session:
+        # The scheduler still transcribes what's buffered
+        session.stop()
+
+@socketio.on('get_stats')
+def get_stats():
+    session = sessions.get(request.sid)
+    if session is not None:
+        emit('audio_stats', session.stats())
+
+@socketio.on('disconnect')
+def disconnect():
+    close_session(request.sid)
+    print(f"[Sessions] {request.sid} disconnected, {len(sessions)} active")
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
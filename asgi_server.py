@@ -0,0 +1,633 @@
+# asgi_server.py
+# Single-process ASGI (Starlette + uvicorn) mode of the transcription service.
+# /transcribe, /analyse, /status and the streaming WebSocket share one event
+# loop and one port, with the same request/response and wire formats as
+# transcriber_server_multiple_users.py and transcriber_new_1.py. All model
+# work goes through one InferenceScheduler thread; streaming chunks are served
+# ahead of uploaded files. SIGINT/SIGTERM drain live sessions before exiting.
+#
+#   python asgi_server.py
+#   ws://host:8080/   POST http://host:8080/transcribe   ...
+
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import numpy as np
+import uvicorn
+from faster_whisper import WhisperModel
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from audio_codec import SUPPORTED_CODECS, CodecError, StreamDecoder, create_decoder, negotiate
+from llm_backends import GeminiBackend, create_router
+from medical_analysis import analyze_medical_conversation
+from session_recorder import open_recorder
+from single_flight import SingleFlight, content_key
+from stream_protocol import (PROTOCOL_VERSION, REJECT_HELLO_WAIT_S, ProtocolError, decode_audio_frame,
+                             rejection_message, requested_protocol, server_message, transcript_message)
+
+# Configuration
+HOST = '0.0.0.0'
+PORT = int(os.environ.get('ASGI_PORT', '8080'))  # HTTP and WebSocket
+UDS = os.environ.get('ASGI_UDS')  # Listen on this unix socket instead (worker behind session_dispatcher.py)
+MODEL_SIZE = "medium.en"
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+CHUNK_DURATION_MS = 1000
+MAX_USERS = int(os.environ.get('MAX_USERS', '5'))  # Concurrent streaming sessions
+MIN_FLUSH_MS = 300  # Shorter leftovers at speech_end wait for the next utterance (too short to transcribe)
+MAX_QUEUED_UPLOADS = int(os.environ.get('MAX_QUEUED_UPLOADS', '8'))  # Files waiting for the model; 503 beyond
+SHUTDOWN_GRACE_S = float(os.environ.get('SHUTDOWN_GRACE_S', '15'))  # Time to finish in-flight chunks on exit
+
+print(f"Initializing Whisper model: {MODEL_SIZE}")
+model = WhisperModel(MODEL_SIZE, device="cuda", compute_type="float16")
+print("Model loaded successfully!")
+
+# Analysis goes through the LLM router; Gemini when GEMINI_API_KEY is set,
+# Azure from its environment variables, or LLM_BACKEND=mock. With none of
+# them, /analyse answers 503 and everything else runs as usual.
+llm_backends = []
+if os.environ.get('GEMINI_API_KEY'):
+    import google.generativeai as genai
+    genai.configure(api_key=os.environ['GEMINI_API_KEY'])
+    llm_backends.append(GeminiBackend(genai.GenerativeModel('gemini-1.5-flash')))
+try:
+    llm = create_router(llm_backends)
+except ValueError as e:
+    print(f"[LLM Router] Analysis disabled: {str(e)}")
+    llm = None
+analyse_flight = SingleFlight("Analyse")
+
+#===================#
+# Inference Scheduler
+#===================#
+
+STREAM_PRIORITY = 0
+UPLOAD_PRIORITY = 1
+_STOP_PRIORITY = 2  # Queued behind everything else, so close() finishes queued work first
+
+class InferenceScheduler:
+    """
+    The only code that touches the model. One worker thread takes jobs from a
+    priority queue: streaming chunks first, then uploaded files, FIFO within
+    each class. Callers await an asyncio future resolved by the worker.
+    Identical uploads in flight share one job.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._uploads_in_flight = {}  # content key -> future
+        self.queued = {STREAM_PRIORITY: 0, UPLOAD_PRIORITY: 0}
+        self._queued_lock = threading.Lock()
+        self.jobs_done = 0
+        self.busy_seconds = 0.0
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    async def transcribe_chunk(self, pcm):
+        """Transcribe 16 kHz PCM16 from a stream. Returns (segments, info, queue_s, inference_s)."""
+        # faster_whisper takes 16 kHz float32 arrays directly; no temp WAV file
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        return await self._submit(STREAM_PRIORITY, audio)
+
+    async def transcribe_file(self, audio_bytes):
+        """Transcribe an uploaded audio file. Returns ((segments, info, queue_s, inference_s), shared)."""
+        key = content_key('transcribe', audio_bytes)
+        future = self._uploads_in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = asyncio.ensure_future(self._submit(UPLOAD_PRIORITY, io.BytesIO(audio_bytes)))
+        self._uploads_in_flight[key] = future
+        future.add_done_callback(lambda _: self._uploads_in_flight.pop(key, None))
+        return await asyncio.shield(future), False
+
+    async def _submit(self, priority, audio):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._queued_lock:
+            self.queued[priority] += 1
+        self._queue.put((priority, next(self._order), (audio, loop, future, time.time())))
+        return await future
+
+    def _run(self):
+        while True:
+            priority, _, job = self._queue.get()
+            if job is None:
+                break
+            audio, loop, future, queued_at = job
+            with self._queued_lock:
+                self.queued[priority] -= 1
+            start = time.time()
+            try:
+                segments, info = self.model.transcribe(audio, language="en")
+                # Segments are decoded lazily; consume them on this thread
+                segments = [(segment.start, segment.end, segment.text) for segment in segments]
+                result = (segments, info, start - queued_at, time.time() - start)
+                loop.call_soon_threadsafe(_resolve, future, result, None)
+            except Exception as e:
+                loop.call_soon_threadsafe(_resolve, future, None, e)
+            self.busy_seconds += time.time() - start
+            self.jobs_done += 1
+
+    def stats(self):
+        return {
+            'queued_stream_chunks': self.queued[STREAM_PRIORITY],
+            'queued_uploads': self.queued[UPLOAD_PRIORITY],
+            'jobs_done': self.jobs_done,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'busy_fraction': round(self.busy_seconds / (time.time() - self.started), 3),
+            'avg_inference_ms': round(self.busy_seconds * 1000 / self.jobs_done, 1) if self.jobs_done else None
+        }
+
+    async def close(self, timeout):
+        """Finish the queued jobs (up to `timeout` seconds) and stop the worker"""
+        self._queue.put((_STOP_PRIORITY, next(self._order), None))
+        await asyncio.to_thread(self._thread.join, timeout)
+
+def _resolve(future, result, error):
+    if future.done():  # Caller went away
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+scheduler = InferenceScheduler(model)
+
+#=========================#
+# WebSocket Section
+#=========================#
+
+sessions = {}  # session id -> StreamSession; only touched on the event loop, so no lock
+draining = False
+server_start_time = time.time()
+
+class StreamSession:
+    """
+    One streaming client. Same protocol as transcriber_server_multiple_users.py:
+    optional JSON hello (codec, capture format, protocol 1), binary audio,
+    speech_start / speech_end markers, transcripts back as text.
+    """
+
+    def __init__(self, websocket):
+        self.id = str(uuid.uuid4())
+        self.websocket = websocket
+        self.address = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else None
+        if UDS:
+            # Behind session_dispatcher.py, which passes the real client address
+            self.address = websocket.headers.get('x-forwarded-for', self.address)
+        self.connected_at = time.time()
+        self.last_activity = self.connected_at
+        self.decoder = None  # Chosen by the hello message; raw PCM if audio arrives first
+        self.protocol = 0
+        self.in_speech = False
+        self.utterances = 0
+        self.next_seq = 0
+        self.frames_lost = 0
+        self.stream_samples = 0
+        self.audio_buffer = b''
+        self.chunk = None
+        self.in_flight = 0  # Chunks dispatched whose results haven't been sent yet
+        self.closed = False
+
+    async def send(self, text):
+        if not self.closed:
+            await self.websocket.send_text(text)
+
+    async def send_error(self, message):
+        if self.protocol:
+            await self.send(server_message('error', message=message))
+        else:
+            await self.send(f"ERROR: {message}")
+
+    async def send_greeting(self):
+        """Session confirmation, once the protocol is known: a status message for protocol 1, text otherwise"""
+        if self.protocol:
+            await self.send(server_message('status', message='connected', session_id=self.id))
+        else:
+            await self.send(f"Connected to transcription service. Your session ID: {self.id}")
+
+    async def handle_audio(self, message, received_at):
+        if self.decoder is None:
+            # No hello: a protocol-0 client sending raw PCM
+            self.decoder = StreamDecoder()
+            await self.send_greeting()
+        try:
+            header = None
+            if self.protocol:
+                header, message = decode_audio_frame(message)
+                self.check_frame(header)
+            pcm = self.decoder.decode(message)
+        except (ProtocolError, CodecError) as e:
+            print(f"[WebSocket] Client {self.id}: {str(e)}")
+            await self.send_error(str(e))
+            return
+
+        self.last_activity = received_at
+        self.audio_buffer += pcm
+        self.track_chunk(header, received_at)
+        self.dispatch()
+
+    def check_frame(self, header):
+        """Validate a protocol-1 frame header and count frames lost before it"""
+        if header.codec != self.decoder.codec:
+            raise ProtocolError(f"Frame codec {header.codec} doesn't match negotiated {self.decoder.codec}")
+        if header.sample_rate != self.decoder.sample_rate:
+            raise ProtocolError(f"Frame sample rate {header.sample_rate} doesn't match declared "
+                                f"{self.decoder.sample_rate}")
+        if header.seq > self.next_seq:
+            self.frames_lost += header.seq - self.next_seq
+        self.next_seq = max(self.next_seq, header.seq + 1)
+
+    def track_chunk(self, header, received_at):
+        """Remember when (and, with protocol 1, which frames) the buffered audio arrived"""
+        if self.chunk is None:
+            self.chunk = {'first_received': received_at, 'first_seq': None, 'last_seq': None, 'capture_us': None}
+        if header is not None:
+            if self.chunk['first_seq'] is None:
+                self.chunk['first_seq'] = header.seq
+            self.chunk['last_seq'] = header.seq
+            self.chunk['capture_us'] = header.capture_us
+
+    def dispatch(self, flush=False):
+        """
+        Start transcribing the buffer once it holds a full chunk, or whatever
+        it holds when `flush` is set (end of an utterance, shutdown).
+        """
+        min_bytes = MIN_FLUSH_MS * SAMPLE_RATE * SAMPLE_WIDTH / 1000 if flush else \
+            SAMPLE_RATE * SAMPLE_WIDTH * CHUNK_DURATION_MS / 1000
+        if not self.audio_buffer or len(self.audio_buffer) < min_bytes:
+            return
+
+        chunk = self.chunk or {}
+        chunk['dispatched'] = time.time()
+        chunk['offset_s'] = self.stream_samples / SAMPLE_RATE
+        chunk['final'] = flush or not self.in_speech
+        self.stream_samples += len(self.audio_buffer) // SAMPLE_WIDTH
+
+        self.in_flight += 1
+        asyncio.create_task(self.process_audio(self.audio_buffer, chunk))
+        self.audio_buffer = b''
+        self.chunk = None
+
+    async def process_audio(self, audio_buffer, chunk):
+        try:
+            segments, _, queue_s, inference_s = await scheduler.transcribe_chunk(audio_buffer)
+            transcription = " ".join(text for _, _, text in segments)
+            print(f"[WebSocket] Client {self.id}: {transcription}")
+
+            if not self.protocol:
+                if transcription.strip():
+                    await self.send(transcription)
+                return
+
+            sent_at = time.time()
+            offset = chunk['offset_s']
+            await self.send(transcript_message(
+                text=transcription.strip(),
+                final=chunk['final'],
+                segments=[(offset + start, offset + end, text.strip()) for start, end, text in segments],
+                seq_range=(chunk['first_seq'], chunk['last_seq']) if chunk.get('first_seq') is not None else None,
+                capture_us=chunk.get('capture_us'),
+                frames_lost=self.frames_lost,
+                latency_ms={
+                    'buffering': (chunk['dispatched'] - chunk['first_received']) * 1000,
+                    'queue': queue_s * 1000,
+                    'inference': inference_s * 1000,
+                    'server_total': (sent_at - chunk['first_received']) * 1000
+                },
+                audio_ms=len(audio_buffer) / SAMPLE_WIDTH / SAMPLE_RATE * 1000
+            ))
+        except Exception as e:
+            print(f"Error processing audio for client {self.id}: {str(e)}")
+        finally:
+            self.in_flight -= 1
+
+    async def handle_control_message(self, message):
+        """
+        Handle a JSON control message:
+          hello         picks the audio codec, capture format and protocol:
+                        {"type": "hello", "codecs": ["opus", "pcm16"], "sample_rate": 48000, "protocol": 1}
+          speech_start  the client's VAD detected speech; audio follows
+          speech_end    the utterance is over; transcribe what's buffered now
+          keepalive     sent by VAD clients during silence; refreshes last_activity
+        """
+        try:
+            control = json.loads(message)
+        except ValueError:
+            await self.send_error("Expected a JSON control message")
+            return
+
+        message_type = control.get('type')
+        if message_type == 'keepalive':
+            self.last_activity = time.time()
+            return
+        if message_type == 'speech_start':
+            self.in_speech = True
+            self.last_activity = time.time()
+            return
+        if message_type == 'speech_end':
+            self.in_speech = False
+            self.utterances += 1
+            self.last_activity = time.time()
+            self.dispatch(flush=True)
+            return
+
+        if message_type != 'hello':
+            await self.send_error(f"Unknown control message: {message_type}")
+            return
+        if self.decoder is not None:
+            await self.send_error("Codec already chosen; send hello before any audio")
+            return
+
+        codec = negotiate(control.get('codecs'))
+        input_rate = control.get('sample_rate', SAMPLE_RATE)
+        input_channels = control.get('channels', CHANNELS)
+        try:
+            self.decoder = create_decoder(codec, input_rate, input_channels)
+        except CodecError as e:
+            await self.send_error(str(e))
+            return
+        self.protocol = PROTOCOL_VERSION if control.get('protocol') == PROTOCOL_VERSION else 0
+        print(f"[WebSocket] Client {self.address} negotiated codec {codec} (offered {control.get('codecs')}), "
+              f"{input_rate} Hz x{input_channels}, protocol {self.protocol}")
+        await self.send(json.dumps({
+            'type': 'hello',
+            'codec': codec,
+            'protocol': self.protocol,
+            'sample_rate': SAMPLE_RATE,
+            'input_sample_rate': input_rate,
+            'input_channels': input_channels,
+            'supported_codecs': SUPPORTED_CODECS
+        }))
+        await self.send_greeting()
+
+    def status(self):
+        return {'id': self.id[:8] + '...', 'address': self.address, 'connected_since': self.connected_at,
+                'transport': self.decoder.stats() if self.decoder else None,
+                'in_speech': self.in_speech, 'utterances': self.utterances,
+                'protocol': self.protocol, 'frames_lost': self.frames_lost, 'in_flight': self.in_flight}
+
+async def reject_client(websocket, reason, code):
+    """Refuse a connection, in the protocol its first message asks for"""
+    try:
+        first = await asyncio.wait_for(websocket.receive(), REJECT_HELLO_WAIT_S)
+    except asyncio.TimeoutError:
+        first = {}
+    if first.get('type') == 'websocket.disconnect':
+        return
+    try:
+        await websocket.send_text(rejection_message(requested_protocol(first.get('text')), reason))
+        await websocket.close(code, reason)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+
+async def websocket_endpoint(websocket):
+    await websocket.accept()
+    if draining or len(sessions) >= MAX_USERS:
+        reason = "Server is shutting down" if draining else "Server at maximum capacity"
+        print(f"{reason}. Rejecting client: {websocket.client}")
+        await reject_client(websocket, reason, 1013 if draining else 1008)
+        return
+
+    session = StreamSession(websocket)
+    sessions[session.id] = session
+    print(f"WebSocket client connected: {session.address} (Client ID: {session.id})")
+    print(f"Active clients: {len(sessions)}/{MAX_USERS}")
+
+    # Optional capture of everything the client sends, for replay (RECORD_SESSIONS_DIR)
+    recorder = open_recorder(session.id, address=session.address, server='asgi_server',
+                             chunk_duration_ms=CHUNK_DURATION_MS, min_flush_ms=MIN_FLUSH_MS)
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            received_at = time.time()
+            data = message.get('bytes') if message.get('bytes') is not None else message.get('text')
+            if data is None:
+                continue
+            if recorder is not None:
+                recorder.record(data, received_at)
+
+            if isinstance(data, str):
+                await session.handle_control_message(data)
+            else:
+                await session.handle_audio(data, received_at)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session.closed = True
+        if recorder is not None:
+            recorder.close()
+        sessions.pop(session.id, None)
+        print(f"WebSocket client disconnected: {session.address} (Client ID: {session.id}). "
+              f"Active clients: {len(sessions)}/{MAX_USERS}")
+
+async def cleanup_inactive_sessions():
+    """Close sessions with no activity for 5 minutes"""
+    while True:
+        await asyncio.sleep(60)
+        now = time.time()
+        for session in list(sessions.values()):
+            if now - session.last_activity > 300:
+                print(f"Removing inactive client {session.id}")
+                try:
+                    await session.websocket.close(1000, "Session timeout due to inactivity")
+                except Exception:
+                    pass
+
+#===================#
+# HTTP API Section
+#===================#
+
+async def read_upload(request):
+    form = await request.form()
+    upload = form.get('audio')
+    if upload is None or isinstance(upload, str):
+        return None
+    return await upload.read()
+
+def upload_rejection():
+    if draining:
+        return JSONResponse({'error': 'Server is shutting down. Please try again later.'}, status_code=503)
+    if scheduler.queued[UPLOAD_PRIORITY] >= MAX_QUEUED_UPLOADS:
+        return JSONResponse({'error': 'Server at maximum capacity. Please try again later.'}, status_code=503)
+    return None
+
+async def transcribe(request):
+    rejection = upload_rejection()
+    if rejection is not None:
+        return rejection
+    audio_bytes = await read_upload(request)
+    if audio_bytes is None:
+        return JSONResponse({'error': 'No audio file provided'}, status_code=400)
+
+    try:
+        print(f"[HTTP API] Processing full audio file: {len(audio_bytes)} bytes")
+        (segments, info, _, _), shared = await scheduler.transcribe_file(audio_bytes)
+        transcription = " ".join(text for _, _, text in segments)
+        print(f"[HTTP API] Transcription complete: {len(transcription)} characters{' (shared)' if shared else ''}")
+        return JSONResponse({
+            'transcription': transcription,
+            'language': info.language,
+            'duration': info.duration
+        })
+    except Exception as e:
+        print(f"[HTTP API] Error during transcription: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def analyse(request):
+    if llm is None:
+        return JSONResponse({'error': 'Analysis not configured (set GEMINI_API_KEY, the Azure OpenAI '
+                                      'variables or LLM_BACKEND=mock)'}, status_code=503)
+    rejection = upload_rejection()
+    if rejection is not None:
+        return rejection
+    audio_bytes = await read_upload(request)
+    if audio_bytes is None:
+        return JSONResponse({'error': 'No audio file provided'}, status_code=400)
+
+    try:
+        print(f"[HTTP API - Analyse] Processing audio file: {len(audio_bytes)} bytes")
+        (segments, _, _, _), _ = await scheduler.transcribe_file(audio_bytes)
+        transcription = " ".join(text for _, _, text in segments)
+        print(f"[HTTP API - Analyse] Transcription complete: {len(transcription)} characters")
+
+        if not transcription.strip():
+            return JSONResponse({'error': 'No speech detected in audio file'}, status_code=400)
+
+        # The LLM client is blocking; run it off the event loop
+        analysis, _ = await asyncio.to_thread(
+            analyse_flight.do, content_key('analyse', transcription), analyze_medical_conversation, llm, transcription
+        )
+        print("[HTTP API - Analyse] Analysis complete")
+        return JSONResponse({"transcription": transcription, **analysis})
+    except Exception as e:
+        print(f"[HTTP API - Analyse] Error during analysis: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def server_status(request):
+    client_list = [session.status() for session in sessions.values()]
+    transports = [client['transport'] for client in client_list if client['transport']]
+    bytes_in = sum(transport['bytes_in'] for transport in transports)
+    bytes_decoded = sum(transport['bytes_decoded'] for transport in transports)
+
+    return JSONResponse({
+        'status': 'draining' if draining else 'online',
+        'active_clients': len(client_list),
+        'max_clients': MAX_USERS,
+        'available_slots': MAX_USERS - len(client_list),
+        'uptime': time.time() - server_start_time,
+        'supported_codecs': SUPPORTED_CODECS,
+        'analysis_available': llm is not None,
+        'transport': {
+            'bytes_in': bytes_in,
+            'bytes_decoded': bytes_decoded,
+            'compression_ratio': round(bytes_decoded / bytes_in, 1) if bytes_in else None,
+            'decode_ms_total': round(sum(transport['decode_ms_total'] for transport in transports), 2)
+        },
+        'scheduler': scheduler.stats(),
+        'clients': client_list
+    })
+
+#===================#
+# Lifecycle
+#===================#
+
+async def drain_sessions():
+    """
+    Stop taking new sessions and uploads, transcribe what each session still
+    has buffered, wait (up to SHUTDOWN_GRACE_S) for those results to be
+    sent, then close the sessions with 1001 (going away).
+    """
+    global draining
+    draining = True
+    print(f"[Shutdown] Draining {len(sessions)} sessions...")
+    for session in list(sessions.values()):
+        session.dispatch(flush=True)
+
+    deadline = time.time() + SHUTDOWN_GRACE_S
+    while any(session.in_flight for session in sessions.values()) and time.time() < deadline:
+        await asyncio.sleep(0.1)
+
+    for session in list(sessions.values()):
+        try:
+            await session.websocket.close(1001, "Server shutting down")
+        except Exception:
+            pass
+    print("[Shutdown] Sessions closed")
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    cleanup_task = asyncio.create_task(cleanup_inactive_sessions())
+    yield
+    # Runs after uvicorn has stopped accepting connections and finished in-flight requests
+    cleanup_task.cancel()
+    await scheduler.close(SHUTDOWN_GRACE_S)
+    print("[Shutdown] Inference scheduler stopped")
+
+app = Starlette(
+    routes=[
+        Route('/transcribe', transcribe, methods=['POST']),
+        Route('/analyse', analyse, methods=['POST']),
+        Route('/status', server_status, methods=['GET']),
+        WebSocketRoute('/', websocket_endpoint),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+class DrainingServer(uvicorn.Server):
+    """
+    The first SIGINT/SIGTERM drains the streaming sessions before uvicorn's
+    own shutdown (which then waits for in-flight HTTP requests); a second
+    one exits immediately.
+    """
+
+    async def serve(self, sockets=None):
+        self._loop = asyncio.get_running_loop()
+        self._exit_requested = False
+        await super().serve(sockets)
+
+    def handle_exit(self, sig, frame):
+        if self._exit_requested:
+            self.should_exit = True
+            self.force_exit = True
+            return
+        self._exit_requested = True
+        self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._drain_then_exit()))
+
+    async def _drain_then_exit(self):
+        await drain_sessions()
+        self.should_exit = True
+
+#===================#
+# Main Entry Point
+#===================#
+
+if __name__ == "__main__":
+    print(f"Starting ASGI Speech Transcription Server on {UDS or f'{HOST}:{PORT}'} (HTTP and WebSocket)...")
+    DrainingServer(uvicorn.Config(
+        app, host=HOST, port=PORT, uds=UDS,
+        ws_ping_interval=60, ws_ping_timeout=60, ws_max_size=16 * 1024 * 1024,
+        timeout_graceful_shutdown=SHUTDOWN_GRACE_S
+    )).run()
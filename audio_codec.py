@@ -0,0 +1,205 @@
+import struct
+import time
+
+# Audio codecs for the WebSocket transcription stream.
+#
+# A client opens with a JSON hello listing the codecs it can send, e.g.
+#   {"type": "hello", "codecs": ["opus", "pcm16"]}
+# and the server answers {"type": "hello", "codec": "<choice>"}. Clients that
+# start sending binary audio straight away get raw PCM (the original protocol).
+#
+#   pcm16  16 kHz mono little-endian int16, as before (256 kbit/s)
+#   opus   Opus packets, each prefixed with its length as a big-endian
+#          uint16, one or more per WebSocket message (~24 kbit/s)
+#
+# Opus needs opuslib (and libopus); without it the server only offers pcm16.
+#
+# The hello may also declare the capture format, e.g. "sample_rate": 48000,
+# "channels": 2. pcm16 is then downmixed and resampled to 16 kHz mono on the
+# server (resample.py, needs numpy); Opus is decoded straight to 16 kHz mono
+# whatever rate it was encoded at. Without a declaration audio must already be
+# 16 kHz mono.
+
+SAMPLE_RATE = 16000
+CHANNELS = 1
+OPUS_FRAME_MS = 20
+OPUS_BITRATE = 24000
+MAX_OPUS_FRAME_SAMPLES = SAMPLE_RATE * 120 // 1000  # Longest Opus frame is 120 ms
+
+MIN_INPUT_RATE = 8000
+MAX_INPUT_RATE = 192000
+MAX_INPUT_CHANNELS = 8
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+try:
+    import opuslib
+except Exception:  # ImportError, or libopus itself missing
+    opuslib = None
+
+try:
+    from resample import StreamResampler
+except ImportError:
+    StreamResampler = None
+
+PCM16 = 'pcm16'
+OPUS = 'opus'
+SUPPORTED_CODECS = [OPUS, PCM16] if opuslib is not None else [PCM16]
+
+
+class CodecError(Exception):
+    """Raised for unsupported codecs and undecodable audio"""
+
+
+def negotiate(offered):
+    """Pick the first codec in the client's preference list that we support"""
+    for codec in offered or []:
+        if codec in SUPPORTED_CODECS:
+            return codec
+    return PCM16
+
+
+def frame_packets(packets):
+    """Length-prefix Opus packets into one message"""
+    return b"".join(struct.pack(">H", len(packet)) + packet for packet in packets)
+
+
+def unframe_packets(message):
+    packets = []
+    offset = 0
+    while offset < len(message):
+        if offset + 2 > len(message):
+            raise CodecError("Truncated Opus packet header")
+        (length,) = struct.unpack_from(">H", message, offset)
+        offset += 2
+        if offset + length > len(message):
+            raise CodecError("Truncated Opus packet")
+        packets.append(message[offset:offset + length])
+        offset += length
+    return packets
+
+
+class StreamDecoder:
+    """Turns incoming audio messages into 16 kHz mono PCM16 bytes and keeps transport/decode metrics"""
+
+    codec = PCM16
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.resampler = None
+        if (sample_rate, channels) != (SAMPLE_RATE, CHANNELS) and self.codec == PCM16:
+            if StreamResampler is None:
+                raise CodecError(f"Can't convert {sample_rate} Hz x{channels} audio (resampling needs numpy)")
+            try:
+                self.resampler = StreamResampler(sample_rate, SAMPLE_RATE, channels)
+            except ValueError as e:
+                raise CodecError(str(e)) from e
+        self.messages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.packets = 0
+        self.decode_seconds = 0.0
+        self._odd_byte = b""  # Half a sample from a PCM message of odd length
+
+    def decode(self, message):
+        start = time.perf_counter()
+        pcm = self._decode(message)
+        self.decode_seconds += time.perf_counter() - start
+        self.messages += 1
+        self.bytes_in += len(message)
+        self.bytes_out += len(pcm)
+        return pcm
+
+    def _decode(self, message):
+        self.packets += 1
+        if self.resampler is not None:
+            return self.resampler.process(message)
+        # Messages can end mid-sample (arbitrary-length or truncated frames); the
+        # trailing byte waits for the next message so samples stay aligned
+        data = self._odd_byte + bytes(message)
+        usable = len(data) - len(data) % 2
+        self._odd_byte = data[usable:]
+        return data[:usable]
+
+    def stats(self):
+        audio_seconds = self.bytes_out / (SAMPLE_RATE * 2 * CHANNELS)
+        return {
+            'codec': self.codec,
+            'input_format': f"{self.sample_rate} Hz x{self.channels}",
+            'messages': self.messages,
+            'bytes_in': self.bytes_in,
+            'bytes_decoded': self.bytes_out,
+            'compression_ratio': round(self.bytes_out / self.bytes_in, 1) if self.bytes_in else None,
+            'kbit_per_s': round(self.bytes_in * 8 / audio_seconds / 1000, 1) if audio_seconds else None,
+            'decode_ms_total': round(self.decode_seconds * 1000, 2),
+            'decode_us_per_packet': round(self.decode_seconds * 1e6 / self.packets, 1) if self.packets else None,
+            # Fraction of real time spent decoding
+            'decode_load': round(self.decode_seconds / audio_seconds, 5) if audio_seconds else None
+        }
+
+
+class OpusStreamDecoder(StreamDecoder):
+    """Incremental Opus decoder; state carries across packets, as Opus requires"""
+
+    codec = OPUS
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        if opuslib is None:
+            raise CodecError("Opus is not available on this server (install opuslib and libopus)")
+        if sample_rate not in OPUS_RATES:
+            raise CodecError(f"Opus can't be encoded at {sample_rate} Hz")
+        super().__init__(sample_rate, channels)
+        # libopus resamples and downmixes while decoding
+        self._decoder = opuslib.Decoder(SAMPLE_RATE, CHANNELS)
+
+    def _decode(self, message):
+        pcm = []
+        for packet in unframe_packets(message):
+            try:
+                pcm.append(self._decoder.decode(packet, MAX_OPUS_FRAME_SAMPLES))
+            except opuslib.OpusError as e:
+                raise CodecError(f"Opus decode failed: {str(e)}") from e
+            self.packets += 1
+        return b"".join(pcm)
+
+
+def create_decoder(codec, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    if not isinstance(sample_rate, int) or not MIN_INPUT_RATE <= sample_rate <= MAX_INPUT_RATE:
+        raise CodecError(f"Unsupported sample rate: {sample_rate}")
+    if not isinstance(channels, int) or not 1 <= channels <= MAX_INPUT_CHANNELS:
+        raise CodecError(f"Unsupported channel count: {channels}")
+    if codec == OPUS:
+        return OpusStreamDecoder(sample_rate, channels)
+    if codec == PCM16:
+        return StreamDecoder(sample_rate, channels)
+    raise CodecError(f"Unsupported codec: {codec}")
+
+
+class OpusStreamEncoder:
+    """
+    Client side: buffers PCM16 and encodes it into fixed 20 ms Opus packets.
+    encode() returns the packets completed so far (possibly none).
+    """
+
+    def __init__(self, bitrate=OPUS_BITRATE, frame_ms=OPUS_FRAME_MS):
+        if opuslib is None:
+            raise CodecError("Opus is not available (install opuslib and libopus)")
+        self._encoder = opuslib.Encoder(SAMPLE_RATE, CHANNELS, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = bitrate
+        self.frame_samples = SAMPLE_RATE * frame_ms // 1000
+        self._frame_bytes = self.frame_samples * 2 * CHANNELS
+        self._pending = b""
+
+    def encode(self, pcm):
+        self._pending += pcm
+        packets = []
+        while len(self._pending) >= self._frame_bytes:
+            frame, self._pending = self._pending[:self._frame_bytes], self._pending[self._frame_bytes:]
+            packets.append(self._encoder.encode(frame, self.frame_samples))
+        return packets
+
+    def flush(self):
+        """Pad and encode the remaining partial frame"""
+        if not self._pending:
+            return []
+        return self.encode(b"\x00" * (self._frame_bytes - len(self._pending)))
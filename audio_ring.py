@@ -0,0 +1,85 @@
+import threading
+
+import numpy as np
+
+# Single-producer / single-consumer ring buffer for int16 audio samples.
+#
+# The capture side only advances `_write_pos` and the inference side only
+# advances `_read_pos`, so neither takes a lock on the data path (each index
+# has exactly one writer, and int assignment is atomic under the GIL). An
+# Event wakes the consumer when new audio arrives. When the consumer falls so
+# far behind that the buffer is full, new samples are dropped and counted in
+# `overflow_samples` instead of blocking the capture callback.
+
+
+class AudioRingBuffer:
+    def __init__(self, capacity_samples):
+        self.capacity = int(capacity_samples)
+        self._buffer = np.zeros(self.capacity, dtype=np.int16)
+        self._write_pos = 0  # Total samples ever written (producer-owned)
+        self._read_pos = 0  # Total samples ever read (consumer-owned)
+        self._data_ready = threading.Event()
+
+        self.overflow_samples = 0
+        self.overflow_events = 0
+
+    def available(self):
+        return self._write_pos - self._read_pos
+
+    def write(self, samples):
+        """Producer: append int16 samples. Returns the number of samples dropped."""
+        samples = np.asarray(samples, dtype=np.int16)
+        free = self.capacity - (self._write_pos - self._read_pos)
+        dropped = 0
+        if len(samples) > free:
+            dropped = len(samples) - free
+            samples = samples[:free]
+            self.overflow_samples += dropped
+            self.overflow_events += 1
+
+        count = len(samples)
+        if count:
+            start = self._write_pos % self.capacity
+            first = min(count, self.capacity - start)
+            self._buffer[start:start + first] = samples[:first]
+            if first < count:
+                self._buffer[:count - first] = samples[first:]
+            # Publish only after the samples are in place
+            self._write_pos += count
+            self._data_ready.set()
+        return dropped
+
+    def read(self, count, timeout=None):
+        """
+        Consumer: wait until `count` samples are available and return them as
+        a new int16 array, or None if the timeout expires first.
+        """
+        while self.available() < count:
+            self._data_ready.clear()
+            # Re-check after clearing so a write between the test and clear isn't missed
+            if self.available() >= count:
+                break
+            if not self._data_ready.wait(timeout):
+                return None
+
+        start = self._read_pos % self.capacity
+        first = min(count, self.capacity - start)
+        if first == count:
+            out = self._buffer[start:start + count].copy()
+        else:
+            out = np.concatenate((self._buffer[start:], self._buffer[:count - first]))
+        self._read_pos += count
+        return out
+
+    def drain(self):
+        """Consumer: return whatever is buffered (possibly empty)"""
+        count = self.available()
+        return self.read(count, timeout=0) if count else np.zeros(0, dtype=np.int16)
+
+    def stats(self):
+        return {
+            'buffered_samples': self.available(),
+            'capacity_samples': self.capacity,
+            'overflow_samples': self.overflow_samples,
+            'overflow_events': self.overflow_events
+        }
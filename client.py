@@ -1,6 +1,14 @@
 import asyncio
+import array
+import json
+import math
+import os
+import time
+from collections import deque
 import websockets
 import pyaudio
+from audio_codec import OPUS, PCM16, SUPPORTED_CODECS, OpusStreamEncoder, frame_packets
+from stream_protocol import PROTOCOL_VERSION, encode_audio_frame
 
 SERVER_URI = "ws://38.65.239.30:35489"  # Updated to match your server port
 
@@ -8,8 +16,124 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
 CHUNK = 1024
+HELLO_TIMEOUT_S = 2  # Servers that don't answer the hello get raw PCM
 
-async def send_audio(websocket):
+# Frames are batched into one WebSocket message per BATCH_MS of audio
+BATCH_MS = int(os.environ.get('CLIENT_BATCH_MS', '250'))
+
+# Energy VAD: nothing is sent during sustained silence
+VAD_ENABLED = os.environ.get('CLIENT_VAD', '1') != '0'
+VAD_THRESHOLD = int(os.environ.get('CLIENT_VAD_THRESHOLD', '500'))  # RMS of int16 samples
+VAD_HANGOVER_MS = 800  # Keep sending this long after the level drops, so pauses between words don't cut
+VAD_PRE_ROLL_MS = 300  # Audio sent from just before speech was detected, so onsets aren't clipped
+KEEPALIVE_S = 30  # During silence; servers close sessions with no activity for 5 minutes
+
+FRAME_MS = CHUNK * 1000 / RATE
+
+def frame_rms(data):
+    samples = array.array('h', data)
+    if not samples:
+        return 0
+    return math.sqrt(sum(sample * sample for sample in samples) / len(samples))
+
+class EnergyVad:
+    """
+    Minimal energy-based voice activity detector with hangover.
+    update() returns 'start', 'end' or None for each frame.
+    """
+
+    def __init__(self, threshold=VAD_THRESHOLD, hangover_ms=VAD_HANGOVER_MS):
+        self.threshold = threshold
+        self.hangover_frames = max(1, int(hangover_ms / FRAME_MS))
+        self.in_speech = False
+        self._quiet_frames = 0
+
+    def update(self, data):
+        loud = frame_rms(data) >= self.threshold
+        if loud:
+            self._quiet_frames = 0
+            if not self.in_speech:
+                self.in_speech = True
+                return 'start'
+        elif self.in_speech:
+            self._quiet_frames += 1
+            if self._quiet_frames >= self.hangover_frames:
+                self.in_speech = False
+                return 'end'
+        return None
+
+class AudioBatcher:
+    """
+    Collects PCM (or encoded Opus packets) and sends one message per BATCH_MS.
+    With protocol 1 each message is a framed audio frame carrying a sequence
+    number and the capture time of its first sample.
+    """
+
+    def __init__(self, websocket, codec, protocol=0, batch_ms=BATCH_MS):
+        self.websocket = websocket
+        self.codec = codec
+        self.protocol = protocol
+        self.seq = 0
+        self._capture_us = None
+        self.encoder = OpusStreamEncoder() if codec == OPUS else None
+        self.batch_bytes = int(RATE * 2 * batch_ms / 1000)  # Measured in PCM bytes for both codecs
+        self._pcm = b""
+        self._packets = []
+        self._pending_bytes = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+
+    async def add(self, data, capture_us=None):
+        if self._capture_us is None:
+            self._capture_us = capture_us if capture_us is not None else time.time() * 1e6
+        if self.encoder is None:
+            self._pcm += data
+        else:
+            self._packets.extend(self.encoder.encode(data))
+        self._pending_bytes += len(data)
+        if self._pending_bytes >= self.batch_bytes:
+            await self.flush()
+
+    async def flush(self, end_of_speech=False):
+        if end_of_speech and self.encoder is not None:
+            self._packets.extend(self.encoder.flush())
+
+        message = self._pcm if self.encoder is None else frame_packets(self._packets)
+        capture_us = self._capture_us
+        self._pcm, self._packets, self._pending_bytes, self._capture_us = b"", [], 0, None
+        if message:
+            if self.protocol:
+                message = encode_audio_frame(message, self.seq, capture_us, RATE, self.codec)
+                self.seq += 1
+            await self.websocket.send(message)
+            self.messages_sent += 1
+            self.bytes_sent += len(message)
+
+async def negotiate(websocket):
+    """
+    Offer our codecs (Opus first when available) and protocol 1.
+    Returns the server's choice as (codec, protocol).
+    """
+    await websocket.send(json.dumps({'type': 'hello', 'codecs': SUPPORTED_CODECS, 'protocol': PROTOCOL_VERSION}))
+    try:
+        while True:
+            message = await asyncio.wait_for(websocket.recv(), HELLO_TIMEOUT_S)
+            try:
+                reply = json.loads(message)
+            except ValueError:
+                # Greeting or other text sent before the hello reply
+                print(f"\033[90m{message}\033[0m")
+                continue
+            if isinstance(reply, dict) and reply.get('type') == 'hello':
+                return reply.get('codec', PCM16), reply.get('protocol', 0)
+            if isinstance(reply, dict):
+                # e.g. a protocol-1 error when the server is at capacity
+                print_result(reply)
+    except asyncio.TimeoutError:
+        print("Server did not answer the codec hello; sending raw PCM.")
+        return PCM16, 0
+
+async def send_audio(websocket, codec, protocol):
     p = pyaudio.PyAudio()
 
     stream = p.open(format=FORMAT,
@@ -18,29 +142,99 @@ async def send_audio(websocket):
                     input=True,
                     frames_per_buffer=CHUNK)
 
-    print("Recording and streaming... Press Ctrl+C to stop.")
+    batcher = AudioBatcher(websocket, codec, protocol)
+    vad = EnergyVad() if VAD_ENABLED else None
+    pre_roll = deque(maxlen=max(1, int(VAD_PRE_ROLL_MS / FRAME_MS)))
+    frames_read = 0
+    last_sent = time.time()
+
+    print(f"Recording and streaming ({codec}, {BATCH_MS} ms batches, VAD {'on' if vad else 'off'})... "
+          f"Press Ctrl+C to stop.")
     try:
         while True:
             data = stream.read(CHUNK, exception_on_overflow=False)
-            await websocket.send(data)
+            # The frame's first sample was captured one frame duration ago
+            capture_us = time.time() * 1e6 - FRAME_MS * 1000
+            frames_read += 1
+            # Most frames aren't sent now; still yield so transcriptions are received
+            await asyncio.sleep(0)
+
+            if vad is None:
+                await batcher.add(data, capture_us)
+                continue
+
+            event = vad.update(data)
+            if event == 'start':
+                await websocket.send(json.dumps({'type': 'speech_start'}))
+                for frame, frame_capture_us in pre_roll:
+                    await batcher.add(frame, frame_capture_us)
+                pre_roll.clear()
+
+            if vad.in_speech or event == 'end':
+                await batcher.add(data, capture_us)
+            else:
+                pre_roll.append((data, capture_us))
+
+            if event == 'end':
+                await batcher.flush(end_of_speech=True)
+                await websocket.send(json.dumps({'type': 'speech_end'}))
+
+            if vad.in_speech or event == 'end':
+                last_sent = time.time()
+            elif time.time() - last_sent >= KEEPALIVE_S:
+                await websocket.send(json.dumps({'type': 'keepalive'}))
+                last_sent = time.time()
     except asyncio.CancelledError:
         print("Audio sending stopped.")
+        if frames_read:
+            print(f"Sent {batcher.messages_sent} messages for {frames_read} frames "
+                  f"({batcher.bytes_sent / 1024:.0f} KB).")
     finally:
         stream.stop_stream()
         stream.close()
         p.terminate()
 
-async def receive_transcription(websocket):
+def print_result(result):
+    """Print a protocol-1 server message, with end-to-end latency for transcripts"""
+    if result.get('type') == 'error':
+        print(f"\033[91mError: {result.get('message')}\033[0m")
+        return
+    if result.get('type') != 'transcript':
+        print(f"\033[90m{result}\033[0m")
+        return
+    if not result['text']:
+        return
+
+    details = [('final' if result['final'] else 'partial')]
+    if result.get('capture_us'):
+        # Capture of the newest included frame -> result received, on our clock
+        details.append(f"e2e {(time.time() * 1e6 - result['capture_us']) / 1000:.0f} ms")
+    latency = result.get('latency_ms', {})
+    details.append(f"server {latency.get('server_total', 0):.0f} ms "
+                   f"(inference {latency.get('inference', 0):.0f} ms, queue {latency.get('queue', 0):.0f} ms)")
+    if result.get('frames_lost'):
+        details.append(f"{result['frames_lost']} frames lost")
+    print(f"\033[94mTranscription: {result['text']}\033[0m \033[90m[{', '.join(details)}]\033[0m")
+
+async def receive_transcription(websocket, protocol):
     try:
         async for message in websocket:
+            if protocol:
+                try:
+                    print_result(json.loads(message))
+                    continue
+                except ValueError:
+                    pass
             print(f"\033[94mTranscription: {message}\033[0m")  # Blue colored transcription output
     except websockets.exceptions.ConnectionClosed as e:
         print(f"Server closed connection: {e}")
 
 async def main():
     async with websockets.connect(SERVER_URI) as websocket:
-        send_task = asyncio.create_task(send_audio(websocket))
-        receive_task = asyncio.create_task(receive_transcription(websocket))
+        codec, protocol = await negotiate(websocket)
+
+        send_task = asyncio.create_task(send_audio(websocket, codec, protocol))
+        receive_task = asyncio.create_task(receive_transcription(websocket, protocol))
 
         # Wait for either task to complete (or for Ctrl+C)
         done, pending = await asyncio.wait(
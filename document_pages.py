@@ -0,0 +1,79 @@
+import io
+import os
+import threading
+
+from PIL import Image, ImageSequence
+
+# Split uploaded documents into page images for form extraction (i2f1.py).
+# Images are one page each (multi-frame TIFFs one page per frame); PDFs are
+# rasterized with pypdfium2 when it's installed.
+
+MAX_PAGES = int(os.environ.get('MAX_UPLOAD_PAGES', '20'))
+PDF_RENDER_DPI = 150  # Enough for legible labels; preprocessing downscales further
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# pdfium isn't thread-safe, and extraction jobs run on a thread pool: only one
+# PDF is opened, rendered or closed at a time
+_pdfium_lock = threading.Lock()
+
+
+class DocumentError(Exception):
+    """Raised for unreadable, unsupported or oversized uploads"""
+
+
+def is_pdf(data):
+    return data[:5] == b'%PDF-'
+
+
+def rasterize_pdf(data, max_pages=MAX_PAGES):
+    """Render each PDF page to a PIL image"""
+    if pdfium is None:
+        raise DocumentError("PDF uploads need pypdfium2 (pip install pypdfium2)")
+
+    with _pdfium_lock:
+        try:
+            pdf = pdfium.PdfDocument(data)
+        except Exception as e:
+            raise DocumentError(f"Could not open PDF: {str(e)}") from e
+
+        try:
+            if len(pdf) > max_pages:
+                raise DocumentError(f"PDF has {len(pdf)} pages, the limit is {max_pages}")
+            pages = []
+            for index in range(len(pdf)):
+                page = pdf[index]
+                pages.append(page.render(scale=PDF_RENDER_DPI / 72).to_pil())
+                page.close()
+            return pages
+        finally:
+            pdf.close()
+
+
+def load_pages(uploads, max_pages=MAX_PAGES):
+    """
+    Turn a list of uploaded files (raw bytes, in page order) into a list of
+    (PIL page image, source byte size or None).
+    """
+    pages = []
+    for data in uploads:
+        if is_pdf(data):
+            pages.extend((page, None) for page in rasterize_pdf(data, max_pages))
+        else:
+            try:
+                image = Image.open(io.BytesIO(data))
+            except Exception as e:
+                raise DocumentError(f"Unsupported file: {str(e)}") from e
+
+            frames = getattr(image, 'n_frames', 1)
+            if frames == 1:
+                pages.append((image, len(data)))
+            else:
+                pages.extend((frame.copy(), None) for frame in ImageSequence.Iterator(image))
+
+        if len(pages) > max_pages:
+            raise DocumentError(f"Too many pages, the limit is {max_pages}")
+    return pages
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sse import SSE_HEARTBEAT_S, format_comment, format_event
+
+# Background form-extraction jobs for i2f1.py.
+# /upload registers a job and returns immediately; a bounded thread pool runs
+# the extraction. Job state lives in the FormStore (SQLite) so any worker
+# process can answer status polls and progress streams, not only the one that
+# runs the job.
+
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', '4'))
+MAX_PENDING_JOBS = int(os.environ.get('MAX_PENDING_JOBS', '32'))  # Queued + running, per process
+JOB_POLL_INTERVAL_S = 0.25
+# A job whose state hasn't changed for this long is treated as orphaned (its
+# worker crashed or restarted); generous, since a job can sit queued behind others
+STALE_JOB_S = float(os.environ.get('STALE_JOB_S', '900'))
+
+TERMINAL_STATUSES = ('done', 'failed')
+
+
+class JobQueueFull(Exception):
+    """Raised when MAX_PENDING_JOBS extractions are already queued or running"""
+
+
+class ExtractionJobs:
+    """
+    Runs extraction functions on a bounded pool. The function is called as
+    fn(report, *args) where report(stage) records progress, and must return
+    the created form ID.
+    """
+
+    def __init__(self, store, workers=EXTRACTION_WORKERS, max_pending=MAX_PENDING_JOBS):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='extraction')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull("Too many extractions in progress, please try again shortly")
+
+        job_id = uuid.uuid4().hex[:12]
+        try:
+            self.store.create_job(job_id)
+            self.executor.submit(self._run, job_id, fn, args)
+        except Exception:
+            self._slots.release()
+            raise
+        return job_id
+
+    def _run(self, job_id, fn, args):
+        start = time.time()
+
+        def report(stage):
+            self.store.update_job(job_id, 'running', stage)
+
+        try:
+            report('starting')
+            form_id = fn(report, *args)
+            self.store.update_job(job_id, 'done', 'done', form_id=form_id)
+            print(f"[Jobs] {job_id} done in {time.time() - start:.1f}s -> form {form_id}")
+        except Exception as e:
+            print(f"[Jobs] {job_id} failed: {str(e)}")
+            self.store.update_job(job_id, 'failed', 'failed', error=str(e))
+        finally:
+            self._slots.release()
+
+    def events(self, job_id):
+        """
+        SSE progress stream for a job: a `progress` event whenever the job
+        state changes, heartbeats while it doesn't, and a final `done` event.
+        Polls the store so it works from any worker process. A job not
+        updated for STALE_JOB_S ends the stream with a failed `done` event.
+        """
+        last_state = None
+        last_sent = time.time()
+        event_id = 0
+        while True:
+            job = self.store.get_job(job_id)
+            if job is None:
+                yield format_event({'job_id': job_id, 'error': 'Job not found'}, event='done')
+                return
+
+            state = (job['status'], job['stage'])
+            if state != last_state:
+                event_id += 1
+                last_state = state
+                last_sent = time.time()
+                event = 'done' if job['status'] in TERMINAL_STATUSES else 'progress'
+                yield format_event(job, event=event, event_id=event_id)
+                if event == 'done':
+                    return
+            elif time.time() - job['updated_at'] >= STALE_JOB_S:
+                print(f"[Jobs] {job_id} not updated for {STALE_JOB_S:.0f}s; ending its progress stream")
+                event_id += 1
+                stale = dict(job, status='failed', error='Extraction stopped responding, please try again')
+                yield format_event(stale, event='done', event_id=event_id)
+                return
+            elif time.time() - last_sent >= SSE_HEARTBEAT_S:
+                last_sent = time.time()
+                yield format_comment("heartbeat")
+
+            time.sleep(JOB_POLL_INTERVAL_S)
@@ -0,0 +1,152 @@
+import re
+import threading
+
+# Precompiled per-form field index used to validate submissions.
+# A form's field list is parsed and compiled once per form version (the
+# form's updated_at) instead of being re-read and walked on every submit.
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+OPTION_TYPES = ('select', 'radio', 'checkbox')
+MAX_VALUE_LENGTH = 10000
+
+
+class CompiledField:
+    __slots__ = ('name', 'type', 'required', 'options')
+
+    def __init__(self, field):
+        self.name = field['name']
+        self.type = field.get('type', 'text')
+        self.required = bool(field.get('required'))
+        # Submitted values are strings; options in the schema may be numbers or booleans
+        self.options = (frozenset(str(option) for option in field.get('options') or ())
+                        if self.type in OPTION_TYPES else None)
+
+
+class FieldIndex:
+    """Compiled fields of one form version"""
+
+    def __init__(self, fields, version):
+        self.version = version
+        self.fields = [CompiledField(field) for field in fields if field.get('name')]
+
+    def validate(self, form):
+        """
+        Validate a submitted MultiDict against the form's fields.
+        Returns (data, errors). Only known fields are kept; a field with
+        several values (checkboxes) is stored as a list, as before.
+        """
+        data = {}
+        errors = []
+        for field in self.fields:
+            values = [value for value in form.getlist(field.name) if value != '']
+            if not values:
+                if field.required and field.type != 'checkbox':
+                    errors.append(f"{field.name} is required")
+                continue
+
+            if any(len(value) > MAX_VALUE_LENGTH for value in values):
+                errors.append(f"{field.name} is too long")
+            elif field.options and not field.options.issuperset(values):
+                errors.append(f"{field.name} has an invalid option")
+            elif field.type != 'checkbox' and len(values) > 1:
+                errors.append(f"{field.name} accepts a single value")
+            elif field.type == 'email' and not EMAIL_PATTERN.match(values[0]):
+                errors.append(f"{field.name} is not a valid email address")
+            elif field.type == 'number' and not _is_number(values[0]):
+                errors.append(f"{field.name} is not a number")
+
+            data[field.name] = values if len(values) > 1 else values[0]
+        return data, errors
+
+    def count_keys(self, data):
+        """
+        Aggregate counter keys a stored submission contributes to, as
+        (field, value) pairs: (field, '') when the field is filled, plus
+        (field, option) for each chosen option of select/radio/checkbox fields.
+        """
+        keys = []
+        for field in self.fields:
+            value = data.get(field.name)
+            if value in (None, '', []):
+                continue
+            keys.append((field.name, ''))
+            if field.options is not None:
+                for option in (value if isinstance(value, list) else [value]):
+                    keys.append((field.name, str(option)))
+        return keys
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+class FieldIndexCache:
+    """form_id -> FieldIndex, recompiled when the form's updated_at changes"""
+
+    def __init__(self, store):
+        self.store = store
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, form_id):
+        """The form's compiled field index, or None if the form doesn't exist"""
+        version = self.store.form_version(form_id)
+        if version is None:
+            return None
+
+        index = self._indexes.get(form_id)
+        if index is not None and index.version == version:
+            return index
+
+        form_data = self.store.get_form(form_id)
+        if form_data is None:
+            return None
+        index = FieldIndex(form_data['fields'], form_data['updated_at'])
+        with self._lock:
+            self._indexes[form_id] = index
+        return index
+
+
+def _field_signature(field):
+    return (field.get('name'), field.get('type', 'text'), (field.get('label') or '').strip().lower())
+
+
+def merge_schemas(schemas):
+    """
+    Merge per-page schemas (in page order) into one form. The title and
+    description come from the first page that has them. A field repeated
+    identically on several pages (same name, type and label, e.g. a running
+    "Applicant name" header) is kept once; any other name clash is renamed
+    with a numeric suffix (name_2, name_3, ...).
+    """
+    merged = {'title': '', 'description': '', 'fields': []}
+    seen_signatures = set()
+    used_names = set()
+
+    for schema in schemas:
+        if not merged['title'] and schema.get('title'):
+            merged['title'] = schema['title']
+        if not merged['description'] and schema.get('description'):
+            merged['description'] = schema['description']
+
+        for field in schema.get('fields', []):
+            if not field.get('name'):
+                continue
+            signature = _field_signature(field)
+            if signature in seen_signatures:
+                continue
+            seen_signatures.add(signature)
+
+            field = dict(field)
+            name, suffix = field['name'], 2
+            while field['name'] in used_names:
+                field['name'] = f"{name}_{suffix}"
+                suffix += 1
+            used_names.add(field['name'])
+            merged['fields'].append(field)
+
+    return merged
@@ -0,0 +1,120 @@
+import copy
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# Cache of extracted form schemas keyed by a perceptual hash of the
+# preprocessed form image. Re-scans of the same paper form differ in lighting,
+# framing and noise, so lookups match any stored hash within a Hamming
+# distance threshold rather than requiring an exact match.
+#
+# Nearest-hash lookup uses multi-index hashing: the 64-bit hash is split into
+# (threshold + 1) bands and every band value is indexed. Two hashes within the
+# threshold must agree exactly on at least one band (pigeonhole), so only the
+# entries sharing a band are compared instead of the whole cache.
+
+HASH_BITS = 64
+MAX_DISTANCE = int(os.environ.get('FORM_CACHE_MAX_DISTANCE', '6'))
+MAX_ENTRIES = int(os.environ.get('FORM_CACHE_MAX_ENTRIES', '5000'))
+
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash: shrink to (hash_size + 1) x hash_size grayscale and
+    record whether each pixel is brighter than its right neighbour.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class FormSchemaCache:
+    """Thread-safe LRU cache of form schemas with near-duplicate hash lookup"""
+
+    def __init__(self, max_distance=MAX_DISTANCE, max_entries=MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.bands = max_distance + 1
+        # Bit ranges of each band, as (shift, mask)
+        width = HASH_BITS // self.bands
+        self._band_layout = []
+        for band in range(self.bands):
+            bits = width if band < self.bands - 1 else HASH_BITS - width * (self.bands - 1)
+            self._band_layout.append((band * width, (1 << bits) - 1))
+
+        self._entries = OrderedDict()  # hash -> schema, in LRU order
+        self._index = [dict() for _ in range(self.bands)]  # band value -> set of hashes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _band_values(self, image_hash):
+        return [(image_hash >> shift) & mask for shift, mask in self._band_layout]
+
+    def _add_to_index(self, image_hash):
+        for band, value in enumerate(self._band_values(image_hash)):
+            self._index[band].setdefault(value, set()).add(image_hash)
+
+    def _remove_from_index(self, image_hash):
+        for band, value in enumerate(self._band_values(image_hash)):
+            bucket = self._index[band].get(value)
+            if bucket is not None:
+                bucket.discard(image_hash)
+                if not bucket:
+                    del self._index[band][value]
+
+    def lookup(self, image_hash):
+        """
+        Return (schema, distance) for the nearest cached hash within
+        max_distance, or (None, None).
+        """
+        with self._lock:
+            candidates = set()
+            for band, value in enumerate(self._band_values(image_hash)):
+                candidates |= self._index[band].get(value, set())
+
+            best, best_distance = None, None
+            for candidate in candidates:
+                distance = hamming(candidate, image_hash)
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best, best_distance = candidate, distance
+
+            if best is None:
+                self.misses += 1
+                return None, None
+
+            self.hits += 1
+            self._entries.move_to_end(best)
+            return copy.deepcopy(self._entries[best]), best_distance
+
+    def store(self, image_hash, schema):
+        with self._lock:
+            if image_hash not in self._entries:
+                self._add_to_index(image_hash)
+            self._entries[image_hash] = copy.deepcopy(schema)
+            self._entries.move_to_end(image_hash)
+
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._remove_from_index(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'max_distance': self.max_distance
+            }
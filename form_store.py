@@ -0,0 +1,512 @@
+import base64
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from form_fields import FieldIndex
+
+# Persistent storage for the image-to-form app (i2f1.py).
+#
+# SQLite in WAL mode lets several gunicorn workers read concurrently while one
+# writes, and keeps memory flat regardless of how many forms/submissions exist.
+# Each process keeps a small pool of connections; every connection caches its
+# prepared statements (the SQL below is constant text with ? parameters, so the
+# statement cache hits on every call).
+
+DB_PATH = os.environ.get('FORMS_DB_PATH', 'forms.db')
+POOL_SIZE = int(os.environ.get('FORMS_DB_POOL_SIZE', '8'))
+BUSY_TIMEOUT_MS = 5000
+FORMS_PAGE_SIZE = 20
+SUBMISSIONS_PAGE_SIZE = 50
+EXPORT_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS forms (
+    form_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    fields TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+DROP INDEX IF EXISTS idx_forms_created;
+CREATE INDEX IF NOT EXISTS idx_forms_created_id ON forms(created_at, form_id);
+CREATE INDEX IF NOT EXISTS idx_forms_updated ON forms(updated_at);
+-- Case-insensitive prefix LIKE can use this index (fallback when FTS5 is unavailable)
+CREATE INDEX IF NOT EXISTS idx_forms_title ON forms(title COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    submission_id TEXT NOT NULL UNIQUE,
+    form_id TEXT NOT NULL REFERENCES forms(form_id),
+    data TEXT NOT NULL,
+    submitted_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_submissions_form_time ON submissions(form_id, submitted_at, id);
+CREATE INDEX IF NOT EXISTS idx_submissions_time ON submissions(submitted_at);
+
+-- Per-form submission aggregates, updated in the same transaction as the inserts.
+-- field_counts holds (field, '') -> filled count and (field, option) -> times chosen.
+CREATE TABLE IF NOT EXISTS form_stats (
+    form_id TEXT PRIMARY KEY REFERENCES forms(form_id),
+    submissions INTEGER NOT NULL DEFAULT 0,
+    fields_version REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS field_counts (
+    form_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (form_id, field, value)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL DEFAULT '',
+    form_id TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at);
+"""
+
+# Title search index, kept in sync with forms by triggers. Created separately
+# since some SQLite builds lack FTS5.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE forms_fts USING fts5(title, content='forms', content_rowid='rowid');
+CREATE TRIGGER forms_fts_insert AFTER INSERT ON forms BEGIN
+    INSERT INTO forms_fts(rowid, title) VALUES (new.rowid, new.title);
+END;
+CREATE TRIGGER forms_fts_delete AFTER DELETE ON forms BEGIN
+    INSERT INTO forms_fts(forms_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+END;
+CREATE TRIGGER forms_fts_update AFTER UPDATE OF title ON forms BEGIN
+    INSERT INTO forms_fts(forms_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+    INSERT INTO forms_fts(rowid, title) VALUES (new.rowid, new.title);
+END;
+INSERT INTO forms_fts(forms_fts) VALUES ('rebuild');
+"""
+
+INSERT_FORM = """
+INSERT INTO forms (form_id, title, description, fields, created_at, updated_at)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+SELECT_FORM = "SELECT title, description, fields, created_at, updated_at FROM forms WHERE form_id = ?"
+# Listing queries only touch the columns the index page shows; newest first
+SELECT_FORMS_FIRST_PAGE = """
+SELECT form_id, title, created_at FROM forms
+ORDER BY created_at DESC, form_id DESC LIMIT ?
+"""
+SELECT_FORMS_PAGE = """
+SELECT form_id, title, created_at FROM forms
+WHERE (created_at, form_id) < (?, ?)
+ORDER BY created_at DESC, form_id DESC LIMIT ?
+"""
+SEARCH_FORMS_FTS = """
+SELECT forms.form_id, forms.title, forms.created_at FROM forms_fts
+JOIN forms ON forms.rowid = forms_fts.rowid
+WHERE forms_fts MATCH ? ORDER BY rank LIMIT ?
+"""
+SEARCH_FORMS_PREFIX = """
+SELECT form_id, title, created_at FROM forms
+WHERE title LIKE ? ESCAPE '\\' ORDER BY title COLLATE NOCASE LIMIT ?
+"""
+HAS_FTS_TABLE = "SELECT 1 FROM sqlite_master WHERE name = 'forms_fts'"
+FORM_EXISTS = "SELECT 1 FROM forms WHERE form_id = ?"
+FORM_VERSION = "SELECT updated_at FROM forms WHERE form_id = ?"
+FORMS_VERSION = "SELECT MAX(updated_at) FROM forms"
+# Idempotent: replaying a submission log must not duplicate rows
+INSERT_SUBMISSION_IGNORE = """
+INSERT OR IGNORE INTO submissions (submission_id, form_id, data, submitted_at)
+VALUES (?, ?, ?, ?)
+"""
+SELECT_SUBMISSIONS = """
+SELECT submission_id, data, submitted_at FROM submissions
+WHERE form_id = ? ORDER BY submitted_at, id
+"""
+# Keyset pagination: seek past the last (submitted_at, id) seen, served by idx_submissions_form_time
+SELECT_SUBMISSIONS_PAGE = """
+SELECT id, submission_id, data, submitted_at FROM submissions
+WHERE form_id = ? AND (submitted_at, id) > (?, ?)
+ORDER BY submitted_at, id LIMIT ?
+"""
+SELECT_FORM_FIELDS = "SELECT fields, updated_at FROM forms WHERE form_id = ?"
+SELECT_ALL_SUBMISSION_DATA = "SELECT data FROM submissions WHERE form_id = ?"
+# No row (a form created before aggregates existed) stays missing until rebuild_summary
+UPDATE_FORM_STATS = "UPDATE form_stats SET submissions = submissions + ? WHERE form_id = ?"
+REPLACE_FORM_STATS = "INSERT OR REPLACE INTO form_stats (form_id, submissions, fields_version) VALUES (?, ?, ?)"
+UPSERT_FIELD_COUNT = """
+INSERT INTO field_counts (form_id, field, value, count) VALUES (?, ?, ?, ?)
+ON CONFLICT(form_id, field, value) DO UPDATE SET count = count + excluded.count
+"""
+DELETE_FIELD_COUNTS = "DELETE FROM field_counts WHERE form_id = ?"
+SELECT_FORM_STATS = "SELECT submissions, fields_version FROM form_stats WHERE form_id = ?"
+SELECT_FIELD_COUNTS = "SELECT field, value, count FROM field_counts WHERE form_id = ?"
+SUBMISSIONS_VERSION = "SELECT COUNT(*), MAX(id) FROM submissions WHERE form_id = ?"
+INSERT_JOB = "INSERT INTO jobs (job_id, status, created_at, updated_at) VALUES (?, 'queued', ?, ?)"
+UPDATE_JOB = """
+UPDATE jobs SET status = ?, stage = ?, form_id = COALESCE(?, form_id), error = ?, updated_at = ?
+WHERE job_id = ?
+"""
+SELECT_JOB = "SELECT status, stage, form_id, error, created_at, updated_at FROM jobs WHERE job_id = ?"
+DELETE_OLD_JOBS = "DELETE FROM jobs WHERE updated_at < ?"
+
+
+def _form_from_row(title, description, fields, created_at, updated_at):
+    return {
+        'title': title,
+        'description': description,
+        'fields': json.loads(fields),
+        'created_at': created_at,
+        'updated_at': updated_at
+    }
+
+
+def encode_cursor(*values):
+    """Opaque page cursor from the last row's sort key (plus any extra state)"""
+    raw = json.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """
+    Inverse of encode_cursor, converting each value with the matching type.
+    Returns None for an empty cursor (the first page). Raises ValueError on garbage.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if len(values) != len(types):
+            raise ValueError("Wrong number of cursor values")
+        return [convert(value) for convert, value in zip(types, values)]
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def fts_query(text):
+    """User search text -> FTS5 query matching every word as a prefix"""
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+class FormStore:
+    """SQLite-backed store for forms and their submissions"""
+
+    def __init__(self, path=DB_PATH, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool_lock = threading.Lock()
+        self._open_pool()
+
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            self.has_fts = self._ensure_fts(conn)
+
+    def _ensure_fts(self, conn):
+        if conn.execute(HAS_FTS_TABLE).fetchone():
+            return True
+        try:
+            conn.executescript("BEGIN;" + FTS_SCHEMA + "COMMIT;")
+            return True
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if conn.execute(HAS_FTS_TABLE).fetchone():
+                # Another worker created it concurrently
+                return True
+            print(f"[Form Store] FTS5 unavailable, title search falls back to prefix LIKE: {str(e)}")
+            return False
+
+    def _open_pool(self):
+        # SQLite connections must not cross fork(); gunicorn --preload forks after import
+        self._pid = os.getpid()
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        for _ in range(self.pool_size):
+            self._pool.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,  # Connections move between request threads via the pool
+            cached_statements=256,
+            isolation_level=None  # Autocommit; explicit BEGIN for multi-statement writes
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        if self._pid != os.getpid():
+            with self._pool_lock:
+                if self._pid != os.getpid():
+                    self._open_pool()
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Connection inside BEGIN IMMEDIATE ... COMMIT (rolled back on error)"""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    #===================#
+    # Forms
+    #===================#
+
+    def create_form(self, form_id, title, description, fields, created_at):
+        updated_at = time.time()
+        with self.transaction() as conn:
+            conn.execute(INSERT_FORM, (form_id, title, description or '', json.dumps(fields),
+                                       created_at, updated_at))
+            conn.execute(REPLACE_FORM_STATS, (form_id, 0, updated_at))
+
+    def get_form(self, form_id):
+        with self.connection() as conn:
+            row = conn.execute(SELECT_FORM, (form_id,)).fetchone()
+        return _form_from_row(*row) if row else None
+
+    def form_exists(self, form_id):
+        with self.connection() as conn:
+            return conn.execute(FORM_EXISTS, (form_id,)).fetchone() is not None
+
+    def form_version(self, form_id):
+        """The form's updated_at, or None if it doesn't exist"""
+        with self.connection() as conn:
+            row = conn.execute(FORM_VERSION, (form_id,)).fetchone()
+        return row[0] if row else None
+
+    def forms_version(self):
+        """Changes whenever a form is added or updated (newest updated_at)"""
+        with self.connection() as conn:
+            return conn.execute(FORMS_VERSION).fetchone()[0] or 0
+
+    def list_forms_page(self, cursor=None, limit=FORMS_PAGE_SIZE):
+        """
+        One page of forms, newest first: ([{'form_id', 'title', 'created_at'}],
+        next cursor or None). Seeks on the (created_at, form_id) index.
+        """
+        after = decode_cursor(cursor, str, str)
+        with self.connection() as conn:
+            if after is None:
+                rows = conn.execute(SELECT_FORMS_FIRST_PAGE, (limit + 1,)).fetchall()
+            else:
+                rows = conn.execute(SELECT_FORMS_PAGE, (after[0], after[1], limit + 1)).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+        forms = [{'form_id': form_id, 'title': title, 'created_at': created_at}
+                 for form_id, title, created_at in rows]
+        return forms, next_cursor
+
+    def search_forms(self, text, limit=FORMS_PAGE_SIZE):
+        """Forms whose title matches every word of `text` as a prefix (best matches first)"""
+        text = text.strip()
+        if not text:
+            return []
+        with self.connection() as conn:
+            if self.has_fts:
+                rows = conn.execute(SEARCH_FORMS_FTS, (fts_query(text), limit)).fetchall()
+            else:
+                pattern = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                rows = conn.execute(SEARCH_FORMS_PREFIX, (pattern, limit)).fetchall()
+        return [{'form_id': form_id, 'title': title, 'created_at': created_at}
+                for form_id, title, created_at in rows]
+
+    #===================#
+    # Submissions
+    #===================#
+
+    def add_submission(self, form_id, submission_id, data, submitted_at):
+        self.add_submissions([{
+            'submission_id': submission_id,
+            'form_id': form_id,
+            'data': data,
+            'submitted_at': submitted_at
+        }])
+
+    def add_submissions(self, records):
+        """
+        Insert a batch of submission records ({'submission_id', 'form_id',
+        'data', 'submitted_at'}) and update the forms' aggregates, in one
+        transaction. Already-stored submission IDs are skipped (and not
+        counted again).
+        """
+        with self.transaction() as conn:
+            field_indexes = {}
+            submissions = Counter()
+            counts = Counter()
+            for record in records:
+                cursor = conn.execute(INSERT_SUBMISSION_IGNORE, (
+                    record['submission_id'], record['form_id'],
+                    json.dumps(record['data']), record['submitted_at']
+                ))
+                if cursor.rowcount != 1:
+                    continue
+
+                form_id = record['form_id']
+                if form_id not in field_indexes:
+                    field_indexes[form_id] = self._field_index(conn, form_id)
+                submissions[form_id] += 1
+                for field, value in field_indexes[form_id].count_keys(record['data']):
+                    counts[(form_id, field, value)] += 1
+
+            conn.executemany(UPDATE_FORM_STATS, [(added, form_id) for form_id, added in submissions.items()])
+            conn.executemany(UPSERT_FIELD_COUNT, [key + (count,) for key, count in counts.items()])
+
+    def _field_index(self, conn, form_id):
+        fields, updated_at = conn.execute(SELECT_FORM_FIELDS, (form_id,)).fetchone()
+        return FieldIndex(json.loads(fields), updated_at)
+
+    def submissions_version(self, form_id):
+        """(count, newest id) of a form's submissions; changes on every new submission"""
+        with self.connection() as conn:
+            count, newest = conn.execute(SUBMISSIONS_VERSION, (form_id,)).fetchone()
+        return count, newest or 0
+
+    def get_submissions_page(self, form_id, cursor=None, limit=SUBMISSIONS_PAGE_SIZE):
+        """
+        One page of a form's submissions, oldest first, starting after `cursor`.
+        Returns (submissions, position of the first one, next cursor or None).
+        Each submission is {'submission_id', 'data', 'submitted_at'}.
+        """
+        submitted_after, after_id, position = decode_cursor(cursor, str, int, int) or ('', 0, 0)
+        with self.connection() as conn:
+            # One extra row tells whether there is a next page
+            rows = conn.execute(SELECT_SUBMISSIONS_PAGE,
+                                (form_id, submitted_after, after_id, limit + 1)).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[3], last[0], position + limit)
+
+        submissions = [
+            {'submission_id': submission_id, 'data': json.loads(data), 'submitted_at': submitted_at}
+            for _, submission_id, data, submitted_at in rows
+        ]
+        return submissions, position, next_cursor
+
+    def iter_submissions(self, form_id, batch_size=EXPORT_BATCH_SIZE):
+        """
+        Yield every submission of a form, oldest first, in keyset-paginated
+        batches. The pooled connection is released between batches, so a slow
+        export consumer never pins a connection or an old WAL snapshot.
+        """
+        submitted_after, after_id = '', 0
+        while True:
+            with self.connection() as conn:
+                rows = conn.execute(SELECT_SUBMISSIONS_PAGE,
+                                    (form_id, submitted_after, after_id, batch_size)).fetchall()
+            for _, submission_id, data, submitted_at in rows:
+                yield {'submission_id': submission_id, 'data': json.loads(data), 'submitted_at': submitted_at}
+            if len(rows) < batch_size:
+                return
+            after_id, submitted_after = rows[-1][0], rows[-1][3]
+
+    def get_submissions(self, form_id):
+        """All submissions of a form as {submission_id: {'data', 'submitted_at'}}, oldest first"""
+        with self.connection() as conn:
+            rows = conn.execute(SELECT_SUBMISSIONS, (form_id,)).fetchall()
+        return {
+            submission_id: {'data': json.loads(data), 'submitted_at': submitted_at}
+            for submission_id, data, submitted_at in rows
+        }
+
+    #===================#
+    # Aggregates
+    #===================#
+
+    def get_summary(self, form_id):
+        """
+        Per-field summary from the aggregate tables, O(fields + options):
+        {'submissions', 'fields_version', 'counts': {field: {value: count}}}
+        where value '' is the filled count. None if no aggregates exist yet.
+        """
+        with self.connection() as conn:
+            stats = conn.execute(SELECT_FORM_STATS, (form_id,)).fetchone()
+            if stats is None:
+                return None
+            rows = conn.execute(SELECT_FIELD_COUNTS, (form_id,)).fetchall()
+
+        counts = {}
+        for field, value, count in rows:
+            counts.setdefault(field, {})[value] = count
+        return {'submissions': stats[0], 'fields_version': stats[1], 'counts': counts}
+
+    def rebuild_summary(self, form_id):
+        """Recount a form's aggregates from its stored submissions (e.g. after a schema change)"""
+        with self.transaction() as conn:
+            field_index = self._field_index(conn, form_id)
+            submissions = 0
+            counts = Counter()
+            cursor = conn.execute(SELECT_ALL_SUBMISSION_DATA, (form_id,))
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                for (data,) in rows:
+                    submissions += 1
+                    counts.update(field_index.count_keys(json.loads(data)))
+
+            conn.execute(DELETE_FIELD_COUNTS, (form_id,))
+            conn.execute(REPLACE_FORM_STATS, (form_id, submissions, field_index.version))
+            conn.executemany(UPSERT_FIELD_COUNT, [
+                (form_id, field, value, count) for (field, value), count in counts.items()
+            ])
+        print(f"[Form Store] Rebuilt summary of {form_id} from {submissions} submissions")
+
+    #===================#
+    # Extraction jobs
+    #===================#
+
+    def create_job(self, job_id, max_age=86400):
+        """Register a queued job (and drop jobs older than max_age seconds)"""
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute(DELETE_OLD_JOBS, (now - max_age,))
+            conn.execute(INSERT_JOB, (job_id, now, now))
+
+    def update_job(self, job_id, status, stage='', form_id=None, error=None):
+        with self.connection() as conn:
+            conn.execute(UPDATE_JOB, (status, stage, form_id, error, time.time(), job_id))
+
+    def get_job(self, job_id):
+        with self.connection() as conn:
+            row = conn.execute(SELECT_JOB, (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, stage, form_id, error, created_at, updated_at = row
+        return {
+            'job_id': job_id,
+            'status': status,
+            'stage': stage,
+            'form_id': form_id,
+            'error': error,
+            'created_at': created_at,
+            'updated_at': updated_at
+        }
@@ -0,0 +1,99 @@
+import io
+import os
+import time
+
+from PIL import Image, ImageFilter, ImageOps
+
+# Preprocessing for uploaded form photos before vision extraction.
+# Phone photos of paper forms are large, rotated via EXIF and mostly background;
+# the model only needs a legible grayscale page. Steps:
+#   1. apply EXIF orientation
+#   2. convert to grayscale
+#   3. crop to the document (bounding box of non-background content)
+#   4. downscale to a target long edge
+#   5. re-encode as JPEG with tuned quality
+
+TARGET_LONG_EDGE = int(os.environ.get('FORM_IMAGE_LONG_EDGE', '1600'))
+JPEG_QUALITY = int(os.environ.get('FORM_IMAGE_JPEG_QUALITY', '80'))
+CROP_THRESHOLD = 40  # Minimum difference from the background level to count as content
+CROP_MARGIN = 0.02  # Margin kept around the detected document, as a fraction of the size
+MIN_CROP_AREA = 0.2  # Ignore crops smaller than this fraction of the image (likely noise)
+
+
+def auto_crop(image):
+    """
+    Crop a grayscale image to its content. The background level is taken from
+    the image border; pixels that differ from it by more than CROP_THRESHOLD
+    define the bounding box. Falls back to the full image when the detected
+    box is implausibly small.
+    """
+    # Work on a small copy, it's only used to find the box
+    probe = image.copy()
+    probe.thumbnail((512, 512))
+    probe = probe.filter(ImageFilter.MedianFilter(5))
+
+    width, height = probe.size
+    border = [probe.getpixel((x, y)) for x in range(width) for y in (0, height - 1)]
+    border += [probe.getpixel((x, y)) for y in range(height) for x in (0, width - 1)]
+    background = sorted(border)[len(border) // 2]
+
+    mask = probe.point(lambda value: 255 if abs(value - background) > CROP_THRESHOLD else 0)
+    box = mask.getbbox()
+    if box is None:
+        return image
+
+    left, top, right, bottom = box
+    if (right - left) * (bottom - top) < MIN_CROP_AREA * width * height:
+        return image
+
+    scale_x = image.width / width
+    scale_y = image.height / height
+    margin_x = int(image.width * CROP_MARGIN)
+    margin_y = int(image.height * CROP_MARGIN)
+    return image.crop((
+        max(int(left * scale_x) - margin_x, 0),
+        max(int(top * scale_y) - margin_y, 0),
+        min(int(right * scale_x) + margin_x, image.width),
+        min(int(bottom * scale_y) + margin_y, image.height)
+    ))
+
+
+def preprocess_image(image_data, long_edge=TARGET_LONG_EDGE, quality=JPEG_QUALITY):
+    """
+    Preprocess raw uploaded image bytes.
+    Returns (PIL image ready for the model, re-encoded JPEG bytes).
+    """
+    return preprocess_page(Image.open(io.BytesIO(image_data)), len(image_data), long_edge, quality)
+
+
+def preprocess_page(image, original_bytes=None, long_edge=TARGET_LONG_EDGE, quality=JPEG_QUALITY):
+    """
+    Preprocess an already-decoded page (e.g. a rasterized PDF page).
+    `original_bytes` is only used for the size reduction log line.
+    Returns (PIL image ready for the model, re-encoded JPEG bytes).
+    """
+    start = time.time()
+    original_size = image.size
+
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('L')
+    image = auto_crop(image)
+
+    if max(image.size) > long_edge:
+        image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    encoded = output.getvalue()
+
+    original_pixels = original_size[0] * original_size[1]
+    pixels = image.width * image.height
+    sizes = ""
+    if original_bytes:
+        sizes = (f"{original_bytes / 1024:.0f} KB -> {len(encoded) / 1024:.0f} KB "
+                 f"({100 * (1 - len(encoded) / original_bytes):.0f}% smaller) ")
+    print(f"[Preprocess] {original_size[0]}x{original_size[1]} -> {image.width}x{image.height} "
+          f"({100 * (1 - pixels / original_pixels):.0f}% fewer pixels), "
+          f"{sizes}in {(time.time() - start) * 1000:.0f} ms")
+
+    return Image.open(io.BytesIO(encoded)), encoded
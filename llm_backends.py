@@ -0,0 +1,435 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+
+# Pluggable LLM backends shared by the analysis services.
+# Every backend exposes the same three calls:
+#   complete(prompt)      -> full response text
+#   stream(prompt)        -> generator of text chunks
+#   complete_json(prompt, task=None) -> parsed JSON object
+#                           (task names the caller's schema, e.g. 'medical_analysis';
+#                            only the mock backend looks at it)
+# LLMRouter wraps several backends, routes by observed latency / error rate
+# and fails over to the next backend when a call errors.
+
+# Router tuning
+EWMA_ALPHA = 0.2  # Weight of the newest latency / error observation
+ERROR_PENALTY_S = 5.0  # Seconds added to a backend's score at a 100% error rate
+FAILURE_COOLDOWN_S = 30  # Skip a backend for this long after repeated failures
+FAILURES_BEFORE_COOLDOWN = 3
+
+
+class LLMUnavailableError(RuntimeError):
+    """Raised when every configured backend failed for a request"""
+
+
+def strip_code_fences(text):
+    """
+    Remove markdown code fences (```json ... ```) that models like to wrap JSON in
+    """
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[7:]
+    elif text.startswith('```'):
+        text = text[3:]
+    if text.endswith('```'):
+        text = text[:-3]
+    return text.strip()
+
+
+def parse_json_response(text):
+    """
+    Parse a model response that should contain a single JSON object.
+    Strict: truncated output raises json.JSONDecodeError rather than being
+    accepted as complete (only the streaming parser repairs partial output).
+    """
+    return json.loads(strip_code_fences(text))
+
+
+#===================#
+# Backends
+#===================#
+
+class LLMBackend:
+    """
+    Base class for LLM backends. Subclasses implement complete() and stream();
+    complete_json() falls back to parsing the completion text.
+    """
+    name = "base"
+
+    def complete(self, prompt):
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        raise NotImplementedError
+
+    def complete_json(self, prompt, task=None):
+        return parse_json_response(self.complete(prompt))
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Google Gemini through google.generativeai. The prompt may be a string or a
+    list of parts (text and PIL images) as accepted by generate_content.
+    """
+
+    def __init__(self, model, name="gemini"):
+        self.model = model
+        self.name = name
+
+    def complete(self, prompt):
+        response = self.model.generate_content(prompt)
+        return response.text.strip()
+
+    def stream(self, prompt):
+        response = self.model.generate_content(prompt, stream=True)
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    def complete_json(self, prompt, task=None):
+        response = self.model.generate_content(
+            prompt,
+            generation_config={"response_mime_type": "application/json"}
+        )
+        return parse_json_response(response.text)
+
+
+class AzureOpenAIBackend(LLMBackend):
+    """
+    Azure OpenAI chat completions (e.g. the o4-mini deployment).
+    PIL images inside a list prompt are sent as base64 image_url parts.
+    The default system prompt is task-neutral, since create_router adds this
+    backend as failover for every service; pass system_prompt to specialise it.
+    """
+
+    def __init__(self, client, deployment,
+                 system_prompt="You are a helpful assistant. Follow the instructions in the user message exactly.",
+                 max_completion_tokens=2000, name="azure"):
+        self.client = client
+        self.deployment = deployment
+        self.system_prompt = system_prompt
+        self.max_completion_tokens = max_completion_tokens
+        self.name = name
+
+    def _content_parts(self, prompt):
+        parts = prompt if isinstance(prompt, (list, tuple)) else [prompt]
+        content = []
+        for part in parts:
+            if isinstance(part, str):
+                content.append({"type": "text", "text": part})
+            else:
+                # Assume a PIL image
+                buffer = io.BytesIO()
+                part.convert('RGB').save(buffer, format='JPEG', quality=85)
+                encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+                content.append({
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}
+                })
+        return content
+
+    def _messages(self, prompt):
+        return [
+            {
+                "role": "developer",
+                "content": [{"type": "text", "text": self.system_prompt}]
+            },
+            {
+                "role": "user",
+                "content": self._content_parts(prompt)
+            }
+        ]
+
+    def complete(self, prompt):
+        response = self.client.chat.completions.create(
+            model=self.deployment,
+            messages=self._messages(prompt),
+            max_completion_tokens=self.max_completion_tokens,
+            stream=False
+        )
+        return response.choices[0].message.content.strip()
+
+    def stream(self, prompt):
+        response = self.client.chat.completions.create(
+            model=self.deployment,
+            messages=self._messages(prompt),
+            max_completion_tokens=self.max_completion_tokens,
+            stream=True
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def complete_json(self, prompt, task=None):
+        response = self.client.chat.completions.create(
+            model=self.deployment,
+            messages=self._messages(prompt),
+            max_completion_tokens=self.max_completion_tokens,
+            response_format={"type": "json_object"},
+            stream=False
+        )
+        return parse_json_response(response.choices[0].message.content)
+
+
+# Canned complete_json() payloads by task; None covers callers that don't name one
+MOCK_JSON_RESPONSES = {
+    'medical_analysis': {
+        "summary": "Mock analysis of the conversation.",
+        "symptoms": [],
+        "diagnosis": [],
+        "medications": [],
+        "follow_up": ""
+    },
+    'form_extraction': {
+        "title": "Mock Form",
+        "description": "Deterministic mock extraction of the uploaded form.",
+        "fields": [
+            {"name": "full_name", "label": "Full Name", "type": "text", "required": True,
+             "placeholder": "Enter your full name"},
+            {"name": "email", "label": "Email Address", "type": "email", "required": True,
+             "placeholder": "Enter your email"},
+            {"name": "visit_type", "label": "Visit Type", "type": "select", "required": False,
+             "options": ["New patient", "Follow-up"]}
+        ]
+    }
+}
+MOCK_JSON_RESPONSES[None] = MOCK_JSON_RESPONSES['medical_analysis']
+
+
+class MockBackend(LLMBackend):
+    """
+    Deterministic local backend for offline load testing.
+
+    The response text is derived from a hash of the prompt, so the same prompt
+    always produces the same output. complete_json() returns the canned payload
+    for the caller's task (json_responses, default MOCK_JSON_RESPONSES).
+    Latency and failures are simulated:
+      latency_s       - delay before the first token
+      chunk_delay_s   - delay between streamed chunks
+      error_rate      - fraction of calls that raise (seeded, reproducible)
+    """
+
+    def __init__(self, latency_s=0.5, chunk_delay_s=0.02, error_rate=0.0,
+                 seed=0, json_responses=None, name="mock"):
+        self.latency_s = latency_s
+        self.chunk_delay_s = chunk_delay_s
+        self.error_rate = error_rate
+        self.json_responses = json_responses if json_responses is not None else MOCK_JSON_RESPONSES
+        self.name = name
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency_s=float(os.environ.get('MOCK_LLM_LATENCY_MS', '500')) / 1000,
+            chunk_delay_s=float(os.environ.get('MOCK_LLM_CHUNK_DELAY_MS', '20')) / 1000,
+            error_rate=float(os.environ.get('MOCK_LLM_ERROR_RATE', '0')),
+            seed=int(os.environ.get('MOCK_LLM_SEED', '0'))
+        )
+
+    def _maybe_fail(self):
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.error_rate:
+            raise RuntimeError("Mock backend injected failure")
+
+    def _response_text(self, prompt):
+        text = prompt if isinstance(prompt, str) else " ".join(p for p in prompt if isinstance(p, str))
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+        return (f"**Mock Report** ({digest})\n\n"
+                f"**Summary**\nThis is a deterministic mock response for a prompt of {len(text)} characters.\n")
+
+    def complete(self, prompt):
+        time.sleep(self.latency_s)
+        self._maybe_fail()
+        return self._response_text(prompt)
+
+    def stream(self, prompt):
+        time.sleep(self.latency_s)
+        self._maybe_fail()
+        for word in self._response_text(prompt).split(' '):
+            yield word + ' '
+            time.sleep(self.chunk_delay_s)
+
+    def complete_json(self, prompt, task=None):
+        time.sleep(self.latency_s)
+        self._maybe_fail()
+        if task not in self.json_responses:
+            raise ValueError(f"Mock backend has no JSON response for task {task!r}")
+        return json.loads(json.dumps(self.json_responses[task]))
+
+
+#===================#
+# Router
+#===================#
+
+class _BackendStats:
+    def __init__(self):
+        # Completions and streams are timed differently, so each has its own EWMA
+        self.latency = 0.0  # EWMA of seconds to complete (complete / complete_json)
+        self.first_chunk_latency = 0.0  # EWMA of seconds to the first chunk (stream)
+        self.error_rate = 0.0  # EWMA of failures (0..1)
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+
+class LLMRouter:
+    """
+    Routes each call to the backend with the best observed score
+    (EWMA latency plus a penalty for the EWMA error rate) and fails over to the
+    remaining backends in score order if the call raises.
+
+    Backends that have not been measured yet score 0 and are tried first,
+    so every backend gets probed. A backend that fails several times in a
+    row is put on cooldown and only used when nothing else is available.
+    """
+
+    def __init__(self, backends):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = list(backends)
+        self._stats = {backend.name: _BackendStats() for backend in self.backends}
+        self._lock = threading.Lock()
+
+    def _ordered_backends(self, streaming=False):
+        now = time.time()
+        with self._lock:
+            def score(item):
+                position, backend = item
+                stats = self._stats[backend.name]
+                cooling = stats.cooldown_until > now
+                latency = stats.first_chunk_latency if streaming else stats.latency
+                return (cooling, latency + ERROR_PENALTY_S * stats.error_rate, position)
+            ranked = sorted(enumerate(self.backends), key=score)
+        return [backend for _, backend in ranked]
+
+    def _record(self, backend, elapsed, failed, streaming=False):
+        with self._lock:
+            stats = self._stats[backend.name]
+            stats.calls += 1
+            stats.error_rate += EWMA_ALPHA * ((1.0 if failed else 0.0) - stats.error_rate)
+            if failed:
+                stats.failures += 1
+                stats.consecutive_failures += 1
+                if stats.consecutive_failures >= FAILURES_BEFORE_COOLDOWN:
+                    stats.cooldown_until = time.time() + FAILURE_COOLDOWN_S
+            else:
+                stats.consecutive_failures = 0
+                attribute = 'first_chunk_latency' if streaming else 'latency'
+                current = getattr(stats, attribute)
+                setattr(stats, attribute, elapsed if current == 0.0 else current + EWMA_ALPHA * (elapsed - current))
+
+    def _call(self, method, prompt, **kwargs):
+        errors = []
+        for backend in self._ordered_backends():
+            start = time.time()
+            try:
+                result = getattr(backend, method)(prompt, **kwargs)
+            except Exception as e:
+                self._record(backend, time.time() - start, failed=True)
+                print(f"[LLM Router] {backend.name}.{method} failed: {str(e)}")
+                errors.append(f"{backend.name}: {str(e)}")
+                continue
+            self._record(backend, time.time() - start, failed=False)
+            return result
+        raise LLMUnavailableError("All LLM backends failed - " + "; ".join(errors))
+
+    def complete(self, prompt):
+        return self._call('complete', prompt)
+
+    def complete_json(self, prompt, task=None):
+        return self._call('complete_json', prompt, task=task)
+
+    def stream(self, prompt):
+        """
+        Stream from the best backend. Failover happens only before the first
+        chunk has been yielded; a failure mid-stream is re-raised because the
+        caller has already received partial output.
+        """
+        errors = []
+        for backend in self._ordered_backends(streaming=True):
+            start = time.time()
+            chunks = backend.stream(prompt)
+            try:
+                first = next(chunks)
+            except StopIteration:
+                self._record(backend, time.time() - start, failed=False, streaming=True)
+                return
+            except Exception as e:
+                self._record(backend, time.time() - start, failed=True, streaming=True)
+                print(f"[LLM Router] {backend.name}.stream failed: {str(e)}")
+                errors.append(f"{backend.name}: {str(e)}")
+                continue
+
+            self._record(backend, time.time() - start, failed=False, streaming=True)
+            yield first
+            yield from chunks
+            return
+        raise LLMUnavailableError("All LLM backends failed - " + "; ".join(errors))
+
+    def stats(self):
+        """Per-backend routing statistics, suitable for a status endpoint"""
+        now = time.time()
+        with self._lock:
+            return {
+                name: {
+                    'latency_ms': round(stats.latency * 1000, 1),
+                    'first_chunk_ms': round(stats.first_chunk_latency * 1000, 1),
+                    'error_rate': round(stats.error_rate, 3),
+                    'calls': stats.calls,
+                    'failures': stats.failures,
+                    'cooling_down': stats.cooldown_until > now
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+def azure_backend_from_env():
+    """
+    Build an Azure OpenAI backend from AZURE_OPENAI_* environment variables,
+    or return None when they are not set. Used to add a failover backend.
+    """
+    endpoint = os.environ.get('AZURE_OPENAI_ENDPOINT')
+    api_key = os.environ.get('AZURE_OPENAI_API_KEY')
+    if not endpoint or not api_key:
+        return None
+
+    from openai import AzureOpenAI
+    client = AzureOpenAI(
+        azure_endpoint=endpoint,
+        api_key=api_key,
+        api_version=os.environ.get('AZURE_OPENAI_API_VERSION', '2025-01-01-preview')
+    )
+    return AzureOpenAIBackend(client, os.environ.get('AZURE_DEPLOYMENT_NAME', 'o4-mini'))
+
+
+def create_router(backends):
+    """
+    Build the router used by a service.
+
+    LLM_BACKEND=mock replaces the configured backends with MockBackend
+    (see MockBackend.from_env for its settings). Otherwise an Azure backend
+    configured through the environment is appended as failover.
+    """
+    if os.environ.get('LLM_BACKEND', '').lower() == 'mock':
+        print("[LLM Router] Using mock backend")
+        return LLMRouter([MockBackend.from_env()])
+
+    backends = list(backends)
+    names = {backend.name for backend in backends}
+    if 'azure' not in names:
+        azure = azure_backend_from_env()
+        if azure is not None:
+            backends.append(azure)
+
+    print(f"[LLM Router] Backends: {', '.join(backend.name for backend in backends)}")
+    return LLMRouter(backends)
@@ -0,0 +1,345 @@
+import asyncio
+import array
+import json
+import math
+import os
+import sys
+import time
+import wave
+import websockets
+from audio_codec import OPUS, PCM16, SAMPLE_RATE, SUPPORTED_CODECS, OpusStreamEncoder, frame_packets
+from stream_protocol import PROTOCOL_VERSION, encode_audio_frame
+
+# Headless load generator for the transcription WebSocket server.
+#
+#   python load_test.py speech1.wav [speech2.wav ...]
+#
+# Opens LOAD_TEST_SESSIONS concurrent sessions (started evenly over
+# LOAD_TEST_RAMP_UP_S), each streaming one of the WAV files (round-robin) in
+# LOAD_TEST_BATCH_MS messages at LOAD_TEST_SPEED x real time, then prints a
+# percentile report. WAV files must be 16-bit mono or stereo at 16 kHz.
+# No audio hardware or PyAudio needed.
+#
+# Against a protocol-1 server (stream_protocol.py) every frame carries its
+# simulated capture time, so each transcript gives:
+#   e2e latency     capture of the newest frame it covers -> transcript received
+#   transcript lag  audio streamed so far - end of the audio the transcript covers
+# Legacy servers only give e2e latency, measured from the last frame sent.
+
+SERVER_URI = os.environ.get('LOAD_TEST_URI', "ws://localhost:8080")
+SESSIONS = int(os.environ.get('LOAD_TEST_SESSIONS', '5'))
+RAMP_UP_S = float(os.environ.get('LOAD_TEST_RAMP_UP_S', '10'))
+SPEED = float(os.environ.get('LOAD_TEST_SPEED', '1.0'))  # 2.0 = twice real time, 0 = as fast as possible
+BATCH_MS = int(os.environ.get('LOAD_TEST_BATCH_MS', '250'))
+CODEC = os.environ.get('LOAD_TEST_CODEC', PCM16)
+DRAIN_TIMEOUT_S = float(os.environ.get('LOAD_TEST_DRAIN_TIMEOUT_S', '10'))  # Idle wait for trailing transcripts
+REPORT_PATH = os.environ.get('LOAD_TEST_REPORT')  # Also write the report as JSON
+HELLO_TIMEOUT_S = 2
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_wav(path):
+    """Read a WAV file as 16 kHz mono PCM16 bytes"""
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit samples, got {wav.getsampwidth() * 8}-bit")
+        if wav.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"{path}: expected {SAMPLE_RATE} Hz, got {wav.getframerate()} Hz")
+        channels = wav.getnchannels()
+        pcm = wav.readframes(wav.getnframes())
+
+    if channels == 1:
+        return pcm
+    samples = array.array('h', pcm)
+    mono = array.array('h', (sum(samples[i:i + channels]) // channels
+                             for i in range(0, len(samples), channels)))
+    return mono.tobytes()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class SessionStats:
+    def __init__(self, index, wav_name):
+        self.index = index
+        self.wav_name = wav_name
+        self.protocol = 0
+        self.codec = None
+        self.connected = False
+        self.rejected = False
+        self.disconnected = False  # Closed by the server (or the network) before we were done
+        self.error = None
+        self.connect_ms = None
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.audio_sent_s = 0.0
+        self.send_behind_ms = []  # How late each message went out vs. its real-time schedule
+        self.transcripts = 0
+        self.e2e_ms = []
+        self.lag_s = []
+        self.server_ms = []
+        self.frames_lost = 0
+
+
+class LoadSession:
+    """One simulated client streaming a WAV file"""
+
+    def __init__(self, index, wav_name, pcm):
+        self.stats = SessionStats(index, wav_name)
+        self.pcm = pcm
+        self.batch_bytes = int(SAMPLE_RATE * 2 * BATCH_MS / 1000)
+        self.frame_end_s = {}  # seq -> stream position (s) at the end of that frame
+        self.last_send_us = None
+        self.last_seq = None
+        self.covered_seq = -1
+        self.done_sending = False
+        self.last_message_at = None
+        self.drained = asyncio.Event()
+
+    async def run(self):
+        stats = self.stats
+        started = time.time()
+        try:
+            async with websockets.connect(SERVER_URI, max_size=None) as websocket:
+                stats.connected = True
+                stats.connect_ms = (time.time() - started) * 1000
+                if not await self.negotiate(websocket):
+                    return
+
+                receiver = asyncio.create_task(self.receive(websocket))
+                await self.send(websocket)
+                self.done_sending = True
+                self.last_message_at = time.time()
+                await self.drain()
+                receiver.cancel()
+        except websockets.exceptions.ConnectionClosed as e:
+            stats.disconnected = not stats.rejected
+            stats.error = stats.error or f"Connection closed: {e}"
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake) as e:
+            stats.error = f"Connect failed: {e}"
+
+    async def drain(self):
+        """
+        Wait for the transcripts of the tail: until the last frame is covered or,
+        when that can't be seen (legacy server, tail too short to transcribe),
+        DRAIN_TIMEOUT_S passes without a new message.
+        """
+        if self.last_seq is None or self.covered_seq >= self.last_seq:
+            return
+        while not self.drained.is_set() and time.time() - self.last_message_at < DRAIN_TIMEOUT_S:
+            try:
+                await asyncio.wait_for(self.drained.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def negotiate(self, websocket):
+        await websocket.send(json.dumps({'type': 'hello', 'codecs': [CODEC], 'protocol': PROTOCOL_VERSION}))
+        try:
+            while True:
+                message = await asyncio.wait_for(websocket.recv(), HELLO_TIMEOUT_S)
+                if message.startswith("ERROR:"):
+                    self.stats.rejected = True
+                    self.stats.error = message
+                    return False
+                try:
+                    reply = json.loads(message)
+                except ValueError:
+                    continue  # Greeting
+                if isinstance(reply, dict) and reply.get('type') == 'error':
+                    # Protocol-1 refusal (e.g. server at capacity)
+                    self.stats.rejected = True
+                    self.stats.error = reply.get('message')
+                    return False
+                if isinstance(reply, dict) and reply.get('type') == 'hello':
+                    self.stats.codec = reply.get('codec', PCM16)
+                    self.stats.protocol = reply.get('protocol', 0)
+                    return True
+        except asyncio.TimeoutError:
+            self.stats.codec = PCM16
+            return True
+
+    async def send(self, websocket):
+        stats = self.stats
+        encoder = OpusStreamEncoder() if stats.codec == OPUS else None
+        start = time.time()
+        seq = 0
+        for offset in range(0, len(self.pcm), self.batch_bytes):
+            batch = self.pcm[offset:offset + self.batch_bytes]
+            position_s = offset / (SAMPLE_RATE * 2)
+            end_s = (offset + len(batch)) / (SAMPLE_RATE * 2)
+
+            # A live client can only send a batch once its last sample has been captured
+            if SPEED > 0:
+                due = start + end_s / SPEED
+                delay = due - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    stats.send_behind_ms.append(-delay * 1000)
+            capture_us = (start + position_s / SPEED) * 1e6 if SPEED > 0 else time.time() * 1e6
+
+            if encoder is not None:
+                packets = encoder.encode(batch)
+                if offset + self.batch_bytes >= len(self.pcm):
+                    packets.extend(encoder.flush())
+                message = frame_packets(packets)
+            else:
+                message = batch
+            if not message:
+                continue
+            if stats.protocol:
+                message = encode_audio_frame(message, seq, capture_us, SAMPLE_RATE, stats.codec)
+                self.frame_end_s[seq] = end_s
+            await websocket.send(message)
+            self.last_seq = seq
+            self.last_send_us = time.time() * 1e6
+            seq += 1
+            stats.messages_sent += 1
+            stats.bytes_sent += len(message)
+            stats.audio_sent_s = end_s
+
+        # Have the server transcribe the tail instead of waiting for a full chunk
+        await websocket.send(json.dumps({'type': 'speech_end'}))
+
+    async def receive(self, websocket):
+        stats = self.stats
+        try:
+            async for message in websocket:
+                self.last_message_at = time.time()
+                now_us = self.last_message_at * 1e6
+                if not stats.protocol:
+                    if message.startswith("ERROR:"):
+                        stats.error = message
+                        continue
+                    stats.transcripts += 1
+                    if self.last_send_us is not None:
+                        stats.e2e_ms.append((now_us - self.last_send_us) / 1000)
+                    continue
+
+                try:
+                    result = json.loads(message)
+                except ValueError:
+                    continue
+                if result.get('type') == 'error':
+                    stats.error = result.get('message')
+                    continue
+                if result.get('type') != 'transcript':
+                    continue
+
+                stats.transcripts += 1
+                stats.frames_lost = result.get('frames_lost', 0)
+                stats.server_ms.append(result.get('latency_ms', {}).get('server_total', 0))
+                if result.get('capture_us'):
+                    stats.e2e_ms.append((now_us - result['capture_us']) / 1000)
+                if result.get('seq_range'):
+                    last_seq = result['seq_range'][1]
+                    self.covered_seq = max(self.covered_seq, last_seq)
+                    if last_seq in self.frame_end_s:
+                        stats.lag_s.append(stats.audio_sent_s - self.frame_end_s[last_seq])
+                if self.done_sending and self.last_seq is not None and self.covered_seq >= self.last_seq:
+                    self.drained.set()
+        except websockets.exceptions.ConnectionClosed as e:
+            if not self.done_sending or not self.drained.is_set():
+                stats.disconnected = True
+                stats.error = stats.error or f"Connection closed: {e}"
+            self.drained.set()
+
+
+#===================#
+# Report
+#===================#
+
+def summarize(values, unit):
+    summary = {f"p{pct}": round(percentile(values, pct), 1) for pct in PERCENTILES} if values else {}
+    summary.update({'count': len(values), 'unit': unit,
+                    'max': round(max(values), 1) if values else None})
+    return summary
+
+
+def build_report(sessions, wall_s):
+    stats = [session.stats for session in sessions]
+    audio_s = sum(s.audio_sent_s for s in stats)
+    return {
+        'sessions': len(stats),
+        'connected': sum(s.connected and not s.rejected for s in stats),
+        'rejected': sum(s.rejected for s in stats),
+        'connect_failed': sum(not s.connected for s in stats),
+        'disconnects': sum(s.disconnected for s in stats),
+        'protocol_1_sessions': sum(s.protocol == PROTOCOL_VERSION for s in stats),
+        'wall_s': round(wall_s, 1),
+        'audio_streamed_s': round(audio_s, 1),
+        'messages_sent': sum(s.messages_sent for s in stats),
+        'kbit_per_s_sent': round(sum(s.bytes_sent for s in stats) * 8 / wall_s / 1000, 1) if wall_s else None,
+        'transcripts': sum(s.transcripts for s in stats),
+        'frames_lost': sum(s.frames_lost for s in stats),
+        'e2e_latency': summarize([v for s in stats for v in s.e2e_ms], 'ms'),
+        'server_latency': summarize([v for s in stats for v in s.server_ms], 'ms'),
+        'transcript_lag': summarize([v * 1000 for s in stats for v in s.lag_s], 'ms'),
+        'connect_time': summarize([s.connect_ms for s in stats if s.connect_ms is not None], 'ms'),
+        'send_behind_schedule': summarize([v for s in stats for v in s.send_behind_ms], 'ms'),
+        'errors': sorted({s.error for s in stats if s.error})
+    }
+
+
+def print_report(report):
+    print("\n===== Load test report =====")
+    print(f"Sessions: {report['sessions']} ({report['connected']} connected, {report['rejected']} rejected, "
+          f"{report['connect_failed']} failed to connect, {report['disconnects']} disconnected early)")
+    print(f"Streamed {report['audio_streamed_s']} s of audio in {report['wall_s']} s "
+          f"({report['messages_sent']} messages, {report['kbit_per_s_sent']} kbit/s); "
+          f"{report['transcripts']} transcripts, {report['frames_lost']} frames lost")
+
+    header = f"{'':<22}" + "".join(f"{f'p{pct}':>9}" for pct in PERCENTILES) + f"{'max':>9}{'n':>7}"
+    print(header)
+    for key, label in (('e2e_latency', "E2E latency (ms)"), ('server_latency', "Server latency (ms)"),
+                       ('transcript_lag', "Transcript lag (ms)"), ('connect_time', "Connect (ms)"),
+                       ('send_behind_schedule', "Send lateness (ms)")):
+        summary = report[key]
+        if not summary['count']:
+            continue
+        print(f"{label:<22}" + "".join(f"{summary[f'p{pct}']:>9}" for pct in PERCENTILES)
+              + f"{summary['max']:>9}{summary['count']:>7}")
+    for error in report['errors']:
+        print(f"  error: {error}")
+
+
+async def main(paths):
+    wavs = [(os.path.basename(path), load_wav(path)) for path in paths]
+    sessions = [LoadSession(i, *wavs[i % len(wavs)]) for i in range(SESSIONS)]
+    interval = RAMP_UP_S / SESSIONS if SESSIONS else 0
+
+    print(f"Starting {SESSIONS} sessions against {SERVER_URI} over {RAMP_UP_S} s "
+          f"({CODEC}, {BATCH_MS} ms messages, speed {SPEED or 'max'}x)")
+    started = time.time()
+    tasks = []
+    for session in sessions:
+        tasks.append(asyncio.create_task(session.run()))
+        await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+
+    report = build_report(sessions, time.time() - started)
+    print_report(report)
+    if REPORT_PATH:
+        with open(REPORT_PATH, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {REPORT_PATH}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python load_test.py file.wav [file.wav ...]")
+        sys.exit(1)
+    if CODEC not in SUPPORTED_CODECS:
+        print(f"Codec {CODEC} isn't available here (supported: {', '.join(SUPPORTED_CODECS)})")
+        sys.exit(1)
+    try:
+        asyncio.run(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        print("Load test stopped.")
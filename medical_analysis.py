@@ -0,0 +1,113 @@
+import json
+
+from prompt_builder import build_prompt
+from streaming_json import TopLevelFieldParser, repair_json
+
+# Medical conversation analysis shared by the servers that expose /analyse.
+
+# Static part of the analysis prompt; kept ahead of the transcript so it can be prefix-cached
+MEDICAL_ANALYSIS_INSTRUCTIONS = """You are a medical AI assistant. Analyze the medical conversation transcript given at the end of this prompt and extract structured information in JSON format.
+
+Please provide a JSON response with the following structure:
+{
+    "summary": "A comprehensive paragraph summary of the entire conversation",
+    "symptoms": ["list of patient symptoms mentioned"],
+    "diagnosis": ["list of diagnoses mentioned by the doctor, in chronological order"],
+    "medications": [
+        {
+            "name": "medication name",
+            "dosage": "dosage amount",
+            "frequency": "frequency of administration"
+        }
+    ],
+    "follow_up": "follow-up instructions or next steps mentioned"
+}
+
+Rules:
+1. Extract only information that is explicitly mentioned in the conversation
+2. If no information is available for a category, use empty arrays [] or empty strings ""
+3. For medications, include all three fields (name, dosage, frequency) if mentioned
+4. Be accurate and don't infer information not present in the transcript
+5. Return only valid JSON format
+
+"""
+
+# Top-level fields of the analysis and their empty defaults, in generation order
+MEDICAL_ANALYSIS_FIELDS = {
+    "summary": "",
+    "symptoms": [],
+    "diagnosis": [],
+    "medications": [],
+    "follow_up": ""
+}
+
+def medical_analysis_prompt(transcription):
+    return build_prompt(MEDICAL_ANALYSIS_INSTRUCTIONS, transcription,
+                        suffix="\n\nRespond with only the JSON object, no additional text.\n")
+
+def analyze_medical_conversation(llm, transcription):
+    """
+    Analyze medical conversation using the given LLM backend (or router) and extract structured information
+    """
+    prompt = medical_analysis_prompt(transcription)
+    
+    try:
+        # Structured-JSON call; the backend strips any markdown fences
+        analysis = llm.complete_json(prompt.text, task='medical_analysis')
+        
+        return analysis
+        
+    except json.JSONDecodeError as e:
+        print(f"[LLM Analysis] JSON decode error: {str(e)}")
+        return {
+            "summary": "Error: Could not parse analysis response",
+            "symptoms": [],
+            "diagnosis": [],
+            "medications": [],
+            "follow_up": ""
+        }
+    except Exception as e:
+        print(f"[LLM Analysis] Error: {str(e)}")
+        return {
+            "summary": "Error: Could not analyze conversation",
+            "symptoms": [],
+            "diagnosis": [],
+            "medications": [],
+            "follow_up": ""
+        }
+
+def stream_medical_analysis(llm, transcription):
+    """
+    Streaming variant of analyze_medical_conversation. Yields ('field', {...})
+    events as soon as each top-level field of the JSON response is complete.
+    Fields missing at the end (truncated or failed generation) are recovered
+    from the repaired partial document, or sent with their empty default.
+    """
+    prompt = medical_analysis_prompt(transcription)
+    parser = TopLevelFieldParser()
+    
+    try:
+        for text in llm.stream(prompt.text):
+            for name, value in parser.feed(text):
+                yield ('field', {'name': name, 'value': value})
+    except Exception as e:
+        print(f"[LLM Analysis] Streaming error: {str(e)}")
+    
+    missing = [name for name in MEDICAL_ANALYSIS_FIELDS if name not in parser.fields]
+    if not missing:
+        return
+    
+    recovered = {}
+    if parser.document():
+        try:
+            recovered = repair_json(parser.document())
+            print(f"[LLM Analysis] Repaired truncated response, recovered: {list(recovered)}")
+        except json.JSONDecodeError as e:
+            print(f"[LLM Analysis] Could not repair response: {str(e)}")
+    
+    for name in missing:
+        yield ('field', {
+            'name': name,
+            'value': recovered.get(name, MEDICAL_ANALYSIS_FIELDS[name]),
+            'repaired': True
+        })
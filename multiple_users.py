@@ -24,6 +24,10 @@ async def handle_client(websocket):
 
     try:
         async for message in websocket:
+            # Text frames are JSON control messages from newer clients (hello, VAD markers).
+            # This server only takes raw 16 kHz PCM; the hello goes unanswered, so clients fall back to it.
+            if isinstance(message, str):
+                continue
             audio_buffer += message
 
             if len(audio_buffer) >= SAMPLE_RATE * SAMPLE_WIDTH * CHUNK_DURATION_MS / 1000:
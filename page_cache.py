@@ -0,0 +1,66 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import Response, request
+
+# Rendered-page caching for i2f1.py.
+# Pages are cached under a key that includes the version of the data they
+# show (e.g. the form's updated_at), so a stale entry is never served; it just
+# stops being requested and falls out of the LRU. Responses carry an ETag
+# derived from the same version plus Last-Modified, so repeat loads by the
+# same browser are answered with 304 Not Modified without rendering.
+
+MAX_CACHED_PAGES = 512
+
+
+class RenderedPageCache:
+    """Small thread-safe LRU of rendered HTML keyed by (page, version...)"""
+
+    def __init__(self, max_entries=MAX_CACHED_PAGES):
+        self.max_entries = max_entries
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            body = self._pages.get(key)
+            if body is not None:
+                self._pages.move_to_end(key)
+                return body
+
+        # Render outside the lock; two threads may render the same page once
+        body = render()
+        with self._lock:
+            self._pages[key] = body
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return body
+
+
+def make_etag(*parts):
+    return hashlib.sha1("|".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def conditional_page(etag, last_modified, render):
+    """
+    Return 304 if the client's If-None-Match / If-Modified-Since matches,
+    otherwise a 200 with the rendered page. `render` is only called on a miss.
+    `last_modified` is a unix timestamp (or None).
+    """
+    response = Response(mimetype='text/html')
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = datetime.fromtimestamp(int(last_modified), tz=timezone.utc)
+    # Always revalidate, so a new form version shows up immediately
+    response.cache_control.no_cache = True
+
+    if request.if_none_match.contains(etag) or (
+            not request.if_none_match and last_modified and request.if_modified_since
+            and request.if_modified_since >= response.last_modified):
+        response.status_code = 304
+        return response
+
+    response.set_data(render())
+    return response
@@ -0,0 +1,171 @@
+import math
+import os
+import re
+from functools import lru_cache
+
+# Prompt assembly for the analysis endpoints.
+# The static instructions and the template form a stable prefix that is
+# identical for every request using the same template, so provider-side
+# prompt/prefix caching can reuse it. The variable transcript always goes last
+# and is trimmed deterministically to fit the token budget.
+
+MAX_PROMPT_TOKENS = int(os.environ.get('MAX_PROMPT_TOKENS', '12000'))
+TRANSCRIPT_HEAD_SHARE = 0.3  # Share of the transcript budget kept from the start; the rest comes from the end
+
+REPORT_INSTRUCTIONS = """You are a medical AI assistant. Analyze the medical conversation transcript given at the end of this prompt and create a structured medical report using the provided template format.
+
+Instructions:
+1. Use the exact template structure provided
+2. Only include information that is explicitly mentioned in the transcript
+3. If information for any section is not mentioned in the transcript, leave that section blank (do not include placeholder text)
+4. Make all section titles bold using **Title** format
+5. Use proper line breaks for readability
+6. Be accurate and don't infer information not present in the transcript
+7. Follow the template structure exactly as provided
+
+Template Format:
+"""
+
+TRANSCRIPT_SUFFIX = "\n\nCreate the medical report based on the transcript and template:\n"
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+
+def count_tokens(text):
+    """
+    Count prompt tokens. Uses tiktoken when installed, otherwise the usual
+    ~4 characters per token estimate.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+class Prompt:
+    """An assembled prompt plus its token accounting"""
+
+    def __init__(self, prefix, transcript, suffix, prefix_tokens, transcript_tokens,
+                 original_transcript_tokens):
+        self.prefix = prefix
+        self.transcript = transcript
+        self.suffix = suffix
+        self.text = prefix + transcript + suffix
+        self.prefix_tokens = prefix_tokens
+        self.transcript_tokens = transcript_tokens
+        self.original_transcript_tokens = original_transcript_tokens
+        self.total_tokens = prefix_tokens + transcript_tokens + count_tokens(suffix)
+        self.trimmed = transcript_tokens < original_transcript_tokens
+
+    def usage(self):
+        return {
+            'prompt_tokens': self.total_tokens,
+            'prefix_tokens': self.prefix_tokens,
+            'transcript_tokens': self.transcript_tokens,
+            'transcript_trimmed': self.trimmed
+        }
+
+
+@lru_cache(maxsize=256)
+def compile_prefix(instructions, template=""):
+    """
+    Build (and cache) the static prefix for an instructions/template pair.
+    Returns the prefix text and its token count.
+    """
+    prefix = instructions + template.strip() + "\n\nTranscript:\n"
+    return prefix, count_tokens(prefix)
+
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+
+def compress_transcript(transcript):
+    """
+    Lossless-ish compression in one linear pass: collapse whitespace and drop
+    a whole sentence that exactly (case-sensitively) repeats the one before it
+    (Whisper likes to repeat "Thank you." over silence).
+    """
+    kept = []
+    for sentence in _SENTENCE_SPLIT.split(" ".join(transcript.split())):
+        if not kept or sentence != kept[-1]:
+            kept.append(sentence)
+    return " ".join(kept)
+
+
+def fit_transcript(transcript, budget):
+    """
+    Fit the transcript into `budget` tokens. A transcript that fits is
+    returned unchanged; otherwise it is compressed first, and if still too
+    long, whole sentences are kept from the start and the end and the middle
+    is replaced by an omission marker. Deterministic for a given input and
+    budget.
+    """
+    if count_tokens(transcript) <= budget:
+        return transcript
+
+    text = compress_transcript(transcript)
+    if count_tokens(text) <= budget:
+        return text
+
+    sentences = _SENTENCE_SPLIT.split(text)
+    marker_tokens = count_tokens("[... transcript trimmed ...]") + 2
+    head_budget = int((budget - marker_tokens) * TRANSCRIPT_HEAD_SHARE)
+    tail_budget = budget - marker_tokens - head_budget
+
+    head, used = [], 0
+    for sentence in sentences:
+        cost = count_tokens(sentence) + 1
+        if used + cost > head_budget:
+            break
+        head.append(sentence)
+        used += cost
+
+    tail, used = [], 0
+    for sentence in reversed(sentences[len(head):]):
+        cost = count_tokens(sentence) + 1
+        if used + cost > tail_budget:
+            break
+        tail.append(sentence)
+        used += cost
+    tail.reverse()
+
+    # A single huge sentence (no punctuation from the ASR) - fall back to characters
+    if not head and not tail:
+        chars = max(budget - marker_tokens, 0) * 4
+        if chars <= 0:
+            # No room for any text; text[-0:] would be the whole transcript
+            marker = "[... transcript trimmed ...]"
+            return marker if count_tokens(marker) <= budget else ""
+        return text[:chars // 3] + " [... transcript trimmed ...] " + text[-(chars - chars // 3):]
+
+    omitted = len(sentences) - len(head) - len(tail)
+    return " ".join(head + [f"[... {omitted} sentences omitted ...]"] + tail)
+
+
+def build_prompt(instructions, transcription, template="", suffix=TRANSCRIPT_SUFFIX,
+                 max_tokens=MAX_PROMPT_TOKENS):
+    """
+    Assemble a prompt as: cached static prefix (instructions + template),
+    then the transcript trimmed to the remaining budget, then a short suffix.
+    """
+    prefix, prefix_tokens = compile_prefix(instructions, template)
+    original_tokens = count_tokens(transcription)
+    budget = max_tokens - prefix_tokens - count_tokens(suffix)
+
+    transcript = fit_transcript(transcription, budget)
+    prompt = Prompt(prefix, transcript, suffix, prefix_tokens, count_tokens(transcript), original_tokens)
+
+    print(f"[Prompt] {prompt.total_tokens} tokens "
+          f"(prefix {prefix_tokens}, transcript {prompt.transcript_tokens}/{original_tokens})"
+          f"{' - transcript trimmed' if prompt.trimmed else ''}")
+    return prompt
+
+
+def build_report_prompt(transcription, template, max_tokens=MAX_PROMPT_TOKENS):
+    """Prompt for the template-driven medical report (/analyse)"""
+    return build_prompt(REPORT_INSTRUCTIONS, transcription, template, max_tokens=max_tokens)
@@ -0,0 +1,88 @@
+import math
+import numpy as np
+
+# Streaming sample-rate conversion for client audio.
+#
+# Browsers capture at 44.1 or 48 kHz; the model wants 16 kHz mono. The
+# resampler upsamples by `up` and decimates by `down` (in_rate * up / down ==
+# out_rate) with a windowed-sinc low-pass split into `up` polyphase
+# branches, so only the taps that touch real input samples are computed. Each
+# block of output samples is one gather + multiply + sum in numpy. The last
+# taps - 1 input samples and the fractional output position carry over to the
+# next frame, so frame boundaries don't click or drift.
+
+ZERO_CROSSINGS = 16  # Half-width of the sinc, in zero crossings at the lower rate
+ROLLOFF = 0.94  # Cutoff as a fraction of the lower Nyquist frequency
+KAISER_BETA = 8.6  # ~80 dB stop-band attenuation
+MAX_FACTOR = 1000  # Filter length grows with the ratio's terms (44.1 -> 16 kHz is 160/441)
+
+
+def design_filter(up, down):
+    """Polyphase low-pass bank, shape (up, taps per phase)"""
+    factor = max(up, down)
+    delay = ZERO_CROSSINGS * factor  # Odd-length symmetric filter: a whole-sample group delay
+    cutoff = ROLLOFF / factor  # Relative to the upsampled Nyquist frequency
+    n = np.arange(2 * delay + 1) - delay
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(len(n), KAISER_BETA)
+    h *= up / h.sum()  # Unity DC gain after zero-stuffing by `up`
+    # Zero-pad to a whole number of taps per branch; branch p holds h[p], h[p + up], ...
+    taps = -(-len(h) // up)
+    h = np.concatenate((h, np.zeros(taps * up - len(h))))
+    return h.reshape(taps, up).T.astype(np.float32), delay
+
+
+class StreamResampler:
+    """
+    Converts interleaved int16 PCM at `in_rate` with `channels` channels into
+    mono int16 PCM at `out_rate`, one frame at a time.
+    """
+
+    def __init__(self, in_rate, out_rate, channels=1):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.passthrough = in_rate == out_rate
+        self._pending = b""  # Bytes of an incomplete sample frame
+
+        if self.passthrough:
+            return
+        g = math.gcd(in_rate, out_rate)
+        self.up, self.down = out_rate // g, in_rate // g
+        if max(self.up, self.down) > MAX_FACTOR:
+            raise ValueError(f"Can't resample {in_rate} Hz to {out_rate} Hz (ratio {self.up}/{self.down} too fine)")
+        self._bank, delay = design_filter(self.up, self.down)
+        self.taps = self._bank.shape[1]
+        self._tap_offsets = np.arange(self.taps)
+        self._history = np.zeros(self.taps - 1, dtype=np.float32)
+        # Position of the next output sample in upsampled units, relative to the start of
+        # the history; starting one group delay in lines output 0 up with input sample 0
+        self._t = (self.taps - 1) * self.up + delay
+
+    def process(self, pcm):
+        data = self._pending + bytes(pcm)
+        frame_bytes = 2 * self.channels
+        usable = len(data) - len(data) % frame_bytes
+        self._pending = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype='<i2')
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1, dtype=np.float32)
+
+        if self.passthrough:
+            return samples.astype('<i2').tobytes() if self.channels > 1 else data[:usable]
+        return self._resample(samples.astype(np.float32))
+
+    def _resample(self, samples):
+        x = np.concatenate((self._history, samples))
+        # Every output whose newest tap falls inside x can be computed now
+        count = max(0, -(-(len(x) * self.up - self._t) // self.down))
+        positions = self._t + self.down * np.arange(count)
+        phases = positions % self.up
+        bases = positions // self.up
+        window = x[bases[:, None] - self._tap_offsets[None, :]]
+        out = np.einsum('ij,ij->i', window, self._bank[phases])
+
+        self._t += count * self.down
+        consumed = len(x) - (self.taps - 1)
+        self._t -= consumed * self.up
+        self._history = x[consumed:]
+        return np.clip(np.rint(out), -32768, 32767).astype('<i2').tobytes()
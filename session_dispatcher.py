@@ -0,0 +1,310 @@
+# session_dispatcher.py
+# Front process for running several model workers on one machine.
+# Starts DISPATCHER_WORKERS copies of asgi_server.py, each with its own model,
+# listening on a unix socket, and accepts the streaming WebSocket clients on
+# WS_PORT. Each new session goes to the least loaded healthy worker that
+# isn't saturated, and its frames are proxied over that worker's socket both
+# ways, unchanged. Capacity is DISPATCHER_WORKERS x WORKER_MAX_SESSIONS.
+#
+#   DISPATCHER_WORKERS=2 WORKER_GPUS=0,1 python session_dispatcher.py
+#
+# Load comes from two places: the sessions the dispatcher has assigned
+# (exact, immediate) and each worker's /status (queued chunks, recent model
+# utilisation), polled every LOAD_POLL_INTERVAL_S.
+
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from http import HTTPStatus
+
+import websockets
+
+from stream_protocol import REJECT_HELLO_WAIT_S, rejection_message, requested_protocol
+
+# Configuration
+HOST = '0.0.0.0'
+WS_PORT = int(os.environ.get('WS_PORT', '8080'))
+WORKERS = int(os.environ.get('DISPATCHER_WORKERS', '2'))
+WORKER_MAX_SESSIONS = int(os.environ.get('WORKER_MAX_SESSIONS', '5'))
+WORKER_GPUS = [gpu for gpu in os.environ.get('WORKER_GPUS', '').split(',') if gpu]  # Round-robin CUDA_VISIBLE_DEVICES
+WORKER_SOCKET_DIR = os.environ.get('WORKER_SOCKET_DIR', '/tmp/transcriber-workers')
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'asgi_server.py')
+LOAD_POLL_INTERVAL_S = 1.0
+SATURATED_UTILIZATION = 0.9  # Model busy this fraction of the last poll interval
+SATURATED_QUEUE = 2  # Stream chunks waiting for the model
+RESTART_DELAY_S = 5  # Before restarting a worker that exited; doubles while it keeps failing at startup
+RESTART_MAX_DELAY_S = 300
+MAX_STARTUP_FAILURES = int(os.environ.get('WORKER_MAX_STARTUP_FAILURES', '5'))  # In a row, then stop restarting
+SHUTDOWN_GRACE_S = float(os.environ.get('SHUTDOWN_GRACE_S', '15'))
+
+#===================#
+# Workers
+#===================#
+
+class Worker:
+    """One asgi_server.py process and what the dispatcher knows about its load"""
+
+    def __init__(self, index):
+        self.index = index
+        self.socket_path = os.path.join(WORKER_SOCKET_DIR, f"worker-{index}.sock")
+        self.process = None
+        self.healthy = False  # Last /status poll answered
+        self.sessions = 0  # Sessions the dispatcher has routed here and not yet closed
+        self.sessions_total = 0
+        self.queued_chunks = 0
+        self.utilization = 0.0
+        self._last_busy = None  # (time, busy_seconds) from the previous poll
+        self.restarts = 0
+        self.became_ready = False  # Answered /status since the last start
+        self.startup_failures = 0  # Consecutive exits before ever becoming ready
+        self.gave_up = False
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        env = dict(os.environ, ASGI_UDS=self.socket_path, MAX_USERS=str(WORKER_MAX_SESSIONS))
+        if WORKER_GPUS:
+            env['CUDA_VISIBLE_DEVICES'] = WORKER_GPUS[self.index % len(WORKER_GPUS)]
+        self.process = await asyncio.create_subprocess_exec(sys.executable, WORKER_SCRIPT, env=env)
+        self.healthy = False
+        self.became_ready = False
+        self._last_busy = None
+        print(f"[Dispatcher] Started worker {self.index} (pid {self.process.pid}) on {self.socket_path}")
+
+    async def supervise(self):
+        """
+        Restart the worker whenever it exits, until shutdown. A worker that
+        keeps dying before it ever answers /status (e.g. a crash on import) is
+        restarted with exponential backoff, and given up on after
+        MAX_STARTUP_FAILURES attempts in a row.
+        """
+        while not shutting_down:
+            await self.process.wait()
+            self.healthy = False
+            if shutting_down:
+                break
+
+            if self.became_ready:
+                self.startup_failures = 0
+                delay = RESTART_DELAY_S
+                print(f"[Dispatcher] Worker {self.index} exited with {self.process.returncode}; "
+                      f"restarting in {delay} s")
+            else:
+                self.startup_failures += 1
+                if self.startup_failures >= MAX_STARTUP_FAILURES:
+                    self.gave_up = True
+                    print(f"[Dispatcher] Worker {self.index} exited with {self.process.returncode} before "
+                          f"becoming ready {self.startup_failures} times in a row; not restarting it "
+                          f"(check its output above)")
+                    break
+                delay = min(RESTART_DELAY_S * 2 ** (self.startup_failures - 1), RESTART_MAX_DELAY_S)
+                print(f"[Dispatcher] Worker {self.index} exited with {self.process.returncode} before becoming "
+                      f"ready ({self.startup_failures}/{MAX_STARTUP_FAILURES}); restarting in {delay} s")
+            await asyncio.sleep(delay)
+            self.restarts += 1
+            await self.start()
+
+    async def poll(self):
+        try:
+            status = await asyncio.wait_for(fetch_status(self.socket_path), LOAD_POLL_INTERVAL_S)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            if self.healthy:
+                print(f"[Dispatcher] Worker {self.index} stopped answering")
+            self.healthy = False
+            return
+
+        if not self.healthy:
+            print(f"[Dispatcher] Worker {self.index} ready")
+        self.healthy = status.get('status') == 'online'
+        self.became_ready = True
+        scheduler = status.get('scheduler', {})
+        self.queued_chunks = scheduler.get('queued_stream_chunks', 0)
+        now, busy = time.time(), scheduler.get('busy_seconds', 0.0)
+        if self._last_busy is not None and now > self._last_busy[0]:
+            self.utilization = min(1.0, (busy - self._last_busy[1]) / (now - self._last_busy[0]))
+        self._last_busy = (now, busy)
+
+    def saturated(self):
+        return (self.sessions >= WORKER_MAX_SESSIONS or self.queued_chunks >= SATURATED_QUEUE
+                or self.utilization >= SATURATED_UTILIZATION)
+
+    def load(self):
+        return self.sessions / WORKER_MAX_SESSIONS + self.utilization + self.queued_chunks / SATURATED_QUEUE
+
+    def status(self):
+        return {
+            'index': self.index,
+            'pid': self.process.pid if self.process else None,
+            'healthy': self.healthy,
+            'saturated': self.saturated(),
+            'sessions': self.sessions,
+            'sessions_total': self.sessions_total,
+            'queued_chunks': self.queued_chunks,
+            'utilization': round(self.utilization, 3),
+            'restarts': self.restarts,
+            'gave_up': self.gave_up
+        }
+
+async def fetch_status(socket_path):
+    """GET /status from a worker over its unix socket"""
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        writer.write(b"GET /status HTTP/1.1\r\nHost: worker\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    if not head.startswith(b"HTTP/1.1 200"):
+        raise ValueError(f"Worker status: {head.splitlines()[0] if head else 'no response'}")
+    return json.loads(body)
+
+workers = [Worker(i) for i in range(WORKERS)]
+shutting_down = False
+
+def pick_worker():
+    """Least loaded healthy worker with room, or None when every worker is saturated"""
+    candidates = [worker for worker in workers if worker.healthy and not worker.saturated()]
+    if not candidates:
+        return None
+    return min(candidates, key=Worker.load)
+
+async def poll_workers():
+    while True:
+        await asyncio.gather(*(worker.poll() for worker in workers))
+        await asyncio.sleep(LOAD_POLL_INTERVAL_S)
+
+#=========================#
+# WebSocket Proxy Section
+#=========================#
+
+async def pump(source, destination):
+    try:
+        async for message in source:
+            await destination.send(message)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+def client_close_code(code):
+    """A worker close code that may be sent on the wire, else 1011 (1005/1006 mean the worker died)"""
+    if 1000 <= code <= 1003 or 1007 <= code <= 1014 or 3000 <= code <= 4999:
+        return code
+    return 1011
+
+async def handle_websocket_client(websocket):
+    worker = None if shutting_down else pick_worker()
+    if worker is None:
+        reason = "Server is shutting down" if shutting_down else "Server at maximum capacity"
+        print(f"[Dispatcher] {reason}. Rejecting client: {websocket.remote_address}")
+        # Answer in the protocol the client's first message asks for
+        try:
+            first = await asyncio.wait_for(websocket.recv(), REJECT_HELLO_WAIT_S)
+        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+            first = None
+        try:
+            await websocket.send(rejection_message(requested_protocol(first), reason))
+            await websocket.close(1013 if shutting_down else 1008, reason)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        return
+
+    # Count the session before connecting, so a burst of new clients spreads out
+    worker.sessions += 1
+    worker.sessions_total += 1
+    print(f"[Dispatcher] Client {websocket.remote_address} -> worker {worker.index} "
+          f"({worker.sessions}/{WORKER_MAX_SESSIONS} sessions)")
+    try:
+        address = websocket.remote_address
+        async with websockets.unix_connect(worker.socket_path, uri="ws://worker/", max_size=None, ping_interval=None,
+                                           additional_headers={'X-Forwarded-For': f"{address[0]}:{address[1]}"}
+                                           ) as upstream:
+            tasks = [asyncio.create_task(pump(websocket, upstream)),
+                     asyncio.create_task(pump(upstream, websocket))]
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                task.cancel()
+            # Pass the worker's close code (e.g. 1001 on shutdown) through to the client
+            if upstream.close_code is not None:
+                code = client_close_code(upstream.close_code)
+                reason = upstream.close_reason if code == upstream.close_code else "Transcription worker failed"
+                await websocket.close(code, reason or "")
+    except (OSError, websockets.exceptions.InvalidHandshake) as e:
+        print(f"[Dispatcher] Worker {worker.index} unreachable: {str(e)}")
+        worker.healthy = False
+        await websocket.close(1011, "Transcription worker unavailable")
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        worker.sessions -= 1
+
+def process_request(connection, request):
+    """Plain HTTP GET /status on the WebSocket port: dispatcher and worker load"""
+    if request.path != '/status':
+        return None
+    return connection.respond(HTTPStatus.OK, json.dumps({
+        'status': 'draining' if shutting_down else 'online',
+        'active_clients': sum(worker.sessions for worker in workers),
+        'max_clients': WORKERS * WORKER_MAX_SESSIONS,
+        'available_slots': sum(max(0, WORKER_MAX_SESSIONS - worker.sessions)
+                               for worker in workers if worker.healthy),
+        'uptime': time.time() - server_start_time,
+        'workers': [worker.status() for worker in workers]
+    }) + "\n")
+
+#===================#
+# Main Entry Point
+#===================#
+
+server_start_time = time.time()
+
+async def shutdown(stop):
+    """Stop taking sessions and let each worker drain its own (they close them with 1001)"""
+    global shutting_down
+    if shutting_down:
+        return
+    shutting_down = True
+    print("[Dispatcher] Shutting down workers...")
+    for worker in workers:
+        if worker.process and worker.process.returncode is None:
+            worker.process.send_signal(signal.SIGTERM)
+    waits = [worker.process.wait() for worker in workers if worker.process]
+    try:
+        await asyncio.wait_for(asyncio.gather(*waits), SHUTDOWN_GRACE_S + 5)
+    except asyncio.TimeoutError:
+        for worker in workers:
+            if worker.process.returncode is None:
+                worker.process.kill()
+    stop.set_result(None)
+
+async def main():
+    os.makedirs(WORKER_SOCKET_DIR, exist_ok=True)
+    for worker in workers:
+        await worker.start()
+    for worker in workers:
+        asyncio.create_task(worker.supervise())
+    asyncio.create_task(poll_workers())
+
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(shutdown(stop)))
+
+    async with websockets.serve(
+        handle_websocket_client,
+        HOST,
+        WS_PORT,
+        process_request=process_request,
+        ping_interval=60,
+        ping_timeout=60,
+        max_size=None
+    ):
+        print(f"[Dispatcher] Listening on {HOST}:{WS_PORT} with {WORKERS} workers "
+              f"x {WORKER_MAX_SESSIONS} sessions")
+        await stop
+    print("[Dispatcher] Stopped")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import struct
+import sys
+import time
+import websockets
+
+# Capture and replay of WebSocket transcription sessions.
+#
+# With RECORD_SESSIONS_DIR set, the server writes every incoming message of
+# each session (audio frames and JSON control messages, byte for byte) with its
+# arrival time to <dir>/<start>-<session id>.wsrec. Replaying a file against a
+# server reproduces the session's chunking, VAD markers and timing exactly:
+#
+#   python session_recorder.py info session.wsrec
+#   python session_recorder.py replay session.wsrec [ws://host:port]
+#
+# File format (big-endian):
+#   magic "WSREC1\n\0", uint32 length + JSON metadata (address, start time, ...)
+#   records: uint8 kind, uint64 arrival offset in microseconds since the start,
+#            uint32 length, payload
+#   kind 0 = text message, 1 = binary message, 2 = connection closed (no payload)
+
+RECORD_SESSIONS_DIR = os.environ.get('RECORD_SESSIONS_DIR')  # Unset = recording off
+RECORD_MAX_BYTES = int(os.environ.get('RECORD_MAX_BYTES', str(64 * 1024 * 1024)))  # Per session
+REPLAY_URI = os.environ.get('REPLAY_URI', "ws://localhost:8080")
+REPLAY_SPEED = float(os.environ.get('REPLAY_SPEED', '1.0'))  # 2.0 = twice as fast, 0 = no waiting
+
+MAGIC = b"WSREC1\n\0"
+RECORD_HEADER = struct.Struct(">BQI")
+LENGTH = struct.Struct(">I")
+
+TEXT = 0
+BINARY = 1
+CLOSED = 2
+
+
+class RecordingError(Exception):
+    """Raised for files that aren't session recordings"""
+
+
+class SessionRecorder:
+    """
+    Appends one session's incoming messages to a recording file. Writes go
+    through a buffered file, so record() is cheap enough for the event loop.
+    """
+
+    def __init__(self, path, metadata):
+        self.path = path
+        self.started = time.time()
+        self.bytes_written = 0
+        self.messages = 0
+        self.truncated = False
+        self._file = open(path, 'wb', buffering=256 * 1024)
+        header = json.dumps({**metadata, 'started': self.started}).encode('utf-8')
+        self._write(MAGIC + LENGTH.pack(len(header)) + header)
+
+    def record(self, message, received_at=None):
+        if self._file is None or self.truncated:
+            return
+        if isinstance(message, str):
+            kind, payload = TEXT, message.encode('utf-8')
+        else:
+            kind, payload = BINARY, bytes(message)
+        if self.bytes_written + RECORD_HEADER.size + len(payload) > RECORD_MAX_BYTES:
+            # Keep what we have; the replay just ends early
+            self.truncated = True
+            print(f"[Recorder] {os.path.basename(self.path)} reached {RECORD_MAX_BYTES} bytes; recording stopped")
+            return
+        self._write(RECORD_HEADER.pack(kind, self._offset_us(received_at), len(payload)) + payload)
+        self.messages += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        if not self.truncated:
+            self._write(RECORD_HEADER.pack(CLOSED, self._offset_us(None), 0))
+        self._file.close()
+        self._file = None
+        print(f"[Recorder] Saved {self.messages} messages ({self.bytes_written / 1024:.0f} KB) to {self.path}")
+
+    def _offset_us(self, at):
+        return max(0, int(((at or time.time()) - self.started) * 1e6))
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+
+def open_recorder(session_id, **metadata):
+    """Start recording a session, or return None when recording is off (or the file can't be created)"""
+    if not RECORD_SESSIONS_DIR:
+        return None
+    try:
+        os.makedirs(RECORD_SESSIONS_DIR, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{session_id}.wsrec"
+        return SessionRecorder(os.path.join(RECORD_SESSIONS_DIR, name), {'session_id': session_id, **metadata})
+    except OSError as e:
+        print(f"[Recorder] Can't record session {session_id}: {str(e)}")
+        return None
+
+
+def read_recording(path):
+    """Returns (metadata, [(kind, offset_s, payload)]); a partially written tail is ignored"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise RecordingError(f"{path} is not a session recording")
+
+    offset = len(MAGIC)
+    (length,) = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    metadata = json.loads(data[offset:offset + length])
+    offset += length
+
+    records = []
+    while offset + RECORD_HEADER.size <= len(data):
+        kind, offset_us, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(data):
+            break
+        payload = data[offset:offset + length]
+        offset += length
+        records.append((kind, offset_us / 1e6, payload.decode('utf-8') if kind == TEXT else payload))
+    return metadata, records
+
+
+#===================#
+# Replay
+#===================#
+
+async def replay(path, uri=REPLAY_URI, speed=REPLAY_SPEED):
+    """
+    Push a recorded session into a server with the original (or scaled)
+    inter-arrival timing and print what the server sends back.
+    Returns the server's messages as [(seconds since start, message)].
+    """
+    metadata, records = read_recording(path)
+    responses = []
+    print(f"[Replay] {path}: {len(records)} messages from {metadata.get('address')} -> {uri} "
+          f"(speed {speed or 'max'}x)")
+
+    async with websockets.connect(uri, max_size=None) as websocket:
+        start = time.time()
+
+        async def receive():
+            async for message in websocket:
+                at = time.time() - start
+                responses.append((at, message))
+                print(f"  {at:8.3f}s  <- {message if isinstance(message, str) else f'{len(message)} bytes'}")
+
+        receiver = asyncio.create_task(receive())
+        for kind, offset_s, payload in records:
+            if speed > 0:
+                delay = start + offset_s / speed - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if kind == CLOSED:
+                break
+            await websocket.send(payload)
+
+        # Wait for the answers to the last messages before closing
+        await asyncio.sleep(2)
+        receiver.cancel()
+
+    print(f"[Replay] Done: {len(responses)} messages received in {time.time() - start:.1f} s")
+    return responses
+
+
+def describe(path):
+    metadata, records = read_recording(path)
+    binary = [payload for kind, _, payload in records if kind == BINARY]
+    text = [payload for kind, _, payload in records if kind == TEXT]
+    duration = records[-1][1] if records else 0
+    print(json.dumps(metadata, indent=2))
+    print(f"{len(binary)} binary messages ({sum(len(p) for p in binary) / 1024:.0f} KB), "
+          f"{len(text)} text messages, {duration:.1f} s, "
+          f"{'closed cleanly' if records and records[-1][0] == CLOSED else 'no close record'}")
+    for payload in text:
+        print(f"  text: {payload}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ('info', 'replay'):
+        print("Usage: python session_recorder.py info|replay file.wsrec [ws://host:port]")
+        sys.exit(1)
+    if sys.argv[1] == 'info':
+        describe(sys.argv[2])
+    else:
+        try:
+            asyncio.run(replay(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else REPLAY_URI))
+        except KeyboardInterrupt:
+            print("Replay stopped.")
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+
+# Request coalescing for expensive model / LLM calls.
+# Concurrent calls with the same key share one execution: the first caller
+# runs the function, later callers block until it finishes and receive the
+# same result (or exception). Nothing is cached once the call completes.
+# Streamed responses are coalesced by StreamRegistry.start(key=...) in sse.py.
+
+
+def content_key(*parts):
+    """Stable hash of request content (bytes or str parts) for use as a key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        # Length prefix so ("ab", "c") and ("a", "bc") differ
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self, name="single-flight"):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless a call with the same key is already in
+        flight, in which case wait for that one. Returns (result, shared) where
+        `shared` is True for callers that joined an existing call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            print(f"[{self.name}] Joining in-flight call {key[:12]} ({call.waiters} waiting)")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
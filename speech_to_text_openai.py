@@ -3,11 +3,12 @@ import soundfile as sf
 import io
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-import tempfile
-import os
 import json
 from openai import AzureOpenAI
 from faster_whisper import WhisperModel
+from single_flight import SingleFlight, content_key
+from llm_backends import AzureOpenAIBackend, create_router
+from prompt_builder import build_report_prompt
 
 # Configuration
 HOST = '0.0.0.0'
@@ -37,6 +38,11 @@ azure_client = AzureOpenAI(
 )
 print("Azure OpenAI client initialized successfully!")
 
+# All analysis calls go through the router (LLM_BACKEND=mock for offline load tests)
+MEDICAL_SYSTEM_PROMPT = "You are a medical AI assistant specialized in analyzing medical conversations and creating structured reports."
+llm = create_router([AzureOpenAIBackend(azure_client, AZURE_DEPLOYMENT_NAME, system_prompt=MEDICAL_SYSTEM_PROMPT,
+                                        max_completion_tokens=2000)])
+
 #===================#
 # Flask API Section
 #===================#
@@ -44,88 +50,49 @@ print("Azure OpenAI client initialized successfully!")
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-def analyze_with_template(transcription, template):
-    """
-    Analyze medical conversation using Azure OpenAI with provided template
+def analyze_with_template(prompt):
     """
-    prompt = f"""
-    You are a medical AI assistant. Analyze the following medical conversation transcript and create a structured medical report using the provided template format.
-
-    Transcript: "{transcription}"
-
-    Template Format:
-    {template}
-
-    Instructions:
-    1. Use the exact template structure provided
-    2. Only include information that is explicitly mentioned in the transcript
-    3. If information for any section is not mentioned in the transcript, leave that section blank (do not include placeholder text)
-    4. Make all section titles bold using **Title** format
-    5. Use proper line breaks for readability
-    6. Be accurate and don't infer information not present in the transcript
-    7. Follow the template structure exactly as provided
-
-    Create the medical report based on the transcript and template:
+    Analyze medical conversation using the configured LLM backend (Azure OpenAI by default) with provided template.
+    `prompt` comes from build_report_prompt (cacheable prefix, transcript last).
     """
-    
     try:
-        # Updated message format with developer role and proper structure
-        messages = [
-            {
-                "role": "developer",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "You are a medical AI assistant specialized in analyzing medical conversations and creating structured reports."
-                    }
-                ]
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ]
-            }
-        ]
-        
-        response = azure_client.chat.completions.create(
-            model=AZURE_DEPLOYMENT_NAME,
-            messages=messages,
-            max_completion_tokens=2000,
-            stream=False
-        )
-        
-        return response.choices[0].message.content.strip()
+        # The backend wraps the prompt with the developer system message
+        return llm.complete(prompt.text)
         
     except Exception as e:
         print(f"[Azure OpenAI Analysis] Error: {str(e)}")
         return f"Error: Could not analyze conversation - {str(e)}"
 
+# Concurrent identical uploads / analysis requests share one model or LLM call
+transcribe_flight = SingleFlight("Transcribe")
+analyse_flight = SingleFlight("Analyse")
+
+def transcribe_audio_bytes(audio_bytes):
+    """
+    Transcribe a complete uploaded audio file held in memory
+    """
+    segments, info = model.transcribe(io.BytesIO(audio_bytes), language="en")
+    
+    # Combine all segments into a single transcription
+    transcription = " ".join([segment.text for segment in segments])
+    return transcription, info
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     if 'audio' not in request.files:
         return jsonify({'error': 'No audio file provided'}), 400
     
-    audio_file = request.files['audio']
-    
-    # Save uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-        audio_file.save(temp_file.name)
-        temp_filename = temp_file.name
+    audio_bytes = request.files['audio'].read()
     
     try:
-        print(f"[Flask API] Processing full audio file: {temp_filename}")
+        print(f"[Flask API] Processing full audio file: {len(audio_bytes)} bytes")
         
-        # Transcribe the audio file
-        segments, info = model.transcribe(temp_filename, language="en")
-        
-        # Combine all segments into a single transcription
-        transcription = " ".join([segment.text for segment in segments])
+        # Transcribe the audio file (joins an identical in-flight request if there is one)
+        (transcription, info), shared = transcribe_flight.do(
+            content_key('transcribe', audio_bytes), transcribe_audio_bytes, audio_bytes
+        )
         
-        print(f"[Flask API] Transcription complete: {len(transcription)} characters")
+        print(f"[Flask API] Transcription complete: {len(transcription)} characters{' (shared)' if shared else ''}")
         
         return jsonify({
             'transcription': transcription,
@@ -136,11 +103,6 @@ def transcribe():
     except Exception as e:
         print(f"[Flask API] Error during transcription: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.unlink(temp_filename)
 
 @app.route('/analyse', methods=['POST'])
 def analyse():
@@ -164,11 +126,18 @@ def analyse():
         print(f"[Flask API - Analyse] Transcription length: {len(transcription)} characters")
         print(f"[Flask API - Analyse] Template length: {len(template)} characters")
         
-        # Get the complete analysis
-        analysis_result = analyze_with_template(transcription, template)
+        # Build the prompt (static prefix first, transcript trimmed to budget)
+        prompt = build_report_prompt(transcription, template)
+        
+        # Get the complete analysis (joins an identical in-flight request if there is one)
+        analysis_result, shared = analyse_flight.do(
+            content_key('analyse', transcription, template), analyze_with_template, prompt
+        )
+        if shared:
+            print("[Flask API - Analyse] Shared result of an identical in-flight request")
         
         # Return simple JSON response like the second code
-        return jsonify({'data': analysis_result})
+        return jsonify({'data': analysis_result, 'usage': prompt.usage()})
     
     except Exception as e:
         print(f"[Flask API - Analyse] Error during analysis: {str(e)}")
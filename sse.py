@@ -0,0 +1,236 @@
+import json
+import threading
+import time
+import uuid
+
+from flask import Response
+
+# Server-Sent Events transport for streamed LLM output.
+#
+# The upstream generator is pumped by a background thread into an EventStream,
+# which keeps every chunk (with a monotonically increasing ID) for a short time
+# after the stream ends. HTTP responses only read from the EventStream, so a
+# client that drops can reconnect with Last-Event-ID and resume from the replay
+# buffer without a new LLM request.
+#
+# Responses coalesce tiny upstream chunks: once a chunk is pending the reader
+# waits up to SSE_COALESCE_MS for more, or until SSE_COALESCE_BYTES are pending.
+# The coalesced event carries the ID of the last chunk it contains, so resuming
+# from it is exact. While nothing arrives a heartbeat comment keeps proxies
+# from closing the connection.
+
+SSE_COALESCE_MS = 50
+SSE_COALESCE_BYTES = 512
+SSE_HEARTBEAT_S = 15
+SSE_RETRY_MS = 2000  # Reconnect delay suggested to EventSource clients
+SSE_REPLAY_TTL_S = 300  # Keep finished streams this long for reconnects
+SSE_MAX_STREAMS = 1000
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',  # Disable proxy buffering (nginx)
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type, Last-Event-ID',
+}
+
+
+def format_event(data, event=None, event_id=None, retry=None):
+    """Serialize one SSE event; `data` is JSON-encoded"""
+    lines = []
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def format_comment(text):
+    return f": {text}\n\n"
+
+
+class EventStream:
+    """
+    Append-only buffer of chunks produced by one upstream generator.
+    A chunk is either plain text (sent as the default `message` event and
+    coalesced with neighbouring text) or a named event with a JSON payload.
+    Chunk IDs start at 1; readers wait on a condition variable for new chunks.
+    """
+
+    def __init__(self, stream_id):
+        self.id = stream_id
+        self.chunks = []  # (event name or None, payload)
+        self._size_totals = []  # Running total of chunk sizes, for min_bytes waits
+        self.done = False
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cond = threading.Condition()
+
+    def publish(self, data, event=None):
+        with self._cond:
+            size = len(data) if event is None else SSE_COALESCE_BYTES
+            total = self._size_totals[-1] if self._size_totals else 0
+            self.chunks.append((event, data))
+            self._size_totals.append(total + size)
+            self._cond.notify_all()
+
+    def close(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def _bytes_after(self, after_id):
+        if len(self.chunks) <= after_id:
+            return 0
+        before = self._size_totals[after_id - 1] if after_id > 0 else 0
+        return self._size_totals[-1] - before
+
+    def wait(self, after_id, timeout, min_bytes=1):
+        """
+        Wait until at least `min_bytes` are available after `after_id`
+        (a named event counts as a full batch), the stream finishes, or
+        `timeout` expires. Returns (chunks after after_id, done).
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                if self.done or self._bytes_after(after_id) >= min_bytes:
+                    return self.chunks[after_id:], self.done
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return self.chunks[after_id:], self.done
+                self._cond.wait(remaining)
+
+    def events(self, last_event_id=0):
+        """
+        Generator of SSE-formatted strings starting after `last_event_id`.
+        Implements coalescing and heartbeats; ends after the `done` event.
+        """
+        last_id = last_event_id
+        yield format_event({'stream_id': self.id}, event='stream', retry=SSE_RETRY_MS)
+
+        while True:
+            chunks, done = self.wait(last_id, SSE_HEARTBEAT_S)
+            if not chunks and not done:
+                yield format_comment("heartbeat")
+                continue
+
+            if chunks and not done:
+                # Give the producer a short window to add more before sending
+                chunks, done = self.wait(last_id, SSE_COALESCE_MS / 1000, min_bytes=SSE_COALESCE_BYTES)
+
+            text = []
+            for event, data in chunks:
+                last_id += 1
+                if event is None:
+                    text.append(data)
+                    continue
+                if text:
+                    yield format_event({'data': "".join(text)}, event_id=last_id - 1)
+                    text = []
+                yield format_event(data, event=event, event_id=last_id)
+            if text:
+                yield format_event({'data': "".join(text)}, event_id=last_id)
+
+            if done and last_id >= len(self.chunks):
+                payload = {'stream_id': self.id}
+                if self.error:
+                    payload['error'] = self.error
+                yield format_event(payload, event='done', event_id=last_id)
+                return
+
+
+class StreamRegistry:
+    """
+    Tracks live and recently finished EventStreams by ID so reconnecting
+    clients can resume. Finished streams expire after SSE_REPLAY_TTL_S.
+    """
+
+    def __init__(self, ttl=SSE_REPLAY_TTL_S, max_streams=SSE_MAX_STREAMS):
+        self.ttl = ttl
+        self.max_streams = max_streams
+        self._streams = {}
+        self._in_flight = {}  # Content key -> live stream, for request coalescing
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.time()
+        expired = [sid for sid, stream in self._streams.items()
+                   if stream.done and now - stream.finished_at > self.ttl]
+        for sid in expired:
+            del self._streams[sid]
+
+        for key in [k for k, stream in self._in_flight.items() if stream.done]:
+            del self._in_flight[key]
+
+        # Hard cap: drop the oldest finished streams first
+        if len(self._streams) > self.max_streams:
+            finished = sorted((s for s in self._streams.values() if s.done), key=lambda s: s.finished_at)
+            for stream in finished[:len(self._streams) - self.max_streams]:
+                del self._streams[stream.id]
+
+    def start(self, chunks, stream_id=None, key=None):
+        """
+        Start pumping the `chunks` generator into a new EventStream on a
+        background thread and return the stream. The generator yields text,
+        or (event name, payload) tuples for named events.
+
+        With a content `key`, a request identical to one still in flight
+        attaches to the existing stream (and replays it from the start)
+        instead of starting a new upstream call; `chunks` is then never run.
+        """
+        with self._lock:
+            self._expire()
+            if key is not None:
+                existing = self._in_flight.get(key)
+                if existing is not None and not existing.done:
+                    print(f"[SSE] Attaching to in-flight stream {existing.id}")
+                    return existing
+
+            stream = EventStream(stream_id or uuid.uuid4().hex)
+            self._streams[stream.id] = stream
+            if key is not None:
+                self._in_flight[key] = stream
+
+        def pump():
+            try:
+                for item in chunks:
+                    if isinstance(item, tuple):
+                        stream.publish(item[1], event=item[0])
+                    elif item:
+                        stream.publish(item)
+                stream.close()
+            except Exception as e:
+                print(f"[SSE] Stream {stream.id} failed: {str(e)}")
+                stream.close(error=str(e))
+
+        threading.Thread(target=pump, daemon=True).start()
+        return stream
+
+    def get(self, stream_id):
+        with self._lock:
+            self._expire()
+            return self._streams.get(stream_id)
+
+
+def parse_last_event_id(value):
+    """Parse a Last-Event-ID header/query value; invalid values mean 'from the start'"""
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def sse_response(stream, last_event_id=0, headers=None):
+    """Flask response streaming `stream` as text/event-stream"""
+    return Response(
+        stream.events(last_event_id),
+        mimetype='text/event-stream',
+        headers={**SSE_HEADERS, **(headers or {})}
+    )
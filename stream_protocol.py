@@ -0,0 +1,117 @@
+import json
+import struct
+from collections import namedtuple
+
+# Versioned framing for the transcription WebSocket (protocol 1).
+#
+# A client opts in by sending "protocol": 1 in its hello. After that:
+#
+# Client -> server, binary: one audio frame per message
+#   header (big-endian, 20 bytes)
+#     B  version        1
+#     B  codec          0 = pcm16, 1 = opus (must match the negotiated codec)
+#     H  flags          reserved, 0
+#     I  seq            frame counter, starting at 0, +1 per message
+#     Q  capture_us     client clock (unix microseconds) when the first sample was captured
+#     I  sample_rate    Hz, the capture rate declared in the hello
+#   payload             codec data (see audio_codec.py)
+#
+# Client -> server, text: JSON control messages (hello, speech_start, speech_end,
+# keepalive while a VAD client is silent)
+#
+# Server -> client, text: JSON objects with a "type":
+#   hello       negotiated codec / protocol
+#   status      informational (e.g. connected, session_id)
+#   transcript  text, final flag, segments with stream-relative timings,
+#               the seq range and capture time of the audio it covers,
+#               frames lost so far and the server-side latency breakdown
+#   error       message
+#
+# Clients that don't ask for protocol 1 keep the original untyped protocol
+# (bare PCM in, bare strings out, a text greeting once the server has seen
+# their hello or first audio).
+#
+# A server that can't take a connection waits up to REJECT_HELLO_WAIT_S for
+# the client's first message, so the refusal is in the protocol the client
+# asked for.
+
+PROTOCOL_VERSION = 1
+REJECT_HELLO_WAIT_S = 2
+
+FRAME_HEADER = struct.Struct(">BBHIQI")
+CODEC_IDS = {'pcm16': 0, 'opus': 1}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+FrameHeader = namedtuple('FrameHeader', 'version codec flags seq capture_us sample_rate')
+
+
+class ProtocolError(Exception):
+    """Raised for malformed frames"""
+
+
+def encode_audio_frame(payload, seq, capture_us, sample_rate, codec):
+    header = FRAME_HEADER.pack(PROTOCOL_VERSION, CODEC_IDS[codec], 0, seq & 0xFFFFFFFF,
+                               int(capture_us), sample_rate)
+    return header + payload
+
+
+def decode_audio_frame(message):
+    """Split a binary frame into (FrameHeader with codec name, payload)"""
+    if len(message) < FRAME_HEADER.size:
+        raise ProtocolError("Frame shorter than its header")
+    version, codec_id, flags, seq, capture_us, sample_rate = FRAME_HEADER.unpack_from(message)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported frame version {version}")
+    if codec_id not in CODEC_NAMES:
+        raise ProtocolError(f"Unknown codec id {codec_id}")
+    header = FrameHeader(version, CODEC_NAMES[codec_id], flags, seq, capture_us, sample_rate)
+    return header, message[FRAME_HEADER.size:]
+
+
+#===================#
+# Server messages
+#===================#
+
+def server_message(message_type, **fields):
+    return json.dumps({'type': message_type, **fields})
+
+
+def requested_protocol(message):
+    """Protocol a client's first message asks for: 1 for a hello with "protocol": 1, else 0"""
+    if not isinstance(message, str):
+        return 0
+    try:
+        control = json.loads(message)
+    except ValueError:
+        return 0
+    if isinstance(control, dict) and control.get('type') == 'hello' and control.get('protocol') == PROTOCOL_VERSION:
+        return PROTOCOL_VERSION
+    return 0
+
+
+def rejection_message(protocol, reason):
+    """Refusal sent before closing a connection the server can't take"""
+    if protocol:
+        return server_message('error', message=reason)
+    return f"ERROR: {reason}. Please try again later."
+
+
+def transcript_message(text, final, segments, seq_range, capture_us, frames_lost, latency_ms, audio_ms):
+    """
+    segments: [(start_s, end_s, text)] relative to the start of the session's audio.
+    capture_us: capture time of the newest frame included, echoed from the client,
+    so the client can compute end-to-end latency against its own clock.
+    """
+    return server_message(
+        'transcript',
+        text=text,
+        final=final,
+        partial=not final,
+        segments=[{'start': round(start, 3), 'end': round(end, 3), 'text': segment_text}
+                  for start, end, segment_text in segments],
+        seq_range=list(seq_range) if seq_range else None,
+        capture_us=capture_us,
+        frames_lost=frames_lost,
+        audio_ms=round(audio_ms),
+        latency_ms={name: round(value, 1) for name, value in latency_ms.items()}
+    )
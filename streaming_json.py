@@ -0,0 +1,158 @@
+import json
+
+# Incremental extraction of structured JSON from streamed LLM output.
+#
+# TopLevelFieldParser is fed text chunks as they arrive and returns each
+# top-level field of the JSON object as soon as its value is complete, so a UI
+# can render "summary" long before "follow_up" has been generated.
+# repair_json() closes a truncated document (open strings, arrays, objects,
+# dangling keys) so a cut-off stream still yields the fields it contains. It is
+# only for streams whose fields were already shown as they arrived; complete
+# responses are parsed strictly (llm_backends.parse_json_response).
+
+
+class TopLevelFieldParser:
+    """
+    Streaming parser for a single JSON object. Anything before the first '{'
+    (markdown fences, preamble text) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields = {}
+        self.finished = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, text):
+        """Add a chunk of text; returns a list of newly completed (key, value) pairs"""
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+        i = self._pos
+
+        while i < len(buffer) and not self.finished:
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._member_start is None:
+                # Still looking for the opening brace
+                if char == '{':
+                    self._depth = 1
+                    self._member_start = i + 1
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(buffer[self._member_start:i], completed)
+                    self.finished = True
+            elif char == ',' and self._depth == 1:
+                self._emit(buffer[self._member_start:i], completed)
+                self._member_start = i + 1
+            i += 1
+
+        self._pos = i
+        return completed
+
+    def _emit(self, member, completed):
+        if not member.strip():
+            return
+        try:
+            pair = json.loads('{' + member + '}')
+        except json.JSONDecodeError:
+            return
+        for key, value in pair.items():
+            self.fields[key] = value
+            completed.append((key, value))
+
+    def document(self):
+        """Text of the JSON object seen so far (from the first '{')"""
+        start = self.buffer.find('{')
+        return self.buffer[start:] if start >= 0 else ""
+
+
+def _scan(text):
+    """
+    Scan JSON text and return (stack of open containers, in_string flag,
+    positions of structural ',' '{' '[' outside strings).
+    """
+    stack = []
+    cut_points = []
+    in_string = False
+    escape = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append(char)
+            cut_points.append(i)
+        elif char in '}]':
+            if stack:
+                stack.pop()
+        elif char == ',':
+            cut_points.append(i)
+    return stack, in_string, cut_points
+
+
+def _close(text):
+    """Append whatever is needed to close open strings and containers"""
+    stack, in_string, _ = _scan(text)
+    if in_string:
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(','):
+        text = text[:-1]
+    closers = {'{': '}', '[': ']'}
+    return text + "".join(closers[c] for c in reversed(stack))
+
+
+def repair_json(text):
+    """
+    Parse possibly truncated JSON. The document is closed as-is first; if that
+    is still invalid (a half-written number or literal, a key without a value)
+    it is cut back to the previous ',' / '{' / '[' and closed again.
+    Returns the parsed value or raises json.JSONDecodeError.
+    """
+    start = text.find('{')
+    if start < 0:
+        raise json.JSONDecodeError("No JSON object found", text, 0)
+    text = text[start:].strip()
+    if text.endswith('```'):
+        text = text[:-3].rstrip()
+
+    error = None
+    for _ in range(64):
+        try:
+            return json.loads(_close(text))
+        except json.JSONDecodeError as e:
+            error = e
+        _, _, cut_points = _scan(text)
+        if not cut_points:
+            break
+        cut = cut_points[-1]
+        # Keep an opening bracket (unless nothing follows it), drop a trailing comma
+        if text[cut] in '{[' and cut + 1 < len(text):
+            text = text[:cut + 1]
+        else:
+            text = text[:cut]
+        if not text:
+            break
+    raise error
@@ -0,0 +1,272 @@
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+# Write-ahead log for form submissions (i2f1.py).
+#
+# submit_form appends a record and returns once it is durable on disk. A
+# writer thread group-commits: it collects every record that arrives within a
+# few milliseconds, writes them with one write() and one fsync(), then wakes
+# all their submitters. An applier thread inserts committed batches into the
+# FormStore in one transaction each. Inserts are idempotent (submission_id is
+# unique), so a log left behind by a crashed process is simply replayed into
+# the store on the next start and then removed.
+#
+# Each process writes its own log file (submissions-<pid>.log), so gunicorn
+# workers never contend on a file. A batch the store keeps rejecting is
+# applied record by record; records that still fail are moved to
+# dead-letter.log (one JSON object per line, with the error) so they don't
+# block later submissions or log rotation.
+
+LOG_DIR = os.environ.get('SUBMISSION_LOG_DIR', 'submission_logs')
+COMMIT_WINDOW_MS = float(os.environ.get('SUBMISSION_LOG_COMMIT_MS', '5'))
+MAX_BATCH = 512
+ROTATE_BYTES = 16 * 1024 * 1024  # Truncate the log once it's this big and fully applied
+APPEND_TIMEOUT_S = 10
+APPLY_ATTEMPTS = 3  # Per batch, then per record, before a record is dead-lettered
+APPLY_RETRY_S = 0.5
+DEAD_LETTER_FILE = 'dead-letter.log'
+
+
+class SubmissionLogError(Exception):
+    """Raised when a record could not be made durable"""
+
+
+class _Pending:
+    __slots__ = ('record', 'done', 'error')
+
+    def __init__(self, record):
+        self.record = record
+        self.done = threading.Event()
+        self.error = None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SubmissionLog:
+    """Group-committed, fsync'd log of submissions applied to a FormStore in the background"""
+
+    def __init__(self, store, log_dir=LOG_DIR, commit_window_ms=COMMIT_WINDOW_MS):
+        self.store = store
+        self.log_dir = log_dir
+        self.commit_window_s = commit_window_ms / 1000
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+        # Counters, for /status-style reporting
+        self.committed = 0
+        self.commits = 0
+        self.applied = 0
+        self.dead_lettered = 0
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.replay_orphaned_logs()
+
+    def _ensure_started(self):
+        # Threads and file handles don't survive fork(); start them in the process that appends
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.path = os.path.join(self.log_dir, f"submissions-{os.getpid()}.log")
+            if os.path.exists(self.path):
+                # Left by an earlier process with the same PID
+                self._replay_file(self.path)
+            self._file = open(self.path, 'wb')
+            self._incoming = queue.Queue()
+            self._to_apply = queue.Queue()
+            self._written_batches = 0
+            self._applied_batches = 0
+            threading.Thread(target=self._writer_loop, name='submission-log-writer', daemon=True).start()
+            threading.Thread(target=self._applier_loop, name='submission-log-applier', daemon=True).start()
+            self._pid = os.getpid()
+
+    #===================#
+    # Append / group commit
+    #===================#
+
+    def append(self, record):
+        """Append a submission record; returns once it has been fsync'd"""
+        self._ensure_started()
+        pending = _Pending(record)
+        self._incoming.put(pending)
+        if not pending.done.wait(APPEND_TIMEOUT_S):
+            raise SubmissionLogError("Timed out waiting for the submission log")
+        if pending.error is not None:
+            raise SubmissionLogError(str(pending.error))
+
+    def _collect_batch(self):
+        batch = [self._incoming.get()]
+        deadline = time.monotonic() + self.commit_window_s
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._incoming.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Take whatever else is already queued without waiting further
+        while len(batch) < MAX_BATCH:
+            try:
+                batch.append(self._incoming.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _writer_loop(self):
+        while True:
+            batch = self._collect_batch()
+            start = self._file.tell()
+            try:
+                payload = b"".join(
+                    json.dumps(pending.record, separators=(',', ':')).encode('utf-8') + b"\n"
+                    for pending in batch
+                )
+                self._file.write(payload)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except Exception as e:
+                print(f"[Submission Log] Commit of {len(batch)} records failed: {str(e)}")
+                self._discard_from(start)
+                for pending in batch:
+                    pending.error = e
+                    pending.done.set()
+                continue
+
+            self.commits += 1
+            self.committed += len(batch)
+            self._written_batches += 1
+            for pending in batch:
+                pending.done.set()
+            self._to_apply.put([pending.record for pending in batch])
+            self._maybe_rotate()
+
+    def _discard_from(self, offset):
+        # Drop a partially written batch so later records aren't stranded behind a torn line
+        try:
+            self._file.seek(offset)
+            self._file.truncate(offset)
+        except Exception as e:
+            print(f"[Submission Log] Could not discard partial write: {str(e)}")
+
+    def _maybe_rotate(self):
+        # Only once every committed batch is in the store; otherwise the log is the only copy
+        if self._file.tell() < ROTATE_BYTES or self._applied_batches != self._written_batches:
+            return
+        self._file.truncate(0)
+        self._file.seek(0)
+        os.fsync(self._file.fileno())
+
+    #===================#
+    # Background apply
+    #===================#
+
+    def _applier_loop(self):
+        while True:
+            records = self._to_apply.get()
+            # Merge batches that queued up while the previous apply ran
+            batches = 1
+            while True:
+                try:
+                    records = records + self._to_apply.get_nowait()
+                    batches += 1
+                except queue.Empty:
+                    break
+
+            self._apply(records)
+            self._applied_batches += batches
+
+    def _apply(self, records):
+        """Insert records into the store; ones that keep failing go to the dead-letter file"""
+        error = self._try_apply(records)
+        if error is None:
+            self.applied += len(records)
+            return
+        print(f"[Submission Log] Apply of {len(records)} records failed {APPLY_ATTEMPTS} times "
+              f"({str(error)}); applying them one by one")
+        for record in records:
+            error = self._try_apply([record]) if len(records) > 1 else error
+            if error is None:
+                self.applied += 1
+            else:
+                self._dead_letter(record, error)
+
+    def _try_apply(self, records):
+        """Returns None once the store accepted the records, or the last error"""
+        for attempt in range(APPLY_ATTEMPTS):
+            if attempt:
+                time.sleep(APPLY_RETRY_S)
+            try:
+                self.store.add_submissions(records)
+                return None
+            except Exception as e:
+                error = e
+        return error
+
+    def _dead_letter(self, record, error):
+        path = os.path.join(self.log_dir, DEAD_LETTER_FILE)
+        print(f"[Submission Log] Moving submission {record.get('submission_id')} to {path}: {str(error)}")
+        entry = {'record': record, 'error': str(error), 'failed_at': time.time()}
+        try:
+            with open(path, 'ab') as dead_letter_file:
+                dead_letter_file.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b"\n")
+                dead_letter_file.flush()
+                os.fsync(dead_letter_file.fileno())
+        except Exception as e:
+            print(f"[Submission Log] Could not write dead letter: {str(e)}")
+        self.dead_lettered += 1
+
+    #===================#
+    # Recovery
+    #===================#
+
+    def _replay_file(self, path):
+        records = []
+        with open(path, 'rb') as log_file:
+            for line in log_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Torn final write from a crash; it was never acknowledged
+                    break
+        if records:
+            self._apply(records)
+            print(f"[Submission Log] Replayed {len(records)} records from {path}")
+
+    def replay_orphaned_logs(self):
+        """Apply and remove logs of processes that are no longer running"""
+        for path in glob.glob(os.path.join(self.log_dir, 'submissions-*.log')):
+            try:
+                pid = int(os.path.basename(path)[len('submissions-'):-len('.log')])
+            except ValueError:
+                continue
+            if pid == os.getpid() or _pid_alive(pid):
+                continue
+            try:
+                self._replay_file(path)
+                os.remove(path)
+            except FileNotFoundError:
+                # Another worker replayed it first
+                continue
+
+    def stats(self):
+        return {
+            'committed': self.committed,
+            'commits': self.commits,
+            'applied': self.applied,
+            'dead_lettered': self.dead_lettered,
+            'avg_batch': round(self.committed / self.commits, 1) if self.commits else 0
+        }
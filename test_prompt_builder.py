@@ -0,0 +1,23 @@
+import time
+
+from prompt_builder import compress_transcript, count_tokens, fit_transcript
+
+
+def test_transcript_within_budget_is_unchanged():
+    transcript = ("Doctor: Any chest pain?  Patient: No. Doctor: Shortness of breath? Patient: No.\n"
+                  "Doctor: How often do you take it? Patient: Twice a day. Twice a day. Doctor: Fine. fine.")
+    assert fit_transcript(transcript, count_tokens(transcript)) == transcript
+
+
+def test_unpunctuated_transcript_is_fast():
+    transcript = " ".join(["word"] * 10000)  # ~50k characters, no sentence breaks
+    start = time.time()
+    fitted = fit_transcript(transcript, 500)
+    assert time.time() - start < 1.0
+    assert count_tokens(fitted) <= 500
+
+
+def test_compress_drops_only_exact_adjacent_repeats():
+    assert compress_transcript("Thank you. Thank you. Thank you. Bye.") == "Thank you. Bye."
+    assert compress_transcript("No. no. No.") == "No. no. No."
+    assert compress_transcript("Yes. Fine. Yes.") == "Yes. Fine. Yes."
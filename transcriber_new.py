@@ -6,9 +6,8 @@ import io
 import threading
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import tempfile
-import os
 from faster_whisper import WhisperModel
+from single_flight import SingleFlight, content_key
 
 # Configuration
 HOST = '0.0.0.0'
@@ -35,6 +34,11 @@ async def handle_websocket_client(websocket):
     
     try:
         async for message in websocket:
+            # Text frames are JSON control messages from newer clients (hello, VAD markers).
+            # This server only takes raw 16 kHz PCM; the hello goes unanswered, so clients fall back to it.
+            if isinstance(message, str):
+                continue
+            
             # Append incoming audio data to buffer
             audio_buffer += message
             
@@ -85,28 +89,35 @@ async def run_websocket_server():
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Concurrent identical uploads share one transcription
+transcribe_flight = SingleFlight("Transcribe")
+
+def transcribe_audio_bytes(audio_bytes):
+    """
+    Transcribe a complete uploaded audio file held in memory
+    """
+    segments, info = model.transcribe(io.BytesIO(audio_bytes), language="en")
+    
+    # Combine all segments into a single transcription
+    transcription = " ".join([segment.text for segment in segments])
+    return transcription, info
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     if 'audio' not in request.files:
         return jsonify({'error': 'No audio file provided'}), 400
     
-    audio_file = request.files['audio']
-    
-    # Save uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-        audio_file.save(temp_file.name)
-        temp_filename = temp_file.name
+    audio_bytes = request.files['audio'].read()
     
     try:
-        print(f"[Flask API] Processing full audio file: {temp_filename}")
-        
-        # Transcribe the audio file
-        segments, info = model.transcribe(temp_filename, language="en")
+        print(f"[Flask API] Processing full audio file: {len(audio_bytes)} bytes")
         
-        # Combine all segments into a single transcription
-        transcription = " ".join([segment.text for segment in segments])
+        # Transcribe the audio file (joins an identical in-flight request if there is one)
+        (transcription, info), shared = transcribe_flight.do(
+            content_key('transcribe', audio_bytes), transcribe_audio_bytes, audio_bytes
+        )
         
-        print(f"[Flask API] Transcription complete: {len(transcription)} characters")
+        print(f"[Flask API] Transcription complete: {len(transcription)} characters{' (shared)' if shared else ''}")
         
         return jsonify({
             'transcription': transcription,
@@ -117,11 +128,6 @@ def transcribe():
     except Exception as e:
         print(f"[Flask API] Error during transcription: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.unlink(temp_filename)
 
 def run_flask_app():
     print(f"Starting Flask API server on {HOST}:{FLASK_PORT}...")
@@ -6,11 +6,12 @@ import io
 import threading
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import tempfile
-import os
-import json
 import google.generativeai as genai
 from faster_whisper import WhisperModel
+from single_flight import SingleFlight, content_key
+from llm_backends import GeminiBackend, create_router
+from medical_analysis import analyze_medical_conversation, stream_medical_analysis
+from sse import StreamRegistry, parse_last_event_id, sse_response
 
 # Configuration
 HOST = '0.0.0.0'
@@ -36,6 +37,9 @@ print("Model loaded successfully!")
 gemini_model = genai.GenerativeModel('gemini-1.5-flash')
 print("Gemini model initialized successfully!")
 
+# All analysis calls go through the router (LLM_BACKEND=mock for offline load tests)
+llm = create_router([GeminiBackend(gemini_model)])
+
 #=========================#
 # WebSocket Server Section
 #=========================#
@@ -46,6 +50,11 @@ async def handle_websocket_client(websocket):
     
     try:
         async for message in websocket:
+            # Text frames are JSON control messages from newer clients (hello, VAD markers).
+            # This server only takes raw 16 kHz PCM; the hello goes unanswered, so clients fall back to it.
+            if isinstance(message, str):
+                continue
+            
             # Append incoming audio data to buffer
             audio_buffer += message
             
@@ -96,99 +105,39 @@ async def run_websocket_server():
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-def analyze_medical_conversation(transcription):
-    """
-    Analyze medical conversation using Gemini AI and extract structured information
-    """
-    prompt = f"""
-    You are a medical AI assistant. Analyze the following medical conversation transcript and extract structured information in JSON format.
-
-    Transcript: "{transcription}"
+# Live and recently finished analysis streams, for Last-Event-ID resume
+analysis_streams = StreamRegistry()
 
-    Please analyze this medical conversation and provide a JSON response with the following structure:
-    {{
-        "summary": "A comprehensive paragraph summary of the entire conversation",
-        "symptoms": ["list of patient symptoms mentioned"],
-        "diagnosis": ["list of diagnoses mentioned by the doctor, in chronological order"],
-        "medications": [
-            {{
-                "name": "medication name",
-                "dosage": "dosage amount",
-                "frequency": "frequency of administration"
-            }}
-        ],
-        "follow_up": "follow-up instructions or next steps mentioned"
-    }}
+# Concurrent identical uploads / analysis requests share one model or LLM call
+transcribe_flight = SingleFlight("Transcribe")
+analyse_flight = SingleFlight("Analyse")
 
-    Rules:
-    1. Extract only information that is explicitly mentioned in the conversation
-    2. If no information is available for a category, use empty arrays [] or empty strings ""
-    3. For medications, include all three fields (name, dosage, frequency) if mentioned
-    4. Be accurate and don't infer information not present in the transcript
-    5. Return only valid JSON format
-
-    Respond with only the JSON object, no additional text.
+def transcribe_audio_bytes(audio_bytes):
+    """
+    Transcribe a complete uploaded audio file held in memory
     """
+    segments, info = model.transcribe(io.BytesIO(audio_bytes), language="en")
     
-    try:
-        response = gemini_model.generate_content(prompt)
-        
-        # Clean the response text to extract JSON
-        response_text = response.text.strip()
-        
-        # Remove any markdown formatting if present
-        if response_text.startswith('```json'):
-            response_text = response_text[7:-3]
-        elif response_text.startswith('```'):
-            response_text = response_text[3:-3]
-        
-        # Parse the JSON response
-        analysis = json.loads(response_text)
-        
-        return analysis
-        
-    except json.JSONDecodeError as e:
-        print(f"[Gemini Analysis] JSON decode error: {str(e)}")
-        print(f"[Gemini Analysis] Raw response: {response.text}")
-        return {
-            "summary": "Error: Could not parse analysis response",
-            "symptoms": [],
-            "diagnosis": [],
-            "medications": [],
-            "follow_up": ""
-        }
-    except Exception as e:
-        print(f"[Gemini Analysis] Error: {str(e)}")
-        return {
-            "summary": "Error: Could not analyze conversation",
-            "symptoms": [],
-            "diagnosis": [],
-            "medications": [],
-            "follow_up": ""
-        }
+    # Combine all segments into a single transcription
+    transcription = " ".join([segment.text for segment in segments])
+    return transcription, info
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     if 'audio' not in request.files:
         return jsonify({'error': 'No audio file provided'}), 400
     
-    audio_file = request.files['audio']
-    
-    # Save uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-        audio_file.save(temp_file.name)
-        temp_filename = temp_file.name
+    audio_bytes = request.files['audio'].read()
     
     try:
-        print(f"[Flask API] Processing full audio file: {temp_filename}")
-        
-        # Transcribe the audio file
-        segments, info = model.transcribe(temp_filename, language="en")
+        print(f"[Flask API] Processing full audio file: {len(audio_bytes)} bytes")
         
-        # Combine all segments into a single transcription
-        transcription = " ".join([segment.text for segment in segments])
+        # Transcribe the audio file (joins an identical in-flight request if there is one)
+        (transcription, info), shared = transcribe_flight.do(
+            content_key('transcribe', audio_bytes), transcribe_audio_bytes, audio_bytes
+        )
         
-        print(f"[Flask API] Transcription complete: {len(transcription)} characters")
+        print(f"[Flask API] Transcription complete: {len(transcription)} characters{' (shared)' if shared else ''}")
         
         return jsonify({
             'transcription': transcription,
@@ -199,30 +148,21 @@ def transcribe():
     except Exception as e:
         print(f"[Flask API] Error during transcription: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.unlink(temp_filename)
 
 @app.route('/analyse', methods=['POST'])
 def analyse():
     if 'audio' not in request.files:
         return jsonify({'error': 'No audio file provided'}), 400
     
-    audio_file = request.files['audio']
-    
-    # Save uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-        audio_file.save(temp_file.name)
-        temp_filename = temp_file.name
+    audio_bytes = request.files['audio'].read()
     
     try:
-        print(f"[Flask API - Analyse] Processing audio file: {temp_filename}")
+        print(f"[Flask API - Analyse] Processing audio file: {len(audio_bytes)} bytes")
         
-        # Step 1: Transcribe the audio file
-        segments, info = model.transcribe(temp_filename, language="en")
-        transcription = " ".join([segment.text for segment in segments])
+        # Step 1: Transcribe the audio file (shared with identical in-flight uploads)
+        (transcription, info), _ = transcribe_flight.do(
+            content_key('transcribe', audio_bytes), transcribe_audio_bytes, audio_bytes
+        )
         
         print(f"[Flask API - Analyse] Transcription complete: {len(transcription)} characters")
         print(f"[Flask API - Analyse] Transcription: {transcription[:200]}...")
@@ -230,9 +170,11 @@ def analyse():
         if not transcription.strip():
             return jsonify({'error': 'No speech detected in audio file'}), 400
         
-        # Step 2: Analyze the transcription using Gemini
-        print("[Flask API - Analyse] Starting Gemini analysis...")
-        analysis = analyze_medical_conversation(transcription)
+        # Step 2: Analyze the transcription using the LLM backend
+        print("[Flask API - Analyse] Starting LLM analysis...")
+        analysis, _ = analyse_flight.do(
+            content_key('analyse', transcription), analyze_medical_conversation, llm, transcription
+        )
         
         # Step 3: Combine transcription with analysis
         result = {
@@ -247,11 +189,57 @@ def analyse():
     except Exception as e:
         print(f"[Flask API - Analyse] Error during analysis: {str(e)}")
         return jsonify({'error': str(e)}), 500
+
+@app.route('/analyse/stream', methods=['POST'])
+def analyse_stream():
+    """
+    Same input as /analyse, but the result is a text/event-stream: a
+    `transcription` event, then one `field` event per analysis field as soon
+    as it is generated, then `done`.
+    """
+    if 'audio' not in request.files:
+        return jsonify({'error': 'No audio file provided'}), 400
+    
+    audio_bytes = request.files['audio'].read()
+    
+    try:
+        print(f"[Flask API - Analyse Stream] Processing audio file: {len(audio_bytes)} bytes")
+        
+        (transcription, info), _ = transcribe_flight.do(
+            content_key('transcribe', audio_bytes), transcribe_audio_bytes, audio_bytes
+        )
+        
+        print(f"[Flask API - Analyse Stream] Transcription complete: {len(transcription)} characters")
+        
+        if not transcription.strip():
+            return jsonify({'error': 'No speech detected in audio file'}), 400
+        
+        def events():
+            yield ('transcription', {'transcription': transcription})
+            yield from stream_medical_analysis(llm, transcription)
+        
+        # An identical analysis already streaming is joined instead of starting a new LLM call
+        stream = analysis_streams.start(events(), key=content_key('analyse-stream', transcription))
+        return sse_response(stream, headers={
+            'Access-Control-Expose-Headers': 'X-Stream-Id',
+            'X-Stream-Id': stream.id,
+        })
+    
+    except Exception as e:
+        print(f"[Flask API - Analyse Stream] Error during analysis: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analyse/stream/<stream_id>', methods=['GET'])
+def resume_analysis_stream(stream_id):
+    """Resume an /analyse/stream response after a dropped connection (Last-Event-ID)"""
+    stream = analysis_streams.get(stream_id)
+    if stream is None:
+        return jsonify({'error': 'Stream not found or expired'}), 404
     
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.unlink(temp_filename)
+    last_event_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    )
+    return sse_response(stream, last_event_id)
 
 def run_flask_app():
     print(f"Starting Flask API server on {HOST}:{FLASK_PORT}...")
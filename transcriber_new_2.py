@@ -3,11 +3,12 @@ import soundfile as sf
 import io
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-import tempfile
-import os
 import json
 import google.generativeai as genai
 from faster_whisper import WhisperModel
+from single_flight import SingleFlight, content_key
+from llm_backends import GeminiBackend, create_router
+from prompt_builder import build_report_prompt
 
 # Configuration
 HOST = '0.0.0.0'
@@ -31,6 +32,9 @@ print("Model loaded successfully!")
 gemini_model = genai.GenerativeModel('gemini-1.5-flash')
 print("Gemini model initialized successfully!")
 
+# All analysis calls go through the router (LLM_BACKEND=mock for offline load tests)
+llm = create_router([GeminiBackend(gemini_model)])
+
 #===================#
 # Flask API Section
 #===================#
@@ -38,60 +42,48 @@ print("Gemini model initialized successfully!")
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-def analyze_with_template(transcription, template):
-    """
-    Analyze medical conversation using Gemini AI with provided template
+def analyze_with_template(prompt):
     """
-    prompt = f"""
-    You are a medical AI assistant. Analyze the following medical conversation transcript and create a structured medical report using the provided template format.
-
-    Transcript: "{transcription}"
-
-    Template Format:
-    {template}
-
-    Instructions:
-    1. Use the exact template structure provided
-    2. Only include information that is explicitly mentioned in the transcript
-    3. If information for any section is not mentioned in the transcript, leave that section blank (do not include placeholder text)
-    4. Make all section titles bold using **Title** format
-    5. Use proper line breaks for readability
-    6. Be accurate and don't infer information not present in the transcript
-    7. Follow the template structure exactly as provided
-
-    Create the medical report based on the transcript and template:
+    Analyze medical conversation using the configured LLM backend with provided template.
+    `prompt` comes from build_report_prompt (cacheable prefix, transcript last).
     """
-    
     try:
-        response = gemini_model.generate_content(prompt)
-        return response.text.strip()
+        return llm.complete(prompt.text)
         
     except Exception as e:
-        print(f"[Gemini Analysis] Error: {str(e)}")
+        print(f"[LLM Analysis] Error: {str(e)}")
         return f"Error: Could not analyze conversation - {str(e)}"
 
+# Concurrent identical uploads / analysis requests share one model or LLM call
+transcribe_flight = SingleFlight("Transcribe")
+analyse_flight = SingleFlight("Analyse")
+
+def transcribe_audio_bytes(audio_bytes):
+    """
+    Transcribe a complete uploaded audio file held in memory
+    """
+    segments, info = model.transcribe(io.BytesIO(audio_bytes), language="en")
+    
+    # Combine all segments into a single transcription
+    transcription = " ".join([segment.text for segment in segments])
+    return transcription, info
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     if 'audio' not in request.files:
         return jsonify({'error': 'No audio file provided'}), 400
     
-    audio_file = request.files['audio']
-    
-    # Save uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-        audio_file.save(temp_file.name)
-        temp_filename = temp_file.name
+    audio_bytes = request.files['audio'].read()
     
     try:
-        print(f"[Flask API] Processing full audio file: {temp_filename}")
-        
-        # Transcribe the audio file
-        segments, info = model.transcribe(temp_filename, language="en")
+        print(f"[Flask API] Processing full audio file: {len(audio_bytes)} bytes")
         
-        # Combine all segments into a single transcription
-        transcription = " ".join([segment.text for segment in segments])
+        # Transcribe the audio file (joins an identical in-flight request if there is one)
+        (transcription, info), shared = transcribe_flight.do(
+            content_key('transcribe', audio_bytes), transcribe_audio_bytes, audio_bytes
+        )
         
-        print(f"[Flask API] Transcription complete: {len(transcription)} characters")
+        print(f"[Flask API] Transcription complete: {len(transcription)} characters{' (shared)' if shared else ''}")
         
         return jsonify({
             'transcription': transcription,
@@ -102,11 +94,6 @@ def transcribe():
     except Exception as e:
         print(f"[Flask API] Error during transcription: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.unlink(temp_filename)
 
 @app.route('/analyse', methods=['POST'])
 def analyse():
@@ -130,11 +117,18 @@ def analyse():
         print(f"[Flask API - Analyse] Transcription length: {len(transcription)} characters")
         print(f"[Flask API - Analyse] Template length: {len(template)} characters")
         
-        # Get the complete analysis
-        analysis_result = analyze_with_template(transcription, template)
+        # Build the prompt (static prefix first, transcript trimmed to budget)
+        prompt = build_report_prompt(transcription, template)
+        
+        # Get the complete analysis (joins an identical in-flight request if there is one)
+        analysis_result, shared = analyse_flight.do(
+            content_key('analyse', transcription, template), analyze_with_template, prompt
+        )
+        if shared:
+            print("[Flask API - Analyse] Shared result of an identical in-flight request")
         
         # Return single JSON response
-        return jsonify({'data': analysis_result})
+        return jsonify({'data': analysis_result, 'usage': prompt.usage()})
     
     except Exception as e:
         print(f"[Flask API - Analyse] Error during analysis: {str(e)}")
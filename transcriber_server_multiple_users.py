@@ -12,9 +12,15 @@ import threading
 import uuid
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import tempfile
 import os
 from faster_whisper import WhisperModel
+from single_flight import SingleFlight, content_key
+from audio_codec import SUPPORTED_CODECS, CodecError, StreamDecoder, create_decoder, negotiate
+from session_recorder import open_recorder
+from stream_protocol import (PROTOCOL_VERSION, REJECT_HELLO_WAIT_S, ProtocolError, decode_audio_frame,
+                             rejection_message, requested_protocol, server_message,
+                             transcript_message)
+import json
 import time
 from collections import defaultdict
 
@@ -27,7 +33,8 @@ SAMPLE_RATE = 16000
 SAMPLE_WIDTH = 2
 CHANNELS = 1
 CHUNK_DURATION_MS = 1000
-MAX_USERS = 5  # Maximum number of concurrent users
+MAX_USERS = int(os.environ.get('MAX_USERS', '5'))  # Maximum number of concurrent users
+MIN_FLUSH_MS = 300  # Shorter leftovers at speech_end wait for the next utterance (too short to transcribe)
 
 print(f"Initializing Whisper model: {MODEL_SIZE}")
 # Initialize the model once for both services
@@ -50,54 +57,249 @@ async def handle_websocket_client(websocket):
     
     # Check if we can accept more clients
     with client_lock:
-        if len(active_clients) >= MAX_USERS:
-            print(f"Maximum users reached. Rejecting client: {client_address}")
-            await websocket.send("ERROR: Server at maximum capacity. Please try again later.")
-            await websocket.close(1008, "Server at maximum capacity")
-            return
-        
-        # Add client to active clients
-        active_clients[client_id] = {
-            'websocket': websocket,
-            'audio_buffer': b'',
-            'last_activity': time.time(),
-            'address': client_address
-        }
+        full = len(active_clients) >= MAX_USERS
+        if not full:
+            # Add client to active clients
+            active_clients[client_id] = {
+                'websocket': websocket,
+                'audio_buffer': b'',
+                'last_activity': time.time(),
+                'address': client_address,
+                'decoder': None,  # Chosen by the hello message; raw PCM if audio arrives first
+                'protocol': 0,  # 1 = framed audio and JSON results (stream_protocol.py), 0 = untyped
+                'in_speech': False,  # Between speech_start and speech_end markers from a VAD client
+                'utterances': 0,
+                'next_seq': 0,
+                'frames_lost': 0,
+                'stream_samples': 0,  # Samples dispatched so far; offsets segment timings
+                'chunk': None  # Metadata of the audio currently in audio_buffer
+            }
+    
+    if full:
+        print(f"Maximum users reached. Rejecting client: {client_address}")
+        await reject_client(websocket, "Server at maximum capacity")
+        return
     
     print(f"WebSocket client connected: {client_address} (Client ID: {client_id})")
     print(f"Active clients: {len(active_clients)}/{MAX_USERS}")
     
+    # Optional capture of everything the client sends, for replay (RECORD_SESSIONS_DIR)
+    recorder = open_recorder(client_id, address=str(client_address), server='transcriber_server_multiple_users',
+                             chunk_duration_ms=CHUNK_DURATION_MS, min_flush_ms=MIN_FLUSH_MS)
+    
     try:
-        # Send confirmation of connection
-        await websocket.send(f"Connected to transcription service. Your session ID: {client_id}")
-        
         async for message in websocket:
+            client = active_clients.get(client_id)
+            if client is None:
+                break
+            received_at = time.time()
+            if recorder is not None:
+                recorder.record(message, received_at)
+            
+            # Text messages are control messages (codec negotiation, speech markers)
+            if isinstance(message, str):
+                await handle_control_message(client_id, client, websocket, message)
+                continue
+            
+            if client['decoder'] is None:
+                # No hello: a protocol-0 client sending raw PCM
+                client['decoder'] = StreamDecoder()
+                await send_greeting(client_id, client)
+            try:
+                header = None
+                if client['protocol']:
+                    header, message = decode_audio_frame(message)
+                    check_frame(client, header)
+                pcm = client['decoder'].decode(message)
+            except (ProtocolError, CodecError) as e:
+                print(f"[WebSocket] Client {client_id}: {str(e)}")
+                await send_error(client, str(e))
+                continue
+            
             # Update client's last activity timestamp
             with client_lock:
                 if client_id in active_clients:
-                    active_clients[client_id]['last_activity'] = time.time()
-                    active_clients[client_id]['audio_buffer'] += message
-                    
-                    # Get the current buffer for processing
-                    audio_buffer = active_clients[client_id]['audio_buffer']
+                    client['last_activity'] = received_at
+                    client['audio_buffer'] += pcm
+                    track_chunk(client, header, received_at)
                     
                     # Process when we have enough audio data
-                    if len(audio_buffer) >= SAMPLE_RATE * SAMPLE_WIDTH * CHUNK_DURATION_MS / 1000:
-                        # Process audio in a non-blocking way
-                        asyncio.create_task(process_audio(client_id, audio_buffer))
-                        # Clear buffer after dispatching for processing
-                        active_clients[client_id]['audio_buffer'] = b''
+                    dispatch_audio(client_id)
     
     except websockets.exceptions.ConnectionClosed as e:
         print(f"WebSocket client disconnected: {client_address} (Client ID: {client_id}) - {e}")
     finally:
+        if recorder is not None:
+            recorder.close()
         # Remove client from active clients
         with client_lock:
             if client_id in active_clients:
                 del active_clients[client_id]
                 print(f"Removed client {client_id}. Active clients: {len(active_clients)}/{MAX_USERS}")
 
-async def process_audio(client_id, audio_buffer):
+def check_frame(client, header):
+    """Validate a protocol-1 frame header and count frames lost before it"""
+    if header.codec != client['decoder'].codec:
+        raise ProtocolError(f"Frame codec {header.codec} doesn't match negotiated {client['decoder'].codec}")
+    if header.sample_rate != client['decoder'].sample_rate:
+        raise ProtocolError(f"Frame sample rate {header.sample_rate} doesn't match declared "
+                            f"{client['decoder'].sample_rate}")
+    if header.seq > client['next_seq']:
+        client['frames_lost'] += header.seq - client['next_seq']
+    client['next_seq'] = max(client['next_seq'], header.seq + 1)
+
+def track_chunk(client, header, received_at):
+    """Remember when (and, with protocol 1, which frames) the buffered audio arrived"""
+    chunk = client['chunk']
+    if chunk is None:
+        chunk = client['chunk'] = {'first_received': received_at, 'first_seq': None, 'last_seq': None,
+                                   'capture_us': None}
+    if header is not None:
+        if chunk['first_seq'] is None:
+            chunk['first_seq'] = header.seq
+        chunk['last_seq'] = header.seq
+        chunk['capture_us'] = header.capture_us
+
+def dispatch_audio(client_id, flush=False):
+    """
+    Start transcribing the client's buffer once it holds a full chunk, or
+    whatever it holds when `flush` is set (end of an utterance).
+    Must be called with client_lock held.
+    """
+    client = active_clients[client_id]
+    audio_buffer = client['audio_buffer']
+    min_bytes = MIN_FLUSH_MS * SAMPLE_RATE * SAMPLE_WIDTH / 1000 if flush else \
+        SAMPLE_RATE * SAMPLE_WIDTH * CHUNK_DURATION_MS / 1000
+    if not audio_buffer or len(audio_buffer) < min_bytes:
+        return
+    
+    chunk = client['chunk'] or {}
+    chunk['dispatched'] = time.time()
+    chunk['offset_s'] = client['stream_samples'] / SAMPLE_RATE
+    # Mid-utterance chunks of a VAD client are partial; the speech_end flush (or any chunk
+    # from a client without VAD) is final
+    chunk['final'] = flush or not client['in_speech']
+    client['stream_samples'] += len(audio_buffer) // SAMPLE_WIDTH
+    
+    # Process audio in a non-blocking way
+    asyncio.create_task(process_audio(client_id, audio_buffer, chunk))
+    # Clear buffer after dispatching for processing
+    client['audio_buffer'] = b''
+    client['chunk'] = None
+
+async def send_error(client, message):
+    if client['protocol']:
+        await client['websocket'].send(server_message('error', message=message))
+    else:
+        await client['websocket'].send(f"ERROR: {message}")
+
+async def reject_client(websocket, reason):
+    """Refuse a connection, in the protocol its first message asks for"""
+    try:
+        first = await asyncio.wait_for(websocket.recv(), REJECT_HELLO_WAIT_S)
+    except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+        first = None
+    try:
+        await websocket.send(rejection_message(requested_protocol(first), reason))
+        await websocket.close(1008, reason)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+async def send_greeting(client_id, client):
+    """Session confirmation, once the protocol is known: a status message for protocol 1, text otherwise"""
+    if client['protocol']:
+        await client['websocket'].send(server_message('status', message='connected', session_id=client_id))
+    else:
+        await client['websocket'].send(f"Connected to transcription service. Your session ID: {client_id}")
+
+async def handle_control_message(client_id, client, websocket, message):
+    """
+    Handle a JSON control message:
+      hello         picks the audio codec and protocol:
+                    {"type": "hello", "codecs": ["opus", "pcm16"], "protocol": 1}
+      speech_start  the client's VAD detected speech; audio follows
+      speech_end    the utterance is over; transcribe what's buffered now
+                    instead of waiting for a full chunk
+      keepalive     sent by VAD clients during silence, so the session
+                    isn't closed as inactive
+    """
+    try:
+        control = json.loads(message)
+    except ValueError:
+        await send_error(client, "Expected a JSON control message")
+        return
+    
+    message_type = control.get('type')
+    if message_type == 'keepalive':
+        client['last_activity'] = time.time()
+        return
+    if message_type == 'speech_start':
+        client['in_speech'] = True
+        client['last_activity'] = time.time()
+        return
+    if message_type == 'speech_end':
+        with client_lock:
+            if client_id in active_clients:
+                client['in_speech'] = False
+                client['utterances'] += 1
+                client['last_activity'] = time.time()
+                dispatch_audio(client_id, flush=True)
+        return
+    
+    if message_type != 'hello':
+        await send_error(client, f"Unknown control message: {message_type}")
+        return
+    if client['decoder'] is not None:
+        await send_error(client, "Codec already chosen; send hello before any audio")
+        return
+    
+    codec = negotiate(control.get('codecs'))
+    input_rate = control.get('sample_rate', SAMPLE_RATE)
+    input_channels = control.get('channels', CHANNELS)
+    try:
+        # Audio at other rates / channel counts is converted to 16 kHz mono as it arrives
+        client['decoder'] = create_decoder(codec, input_rate, input_channels)
+    except CodecError as e:
+        await send_error(client, str(e))
+        return
+    client['protocol'] = PROTOCOL_VERSION if control.get('protocol') == PROTOCOL_VERSION else 0
+    print(f"[WebSocket] Client {client['address']} negotiated codec {codec} (offered {control.get('codecs')}), "
+          f"{input_rate} Hz x{input_channels}, protocol {client['protocol']}")
+    await websocket.send(json.dumps({
+        'type': 'hello',
+        'codec': codec,
+        'protocol': client['protocol'],
+        'sample_rate': SAMPLE_RATE,
+        'input_sample_rate': input_rate,
+        'input_channels': input_channels,
+        'supported_codecs': SUPPORTED_CODECS
+    }))
+    await send_greeting(client_id, client)
+
+def transcribe_chunk(audio_buffer):
+    """
+    Runs on an executor thread: waits for the model and transcribes the chunk.
+    Returns (segments as (start, end, text), seconds waiting for the model, seconds of inference).
+    """
+    # Convert audio buffer to numpy array
+    audio_np = np.frombuffer(audio_buffer, dtype=np.int16)
+    
+    with io.BytesIO() as wav_io:
+        sf.write(wav_io, audio_np, SAMPLE_RATE, format='WAV')
+        wav_io.seek(0)
+        
+        wait_start = time.time()
+        # Acquire model lock to ensure one transcription at a time
+        with model_lock:
+            inference_start = time.time()
+            segments, _ = model.transcribe(wav_io, language="en")
+            # Segments are decoded lazily; consume them while holding the lock
+            segments = [(segment.start, segment.end, segment.text) for segment in segments]
+        inference_end = time.time()
+    
+    return segments, inference_start - wait_start, inference_end - inference_start
+
+async def process_audio(client_id, audio_buffer, chunk):
     """Process audio data for a specific client"""
     try:
         with client_lock:
@@ -105,31 +307,42 @@ async def process_audio(client_id, audio_buffer):
                 # Client disconnected while we were processing
                 return
                 
-            websocket = active_clients[client_id]['websocket']
+            client = active_clients[client_id]
+            websocket = client['websocket']
         
-        # Convert audio buffer to numpy array
-        audio_np = np.frombuffer(audio_buffer, dtype=np.int16)
+        # Use run_in_executor for non-blocking transcription
+        segments, queue_s, inference_s = await asyncio.get_event_loop().run_in_executor(
+            None, transcribe_chunk, audio_buffer
+        )
+        transcription = " ".join(text for _, _, text in segments)
         
-        with io.BytesIO() as wav_io:
-            sf.write(wav_io, audio_np, SAMPLE_RATE, format='WAV')
-            wav_io.seek(0)
-            
-            # Acquire model lock to ensure one transcription at a time
-            with model_lock:
-                # Use run_in_executor for non-blocking transcription
-                segments, _ = await asyncio.get_event_loop().run_in_executor(
-                    None, 
-                    lambda: model.transcribe(wav_io, language="en")
-                )
-                
-                transcription = " ".join([segment.text for segment in segments])
-            
-            print(f"[WebSocket] Client {client_id}: {transcription}")
-            
-            # Send transcription back to client if still connected
-            with client_lock:
-                if client_id in active_clients and transcription.strip():
-                    await websocket.send(transcription)
+        print(f"[WebSocket] Client {client_id}: {transcription}")
+        
+        # Send transcription back to client if still connected
+        if client_id not in active_clients:
+            return
+        if not client['protocol']:
+            if transcription.strip():
+                await websocket.send(transcription)
+            return
+        
+        sent_at = time.time()
+        offset = chunk['offset_s']
+        await websocket.send(transcript_message(
+            text=transcription.strip(),
+            final=chunk['final'],
+            segments=[(offset + start, offset + end, text.strip()) for start, end, text in segments],
+            seq_range=(chunk['first_seq'], chunk['last_seq']) if chunk.get('first_seq') is not None else None,
+            capture_us=chunk.get('capture_us'),
+            frames_lost=client['frames_lost'],
+            latency_ms={
+                'buffering': (chunk['dispatched'] - chunk['first_received']) * 1000,
+                'queue': queue_s * 1000,
+                'inference': inference_s * 1000,
+                'server_total': (sent_at - chunk['first_received']) * 1000
+            },
+            audio_ms=len(audio_buffer) / SAMPLE_WIDTH / SAMPLE_RATE * 1000
+        ))
     
     except Exception as e:
         print(f"Error processing audio for client {client_id}: {str(e)}")
@@ -188,6 +401,20 @@ async def run_websocket_server():
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Concurrent identical uploads share one transcription
+transcribe_flight = SingleFlight("Transcribe")
+
+def transcribe_audio_bytes(audio_bytes):
+    """
+    Transcribe a complete uploaded audio file held in memory
+    """
+    # Model lock to prevent GPU memory issues
+    with model_lock:
+        segments, info = model.transcribe(io.BytesIO(audio_bytes), language="en")
+        # Combine all segments into a single transcription (segments are decoded lazily)
+        transcription = " ".join([segment.text for segment in segments])
+    return transcription, info
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     if 'audio' not in request.files:
@@ -199,24 +426,17 @@ def transcribe():
         if len(active_clients) >= MAX_USERS:
             return jsonify({'error': 'Server at maximum capacity. Please try again later.'}), 503
     
-    audio_file = request.files['audio']
-    
-    # Save uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-        audio_file.save(temp_file.name)
-        temp_filename = temp_file.name
+    audio_bytes = request.files['audio'].read()
     
     try:
-        print(f"[Flask API] Processing full audio file: {temp_filename}")
+        print(f"[Flask API] Processing full audio file: {len(audio_bytes)} bytes")
         
-        # Transcribe the audio file with model lock to prevent GPU memory issues
-        with model_lock:
-            segments, info = model.transcribe(temp_filename, language="en")
-        
-        # Combine all segments into a single transcription
-        transcription = " ".join([segment.text for segment in segments])
+        # Transcribe the audio file (joins an identical in-flight request if there is one)
+        (transcription, info), shared = transcribe_flight.do(
+            content_key('transcribe', audio_bytes), transcribe_audio_bytes, audio_bytes
+        )
         
-        print(f"[Flask API] Transcription complete: {len(transcription)} characters")
+        print(f"[Flask API] Transcription complete: {len(transcription)} characters{' (shared)' if shared else ''}")
         
         return jsonify({
             'transcription': transcription,
@@ -227,25 +447,35 @@ def transcribe():
     except Exception as e:
         print(f"[Flask API] Error during transcription: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.unlink(temp_filename)
 
 @app.route('/status', methods=['GET'])
 def server_status():
     with client_lock:
         active_count = len(active_clients)
-        client_list = [{'id': cid[:8] + '...', 'address': data['address'], 'connected_since': data['last_activity']} 
+        client_list = [{'id': cid[:8] + '...', 'address': data['address'], 'connected_since': data['last_activity'],
+                        'transport': data['decoder'].stats() if data['decoder'] else None,
+                        'in_speech': data['in_speech'], 'utterances': data['utterances'],
+                        'protocol': data['protocol'], 'frames_lost': data['frames_lost']}
                       for cid, data in active_clients.items()]
     
+    # Bandwidth and decode cost across all connected clients
+    transports = [client['transport'] for client in client_list if client['transport']]
+    bytes_in = sum(transport['bytes_in'] for transport in transports)
+    bytes_decoded = sum(transport['bytes_decoded'] for transport in transports)
+    
     return jsonify({
         'status': 'online',
         'active_clients': active_count,
         'max_clients': MAX_USERS,
         'available_slots': MAX_USERS - active_count,
         'uptime': time.time() - server_start_time,
+        'supported_codecs': SUPPORTED_CODECS,
+        'transport': {
+            'bytes_in': bytes_in,
+            'bytes_decoded': bytes_decoded,
+            'compression_ratio': round(bytes_decoded / bytes_in, 1) if bytes_in else None,
+            'decode_ms_total': round(sum(transport['decode_ms_total'] for transport in transports), 2)
+        },
         'clients': client_list
     })
 
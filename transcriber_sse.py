@@ -1,13 +1,14 @@
 import numpy as np
 import soundfile as sf
 import io
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify
 from flask_cors import CORS
-import tempfile
-import os
-import json
 import google.generativeai as genai
 from faster_whisper import WhisperModel
+from single_flight import SingleFlight, content_key
+from llm_backends import GeminiBackend, create_router
+from prompt_builder import build_report_prompt
+from sse import StreamRegistry, parse_last_event_id, sse_response
 
 # Configuration
 HOST = '0.0.0.0'
@@ -31,6 +32,9 @@ print("Model loaded successfully!")
 gemini_model = genai.GenerativeModel('gemini-1.5-flash')
 print("Gemini model initialized successfully!")
 
+# All analysis calls go through the router (LLM_BACKEND=mock for offline load tests)
+llm = create_router([GeminiBackend(gemini_model)])
+
 #===================#
 # Flask API Section
 #===================#
@@ -38,97 +42,62 @@ print("Gemini model initialized successfully!")
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-def analyze_with_template(transcription, template):
-    """
-    Analyze medical conversation using Gemini AI with provided template
-    """
-    prompt = f"""
-    You are a medical AI assistant. Analyze the following medical conversation transcript and create a structured medical report using the provided template format.
-
-    Transcript: "{transcription}"
+# Live and recently finished analysis streams, for Last-Event-ID resume
+analysis_streams = StreamRegistry()
 
-    Template Format:
-    {template}
-
-    Instructions:
-    1. Use the exact template structure provided
-    2. Only include information that is explicitly mentioned in the transcript
-    3. If information for any section is not mentioned in the transcript, leave that section blank (do not include placeholder text)
-    4. Make all section titles bold using **Title** format
-    5. Use proper line breaks for readability
-    6. Be accurate and don't infer information not present in the transcript
-    7. Follow the template structure exactly as provided
-
-    Create the medical report based on the transcript and template:
+def analyze_with_template(prompt):
+    """
+    Analyze medical conversation using the configured LLM backend with provided template.
+    `prompt` comes from build_report_prompt (cacheable prefix, transcript last).
     """
-    
     try:
-        response = gemini_model.generate_content(prompt)
-        return response.text.strip()
+        return llm.complete(prompt.text)
         
     except Exception as e:
-        print(f"[Gemini Analysis] Error: {str(e)}")
+        print(f"[LLM Analysis] Error: {str(e)}")
         return f"Error: Could not analyze conversation - {str(e)}"
 
-def stream_analysis(transcription, template):
+def stream_analysis(prompt):
     """
-    Stream the analysis response from Gemini AI
+    Stream the analysis response from the configured LLM backend as text chunks.
+    SSE framing, coalescing and replay are handled by the sse module.
     """
-    prompt = f"""
-    You are a medical AI assistant. Analyze the following medical conversation transcript and create a structured medical report using the provided template format.
-
-    Transcript: "{transcription}"
-
-    Template Format:
-    {template}
+    try:
+        for text in llm.stream(prompt.text):
+            yield text
+                
+    except Exception as e:
+        yield f"Error: Could not analyze conversation - {str(e)}"
 
-    Instructions:
-    1. Use the exact template structure provided
-    2. Only include information that is explicitly mentioned in the transcript
-    3. If information for any section is not mentioned in the transcript, leave that section blank (do not include placeholder text)
-    4. Make all section titles bold using **Title** format
-    5. Use proper line breaks for readability
-    6. Be accurate and don't infer information not present in the transcript
-    7. Follow the template structure exactly as provided
+# Concurrent identical uploads share one transcription
+transcribe_flight = SingleFlight("Transcribe")
 
-    Create the medical report based on the transcript and template:
+def transcribe_audio_bytes(audio_bytes):
+    """
+    Transcribe a complete uploaded audio file held in memory
     """
+    segments, info = model.transcribe(io.BytesIO(audio_bytes), language="en")
     
-    try:
-        response = gemini_model.generate_content(prompt, stream=True)
-        
-        for chunk in response:
-            if chunk.text:
-                # Format the response as JSON for streaming
-                data = {"data": chunk.text}
-                yield f"data: {json.dumps(data)}\n\n"
-                
-    except Exception as e:
-        error_data = {"data": f"Error: Could not analyze conversation - {str(e)}"}
-        yield f"data: {json.dumps(error_data)}\n\n"
+    # Combine all segments into a single transcription
+    transcription = " ".join([segment.text for segment in segments])
+    return transcription, info
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     if 'audio' not in request.files:
         return jsonify({'error': 'No audio file provided'}), 400
     
-    audio_file = request.files['audio']
-    
-    # Save uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-        audio_file.save(temp_file.name)
-        temp_filename = temp_file.name
+    audio_bytes = request.files['audio'].read()
     
     try:
-        print(f"[Flask API] Processing full audio file: {temp_filename}")
+        print(f"[Flask API] Processing full audio file: {len(audio_bytes)} bytes")
         
-        # Transcribe the audio file
-        segments, info = model.transcribe(temp_filename, language="en")
-        
-        # Combine all segments into a single transcription
-        transcription = " ".join([segment.text for segment in segments])
+        # Transcribe the audio file (joins an identical in-flight request if there is one)
+        (transcription, info), shared = transcribe_flight.do(
+            content_key('transcribe', audio_bytes), transcribe_audio_bytes, audio_bytes
+        )
         
-        print(f"[Flask API] Transcription complete: {len(transcription)} characters")
+        print(f"[Flask API] Transcription complete: {len(transcription)} characters{' (shared)' if shared else ''}")
         
         return jsonify({
             'transcription': transcription,
@@ -139,11 +108,6 @@ def transcribe():
     except Exception as e:
         print(f"[Flask API] Error during transcription: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.unlink(temp_filename)
 
 @app.route('/analyse', methods=['POST'])
 def analyse():
@@ -167,22 +131,43 @@ def analyse():
         print(f"[Flask API - Analyse] Transcription length: {len(transcription)} characters")
         print(f"[Flask API - Analyse] Template length: {len(template)} characters")
         
-        # Return streaming response
-        return Response(
-            stream_analysis(transcription, template),
-            mimetype='text/plain',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type',
-            }
+        # Build the prompt (static prefix first, transcript trimmed to budget)
+        prompt = build_report_prompt(transcription, template)
+        
+        # Run the LLM call in the background; the response reads from its replay buffer.
+        # An identical request already in flight is joined instead of starting a new call.
+        stream = analysis_streams.start(
+            stream_analysis(prompt), key=content_key('analyse', transcription, template)
         )
+        print(f"[Flask API - Analyse] Streaming as {stream.id}")
+        
+        return sse_response(stream, headers={
+            'Access-Control-Expose-Headers': 'X-Prompt-Tokens, X-Stream-Id',
+            'X-Prompt-Tokens': str(prompt.total_tokens),
+            'X-Stream-Id': stream.id,
+        })
     
     except Exception as e:
         print(f"[Flask API - Analyse] Error during analysis: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/analyse/stream/<stream_id>', methods=['GET'])
+def resume_analysis(stream_id):
+    """
+    Resume an analysis stream after a dropped connection. The position comes
+    from the Last-Event-ID header (sent automatically by EventSource) or the
+    last_event_id query parameter.
+    """
+    stream = analysis_streams.get(stream_id)
+    if stream is None:
+        return jsonify({'error': 'Stream not found or expired'}), 404
+    
+    last_event_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    )
+    print(f"[Flask API - Analyse] Resuming {stream_id} after event {last_event_id}")
+    return sse_response(stream, last_event_id)
+
 #===================#
 # Main Entry Point
 #===================#